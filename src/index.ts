@@ -8,6 +8,7 @@ import { components } from "./components";
 import { spawn } from "child_process";
 // import "./ROS/roboeROS`"
 import wsClient from "./websocket/websocketClient"
+import updateEvents from "./services/updateEvents.service";
 
 const isDevelopment = process.env.NODE_ENV !== "production";
 const fileExtension = isDevelopment ? "ts" : "js";
@@ -77,6 +78,9 @@ app.listen(PORT, () => {
     pythonProcess.on('close', (code) => {
       console.error(`Python script exited with code ${code?.toString}`);
     });
+
+    // structured session status, reconnects until the update server listens
+    updateEvents.start();
   } catch (err) {
     console.error(`Error while starting update service`);
   }
@@ -0,0 +1,79 @@
+import express, { Request, Response, Router } from "express";
+import updateEvents from "../services/updateEvents.service";
+
+const router: Router = express.Router();
+
+/**
+ * @swagger
+ * tags:
+ *   name: UpdateStatus
+ *   description: Status of the update server sessions
+ */
+
+/**
+ * @swagger
+ * components:
+ *   schemas:
+ *     UpdateSessionStatusDto:
+ *       type: object
+ *       required:
+ *        - session
+ *        - active
+ *        - updatedAt
+ *       properties:
+ *         session:
+ *           type: string
+ *         peer:
+ *           type: string
+ *         active:
+ *           type: boolean
+ *         phase:
+ *           type: string
+ *           description: upload, verify, sync, build, install, log_export, log_query or log_follow
+ *         filename:
+ *           type: string
+ *         received:
+ *           type: integer
+ *         total:
+ *           type: integer
+ *         percent:
+ *           type: integer
+ *         step:
+ *           type: string
+ *         error:
+ *           type: string
+ *         result:
+ *           type: object
+ *           properties:
+ *             operation:
+ *               type: string
+ *             success:
+ *               type: boolean
+ *             message:
+ *               type: string
+ *         updatedAt:
+ *           type: number
+ */
+
+// Get the running and recently finished update sessions
+/**
+ * @swagger
+ * /update-status:
+ *   get:
+ *     summary: Retrieve the status of the update sessions
+ *     tags: [UpdateStatus]
+ *     responses:
+ *       200:
+ *         description: The running and recently finished sessions.
+ *         content:
+ *           application/json:
+ *             schema:
+ *               type: array
+ *               items:
+ *                 $ref: '#/components/schemas/UpdateSessionStatusDto'
+ */
+router.get("/update-status", (req: Request, res: Response) => {
+  res.json(updateEvents.status());
+});
+
+module.exports = router;
@@ -0,0 +1,165 @@
+import { EventEmitter } from "events";
+import net from "net";
+import os from "os";
+import path from "path";
+
+// update_server.py is started with its default port (FS_UPDATE_PORT)
+const FS_UPDATE_PORT = 12342;
+const RECONNECT_DELAY = 2000;
+const MAX_FINISHED_SESSIONS = 20;
+
+export interface UpdateEvent {
+  seq: number;
+  time: number;
+  type: string;
+  session: string | null;
+  [field: string]: unknown;
+}
+
+export interface UpdateSessionStatus {
+  session: string;
+  peer?: string;
+  active: boolean;
+  phase?: string;
+  filename?: string;
+  received?: number;
+  total?: number;
+  percent?: number;
+  step?: string;
+  error?: string;
+  result?: { operation: string; success: boolean; message: string };
+  updatedAt: number;
+}
+
+// Subscribes to the status events of update_server.py (update_events.py)
+class UpdateEventClient extends EventEmitter {
+  private socket: net.Socket | null = null;
+  private buffer: string = "";
+  private lastSeq: number = 0;
+  private stopped: boolean = true;
+  private sessions = new Map<string, UpdateSessionStatus>();
+
+  constructor(private socketPath: string) {
+    super();
+  }
+
+  start() {
+    if (!this.stopped) {
+      return;
+    }
+    this.stopped = false;
+    this.connect();
+  }
+
+  stop() {
+    this.stopped = true;
+    this.socket?.destroy();
+  }
+
+  status(): UpdateSessionStatus[] {
+    return Array.from(this.sessions.values());
+  }
+
+  private connect() {
+    this.buffer = "";
+    const socket = net.createConnection(this.socketPath, () => {
+      // events after lastSeq are replayed, all of them after a server restart
+      socket.write(JSON.stringify({ since: this.lastSeq }) + "\n");
+    });
+    socket.setEncoding("utf8");
+    socket.on("data", (chunk: string) => this.onData(chunk));
+    socket.on("error", () => {
+      // the server is not running yet, "close" follows
+    });
+    socket.on("close", () => {
+      this.socket = null;
+      if (!this.stopped) {
+        setTimeout(() => this.connect(), RECONNECT_DELAY);
+      }
+    });
+    this.socket = socket;
+  }
+
+  private onData(chunk: string) {
+    this.buffer += chunk;
+    let newline = this.buffer.indexOf("\n");
+    while (newline >= 0) {
+      const line = this.buffer.slice(0, newline);
+      this.buffer = this.buffer.slice(newline + 1);
+      newline = this.buffer.indexOf("\n");
+      try {
+        const batch = JSON.parse(line) as { events: UpdateEvent[]; dropped: number };
+        if (batch.dropped) {
+          console.error(`Update events dropped: ${batch.dropped}`);
+        }
+        for (const event of batch.events) {
+          this.lastSeq = event.seq;
+          this.apply(event);
+          this.emit("event", event);
+        }
+      } catch (err) {
+        console.error("Error parsing update event", err);
+      }
+    }
+  }
+
+  private apply(event: UpdateEvent) {
+    if (!event.session) {
+      return;
+    }
+    let status = this.sessions.get(event.session);
+    if (!status) {
+      status = { session: event.session, active: true, updatedAt: event.time };
+      this.sessions.set(event.session, status);
+    }
+    status.updatedAt = event.time;
+
+    switch (event.type) {
+      case "session_started":
+        status.peer = event.peer as string;
+        break;
+      case "phase":
+        status.phase = event.phase as string;
+        status.filename = (event.filename as string) ?? status.filename;
+        status.total = (event.size as number) ?? status.total;
+        break;
+      case "bytes":
+        status.received = event.received as number;
+        status.total = event.total as number;
+        break;
+      case "progress":
+        status.percent = event.percent as number;
+        break;
+      case "step":
+        status.step = event.message as string;
+        break;
+      case "failed":
+        status.error = event.message as string;
+        break;
+      case "result":
+        status.result = {
+          operation: event.operation as string,
+          success: event.success as boolean,
+          message: event.message as string,
+        };
+        break;
+      case "session_ended":
+        status.active = false;
+        this.pruneFinished();
+        break;
+    }
+  }
+
+  private pruneFinished() {
+    const finished = this.status().filter((status) => !status.active);
+    const excess = finished.length - MAX_FINISHED_SESSIONS;
+    for (const status of finished.slice(0, Math.max(excess, 0))) {
+      this.sessions.delete(status.session);
+    }
+  }
+}
+
+const updateEvents = new UpdateEventClient(
+  path.join(os.homedir(), ".cache/morow_update", `events_${FS_UPDATE_PORT}.sock`)
+);
+export default updateEvents;
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+PREWARM_WORKSPACE = "~/catkin_ws_prewarm"
+LIVE_WORKSPACE = "~/catkin_ws"
+BUILD_CACHE_DIRECTORY = "~/.cache/morow_update/ccache"
+BUILD_CACHE_SIZE = "5G"
+
+CATKIN_BUILD_ARGS = "-DCMAKE_BUILD_TYPE=Release"
+CACHE_CMAKE_ARGS = (
+    "-DCMAKE_C_COMPILER_LAUNCHER=ccache -DCMAKE_CXX_COMPILER_LAUNCHER=ccache"
+)
+
+# ccache -s of ccache 3.x
+CACHE_HIT_PATTERN = re.compile(r"cache hit \((?:direct|preprocessed)\)\s+(\d+)")
+CACHE_MISS_PATTERN = re.compile(r"cache miss\s+(\d+)")
+
+
+def cache_environment(cache_directory=BUILD_CACHE_DIRECTORY):
+    # paths below $HOME are hashed relative to the build directory,
+    # so the prewarm and the live workspace share their cache entries
+    return {
+        "CCACHE_DIR": os.path.expanduser(cache_directory),
+        "CCACHE_BASEDIR": os.path.expanduser("~"),
+        "CCACHE_NOHASHDIR": "1",
+        "CCACHE_MAXSIZE": BUILD_CACHE_SIZE,
+    }
+
+
+def format_environment(env):
+    return " ".join(f"{key}={value}" for key, value in env.items())
+
+
+def read_cache_stats(cache_directory=BUILD_CACHE_DIRECTORY):
+    # returns (hits, misses), None without ccache
+    if shutil.which("ccache") is None:
+        return None
+    env = dict(os.environ, **cache_environment(cache_directory))
+    result = subprocess.run(
+        ["ccache", "--print-stats"], capture_output=True, text=True, env=env
+    )
+    if result.returncode == 0:
+        stats = {}
+        for line in result.stdout.splitlines():
+            key, _, value = line.partition("\t")
+            if value.strip().isdigit():
+                stats[key] = int(value)
+        return (
+            stats.get("direct_cache_hit", 0) + stats.get("preprocessed_cache_hit", 0),
+            stats.get("cache_miss", 0),
+        )
+
+    result = subprocess.run(["ccache", "-s"], capture_output=True, text=True, env=env)
+    misses = CACHE_MISS_PATTERN.search(result.stdout)
+    return (
+        sum(int(v) for v in CACHE_HIT_PATTERN.findall(result.stdout)),
+        int(misses.group(1)) if misses else 0,
+    )
+
+
+def format_hit_rate(before, after):
+    if before is None or after is None:
+        return "n/a"
+    hits, misses = after[0] - before[0], after[1] - before[1]
+    if hits + misses <= 0:
+        return "n/a"
+    return f"{hits * 100 / (hits + misses):.1f}% ({hits}/{hits + misses})"
+
+
+class BuildPrewarm:
+    # builds a new version next to the running one to fill the compiler cache
+    # and to reject versions that do not build. catkin devel spaces hold
+    # absolute paths, so the result is not moved: the live build after the
+    # switch still runs, served from the shared cache
+
+    def __init__(
+        self,
+        source_path,
+        workspace=PREWARM_WORKSPACE,
+        live_workspace=LIVE_WORKSPACE,
+        cache_directory=BUILD_CACHE_DIRECTORY,
+    ):
+        self.source_path = source_path
+        self.workspace = os.path.expanduser(workspace)
+        self.live_workspace = os.path.expanduser(live_workspace)
+        self.cache_directory = os.path.expanduser(cache_directory)
+
+    @staticmethod
+    def is_available():
+        return shutil.which("ccache") is not None and shutil.which("catkin") is not None
+
+    def prepare(self):
+        # the build directories are kept, only the sources are replaced.
+        # hard links: the new version is moved into the live workspace later
+        source_directory = os.path.join(self.workspace, "src")
+        shutil.rmtree(source_directory, ignore_errors=True)
+        try:
+            shutil.copytree(
+                self.source_path, source_directory, symlinks=True, copy_function=os.link
+            )
+        except (OSError, shutil.Error):
+            shutil.rmtree(source_directory, ignore_errors=True)
+            shutil.copytree(self.source_path, source_directory, symlinks=True)
+
+        # same catkin profile as the live workspace
+        config_directory = os.path.join(self.workspace, ".catkin_tools")
+        live_config_directory = os.path.join(self.live_workspace, ".catkin_tools")
+        if not os.path.isdir(config_directory) and os.path.isdir(
+            live_config_directory
+        ):
+            shutil.copytree(live_config_directory, config_directory)
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    def build_command(self):
+        script = (
+            f"cd {self.workspace} && (test -d .catkin_tools || catkin init) "
+            f"&& source /opt/ros/noetic/setup.bash "
+            f"&& {format_environment(cache_environment(self.cache_directory))} "
+            f"catkin build --no-status {CATKIN_BUILD_ARGS} {CACHE_CMAKE_ARGS}"
+        )
+        return f"/bin/bash -c {shlex.quote(script)}"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Build Cache Prewarm")
+    parser.add_argument("source_path", type=str)
+    parser.add_argument("--workspace", type=str, default=PREWARM_WORKSPACE)
+    opts = parser.parse_args(argv)
+
+    build = BuildPrewarm(opts.source_path, workspace=opts.workspace)
+    build.prepare()
+    before = read_cache_stats(build.cache_directory)
+    started = time.monotonic()
+    result = subprocess.run(build.build_command(), shell=True)
+    after = read_cache_stats(build.cache_directory)
+    print(
+        f"prewarm build {time.monotonic() - started:.1f}s, "
+        f"cache hit {format_hit_rate(before, after)}"
+    )
+    return result.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
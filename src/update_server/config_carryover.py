@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_manifest import hash_file
+
+# robot specific files of the running version that survive an MR update,
+# relative to the workspace src tree. "**/" matches any directory depth.
+MR_CARRYOVER = [
+    "integration/morow/launch/morow.launch",
+    "integration/morow/morow/assets/morowConfig.yaml",
+    "integration/morow/morow/assets/serial_number",
+    "integration/morow/morow/assets/**/platform.yaml",
+]
+CARRYOVER_INDEX_PATH = "~/.cache/morow_update/carryover_index.json"
+CARRYOVER_INDEX_FORMAT = 1
+
+
+def split_pattern(pattern):
+    # "a/b/**/c.yaml" -> ("a/b", "**/c.yaml"), ("a/b/c", "") without globs
+    parts = pattern.split("/")
+    for i, part in enumerate(parts):
+        if any(c in part for c in "*?["):
+            return "/".join(parts[:i]), "/".join(parts[i:])
+    return pattern, ""
+
+
+def match_pattern(rel, glob):
+    if glob.startswith("**/"):
+        glob = glob[3:]
+        return fnmatch.fnmatch(rel, glob) or fnmatch.fnmatch(rel, "*/" + glob)
+    return fnmatch.fnmatch(rel, glob) and rel.count("/") == glob.count("/")
+
+
+class CarryOverIndex:
+    # where the files of a glob live, valid as long as no directory below its
+    # base changed (new or removed entries change the directory mtime)
+
+    def __init__(self, path=CARRYOVER_INDEX_PATH):
+        self.path = os.path.expanduser(path)
+        self.patterns = {}
+        self.hits = 0
+        self.scans = 0
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index.get("format") == CARRYOVER_INDEX_FORMAT:
+                self.patterns = index["patterns"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def _is_valid(root, entry):
+        for rel, mtime in entry["directories"].items():
+            try:
+                if os.stat(os.path.join(root, rel)).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _scan(self, root, base, glob):
+        directories = {}
+        files = []
+        base_path = os.path.join(root, base)
+        if not os.path.isdir(base_path):
+            # never valid, looked for again once the directory exists
+            return {"directories": {base: None}, "files": []}
+        for directory, dirs, names in os.walk(base_path):
+            directories[os.path.relpath(directory, root)] = os.stat(
+                directory
+            ).st_mtime_ns
+            for name in names:
+                rel = os.path.relpath(os.path.join(directory, name), base_path)
+                if match_pattern(rel, glob):
+                    files.append(os.path.join(base, rel))
+        return {"directories": directories, "files": sorted(files)}
+
+    def locate(self, root, pattern):
+        # rel paths below root matching pattern
+        base, glob = split_pattern(pattern)
+        if not glob:
+            return [pattern] if os.path.isfile(os.path.join(root, pattern)) else []
+        entry = self.patterns.get(pattern)
+        if entry is not None and self._is_valid(root, entry):
+            self.hits += 1
+            return entry["files"]
+        self.scans += 1
+        entry = self.patterns[pattern] = self._scan(root, base, glob)
+        return entry["files"]
+
+    def refresh(self, root, patterns):
+        # index of the tree that is the running version after the update
+        for pattern in patterns:
+            base, glob = split_pattern(pattern)
+            if glob:
+                self.patterns[pattern] = self._scan(root, base, glob)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = self.path + ".partial"
+        with open(partial, "w") as f:
+            json.dump(
+                {"format": CARRYOVER_INDEX_FORMAT, "patterns": self.patterns}, f
+            )
+        os.replace(partial, self.path)
+
+
+class ConfigCarryOver:
+    # copies the carried over files of the running tree into the new one,
+    # unchanged files are skipped so a repeated run copies nothing
+
+    def __init__(
+        self,
+        old_root,
+        new_root,
+        patterns=MR_CARRYOVER,
+        index_path=CARRYOVER_INDEX_PATH,
+        workers=None,
+    ):
+        self.old_root = old_root
+        self.new_root = new_root
+        self.patterns = patterns
+        self.index = CarryOverIndex(index_path)
+        self.workers = workers or os.cpu_count() or 1
+
+    def _carry(self, rel):
+        # "copied", "unchanged" or "skipped" (directory not in the new version)
+        old_path = os.path.join(self.old_root, rel)
+        new_path = os.path.join(self.new_root, rel)
+        if not os.path.isdir(os.path.dirname(new_path)):
+            return "skipped"
+        if (
+            os.path.isfile(new_path)
+            and os.path.getsize(new_path) == os.path.getsize(old_path)
+            and hash_file(new_path) == hash_file(old_path)
+        ):
+            return "unchanged"
+        # replaced at once, an interrupted run leaves the file as it was
+        partial = new_path + ".carryover"
+        shutil.copy2(old_path, partial)
+        os.replace(partial, new_path)
+        return "copied"
+
+    def apply(self):
+        report = {"copied": [], "unchanged": 0, "skipped": [], "missing": []}
+        files = []
+        for pattern in self.patterns:
+            located = self.index.locate(self.old_root, pattern)
+            if not located:
+                report["missing"].append(pattern)
+            files += [rel for rel in located if rel not in files]
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            for rel, result in zip(files, executor.map(self._carry, files)):
+                if result == "unchanged":
+                    report["unchanged"] += 1
+                else:
+                    report[result].append(rel)
+
+        report["index_hits"] = self.index.hits
+        report["index_scans"] = self.index.scans
+        self.index.refresh(self.new_root, self.patterns)
+        try:
+            self.index.save()
+        except OSError:
+            pass  # only the next update is slower
+        return report
+
+
+def format_report(report):
+    lines = [
+        f"carried over {len(report['copied'])} files, "
+        f"{report['unchanged']} unchanged "
+        f"(index: {report['index_hits']} hits, {report['index_scans']} scans)"
+    ]
+    lines += [f"copied {rel}" for rel in report["copied"]]
+    lines += [f"skipped {rel} (not in the new version)" for rel in report["skipped"]]
+    lines += [f"missing {pattern}" for pattern in report["missing"]]
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MR Update Config Carry-over")
+    parser.add_argument("old_root", type=str, help="src tree of the running version")
+    parser.add_argument("new_root", type=str, help="src tree of the new version")
+    parser.add_argument("--index", type=str, default=CARRYOVER_INDEX_PATH)
+    opts = parser.parse_args(argv)
+
+    carry_over = ConfigCarryOver(opts.old_root, opts.new_root, index_path=opts.index)
+    print(format_report(carry_over.apply()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+# sqlite databases of robot-api (jobs, pallets), relative to the FS tree
+ROBOT_API_DATA = "ui/robot-api/prisma/data"
+DB_SNAPSHOT_DIRECTORY = "fs_db_snapshot"
+SNAPSHOT_STATE_NAME = "CARRYOVER.json"
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_SIDE_FILES = ["-wal", "-shm", "-journal"]
+# one step: a stepped backup restarts whenever robot-api commits in between.
+# wal databases stay writable meanwhile, rollback journal ones wait for the copy
+BACKUP_PAGES = -1
+BACKUP_SLEEP = 0.05  # seconds before retrying a busy step
+BUSY_TIMEOUT = 10
+
+
+def is_database(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def file_state(path):
+    # (size, mtime_ns) of a database and its wal, changes with every commit
+    state = []
+    for suffix in ["", "-wal"]:
+        try:
+            st = os.stat(path + suffix)
+            state.append([st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            state.append(None)
+    return state
+
+
+def backup_database(source, destination):
+    # sqlite online backup: a consistent copy while other connections write,
+    # the destination is only replaced by a complete copy
+    partial = destination + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    source_connection = sqlite3.connect(source, timeout=BUSY_TIMEOUT)
+    try:
+        destination_connection = sqlite3.connect(partial)
+        try:
+            source_connection.backup(
+                destination_connection, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP
+            )
+        finally:
+            destination_connection.close()
+    finally:
+        source_connection.close()
+    os.replace(partial, destination)
+
+
+def check_database(path):
+    # [] if PRAGMA integrity_check is ok, the reported problems otherwise
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    errors = [row[0] for row in rows]
+    return [] if errors == ["ok"] else errors
+
+
+class DatabaseCarryOver:
+    # robot-api data of the running version for the new one: snapshot()
+    # while the API is serving, activate() after it was shut down
+
+    def __init__(self, snapshot_directory):
+        self.snapshot_directory = snapshot_directory
+        self.state_path = os.path.join(snapshot_directory, SNAPSHOT_STATE_NAME)
+
+    def snapshot(self, data_directory):
+        shutil.rmtree(self.snapshot_directory, ignore_errors=True)
+        os.makedirs(self.snapshot_directory)
+        databases = {}
+        for name in sorted(os.listdir(data_directory)):
+            source = os.path.join(data_directory, name)
+            if not os.path.isfile(source) or not is_database(source):
+                continue
+            # recorded before the copy, a later commit makes it stale
+            state = file_state(source)
+            destination = os.path.join(self.snapshot_directory, name)
+            backup_database(source, destination)
+            errors = check_database(destination)
+            if errors:
+                raise Exception(f"{name}: integrity check failed: {errors[0]}")
+            databases[name] = state
+
+        with open(self.state_path, "w") as f:
+            json.dump({"databases": databases}, f)
+        return {
+            "snapshot": sorted(databases),
+            "refreshed": [],
+            "refresh_time": 0.0,
+            "copied": [],
+        }
+
+    def activate(self, source_directory, target_directory):
+        # source: data of the stopped version, target: data of the new tree
+        with open(self.state_path) as f:
+            databases = json.load(f)["databases"]
+        report = {
+            "snapshot": sorted(databases),
+            "refreshed": [],
+            "refresh_time": 0.0,
+            "copied": [],
+        }
+
+        started = time.monotonic()
+        for name, state in databases.items():
+            source = os.path.join(source_directory, name)
+            snapshot = os.path.join(self.snapshot_directory, name)
+            if os.path.exists(source) and file_state(source) != state:
+                # written after the snapshot, copied again now that the API is
+                # stopped: this copy is part of the downtime
+                backup_database(source, snapshot)
+                errors = check_database(snapshot)
+                if errors:
+                    raise Exception(f"{name}: integrity check failed: {errors[0]}")
+                report["refreshed"].append(name)
+        report["refresh_time"] = time.monotonic() - started
+
+        os.makedirs(target_directory, exist_ok=True)
+        for name in databases:
+            target = os.path.join(target_directory, name)
+            # a stale wal or journal would be applied to the snapshot
+            for suffix in SQLITE_SIDE_FILES:
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+            try:
+                os.replace(os.path.join(self.snapshot_directory, name), target)
+            except OSError:
+                shutil.copy2(os.path.join(self.snapshot_directory, name), target)
+
+        # other files of the data directory are copied as before
+        side_files = {
+            name + suffix for name in databases for suffix in SQLITE_SIDE_FILES
+        }
+        for name in sorted(os.listdir(source_directory)):
+            if name in databases or name in side_files:
+                continue
+            source = os.path.join(source_directory, name)
+            if os.path.isdir(source):
+                shutil.copytree(
+                    source, os.path.join(target_directory, name), dirs_exist_ok=True
+                )
+            else:
+                shutil.copy2(source, os.path.join(target_directory, name))
+            report["copied"].append(name)
+        return report
+
+
+def format_report(report):
+    lines = [f"database snapshot: {', '.join(report['snapshot']) or 'none'}"]
+    if report["refreshed"]:
+        lines.append(
+            f"written after the snapshot, copied again during the downtime "
+            f"({report['refresh_time']:.1f}s): {', '.join(report['refreshed'])}"
+        )
+    if report["copied"]:
+        lines.append(f"copied: {', '.join(report['copied'])}")
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="robot-api Database Carry-over")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = subparsers.add_parser("snapshot")
+    snapshot_parser.add_argument("data_directory", type=str)
+    snapshot_parser.add_argument("snapshot_directory", type=str)
+    activate_parser = subparsers.add_parser("activate")
+    activate_parser.add_argument("snapshot_directory", type=str)
+    activate_parser.add_argument("source_directory", type=str)
+    activate_parser.add_argument("target_directory", type=str)
+    opts = parser.parse_args(argv)
+
+    carry_over = DatabaseCarryOver(opts.snapshot_directory)
+    try:
+        if opts.command == "snapshot":
+            report = carry_over.snapshot(opts.data_directory)
+        else:
+            report = carry_over.activate(opts.source_directory, opts.target_directory)
+    except Exception as e:
+        print(e)
+        return 1
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_manifest import hash_file
+
+# runtime data of the live tree, never touched by the sync
+FS_PRESERVED = ["ui/robot-api/prisma/data"]
+# kept as they are unless the lockfiles / sources of their project changed
+DEPENDENCY_DIRECTORIES = ["node_modules"]
+BUILD_DIRECTORIES = [".next", "dist", "build"]
+LOCKFILES = ["package.json", "pnpm-lock.yaml", "yarn.lock", "package-lock.json"]
+# changes that need catkin build (morrow_msg)
+CATKIN_PATTERNS = ["CMakeLists.txt", "package.xml", "*.msg", "*.srv", "*.action"]
+
+
+def scan_tree(root, prune=(), skip=()):
+    # rel path -> (size, mtime_ns, symlink target) of files and symlinks.
+    # directories named in prune and rel paths in skip are not entered.
+    files = {}
+    if not os.path.isdir(root):
+        return files
+    for directory, dirs, names in os.walk(root):
+        rel_directory = os.path.relpath(directory, root)
+        rel_directory = "" if rel_directory == "." else rel_directory
+        for name in list(dirs):
+            rel = os.path.join(rel_directory, name)
+            path = os.path.join(directory, name)
+            if name in prune or rel in skip:
+                dirs.remove(name)
+            elif os.path.islink(path):
+                dirs.remove(name)
+                names.append(name)
+        for name in names:
+            path = os.path.join(directory, name)
+            st = os.lstat(path)
+            target = os.readlink(path) if os.path.islink(path) else None
+            files[os.path.join(rel_directory, name)] = (
+                st.st_size,
+                st.st_mtime_ns,
+                target,
+            )
+    return files
+
+
+def _is_under(rel, directory):
+    return directory == "" or rel == directory or rel.startswith(directory + "/")
+
+
+class FsSyncPlan:
+
+    def __init__(self):
+        self.copy = []  # rel paths to copy from the new tree
+        self.delete = []  # rel paths to remove from the live tree
+        self.unchanged = 0
+        self.kept = []  # subtrees left as they are, with the reason
+        self.catkin_changed = False
+
+    def report(self):
+        return {
+            "copied": len(self.copy),
+            "deleted": len(self.delete),
+            "unchanged": self.unchanged,
+            "kept": self.kept,
+            "catkin_changed": self.catkin_changed,
+        }
+
+
+class FsSync:
+    # incremental replacement of the live UI tree by a decrypted FS package,
+    # replaced and removed files are moved into the backup directory
+
+    def __init__(self, new_root, live_root, backup_root, workers=None):
+        self.new_root = new_root
+        self.live_root = live_root
+        self.backup_root = backup_root
+        self.workers = workers or os.cpu_count() or 1
+        self.copied_bytes = 0
+        # changes to the live tree in order, undone if apply() fails:
+        # ("directory", path), ("created", path), ("backup", live, backup)
+        self.journal = []
+        self.journal_lock = threading.Lock()
+
+    def _record(self, *entry):
+        with self.journal_lock:
+            self.journal.append(entry)
+
+    def _makedirs(self, path):
+        missing = []
+        while path and not os.path.isdir(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for directory in reversed(missing):
+            os.makedirs(directory, exist_ok=True)
+            self._record("directory", directory)
+
+    def _is_changed(self, rel, new, live):
+        if live is None:
+            return True
+        if new[2] is not None or live[2] is not None:
+            return new[2] != live[2]
+        if new[0] != live[0]:
+            return True
+        if new[1] == live[1]:
+            return False
+        return hash_file(os.path.join(self.new_root, rel)) != hash_file(
+            os.path.join(self.live_root, rel)
+        )
+
+    def _diff(self, plan, new_files, live_files, preserved=()):
+        with ThreadPoolExecutor(self.workers) as executor:
+            changed = executor.map(
+                lambda rel: self._is_changed(rel, new_files[rel], live_files.get(rel)),
+                new_files,
+            )
+            for rel, is_changed in zip(list(new_files), changed):
+                if is_changed:
+                    plan.copy.append(rel)
+                else:
+                    plan.unchanged += 1
+        for rel in live_files:
+            if rel not in new_files and not any(
+                _is_under(rel, directory) for directory in preserved
+            ):
+                plan.delete.append(rel)
+
+    def plan(self):
+        plan = FsSyncPlan()
+        prune = DEPENDENCY_DIRECTORIES + BUILD_DIRECTORIES
+        # preserved data shipped in a package must not replace the live one
+        new_files = scan_tree(self.new_root, prune, FS_PRESERVED)
+        live_files = scan_tree(self.live_root, prune, FS_PRESERVED)
+        self._diff(plan, new_files, live_files, FS_PRESERVED)
+
+        changed = set(plan.copy) | set(plan.delete)
+        plan.catkin_changed = any(
+            fnmatch.fnmatch(os.path.basename(rel), pattern)
+            for rel in changed
+            for pattern in CATKIN_PATTERNS
+        )
+
+        # node_modules and build outputs of every node project in the package
+        projects = [
+            os.path.dirname(rel)
+            for rel in new_files
+            if os.path.basename(rel) == "package.json"
+        ]
+        for project in projects:
+            lock_changed = any(
+                os.path.join(project, lockfile) in changed for lockfile in LOCKFILES
+            )
+            source_changed = any(_is_under(rel, project) for rel in changed)
+            for name in DEPENDENCY_DIRECTORIES + BUILD_DIRECTORIES:
+                directory = os.path.join(project, name)
+                if not os.path.isdir(os.path.join(self.new_root, directory)):
+                    continue
+                if name in DEPENDENCY_DIRECTORIES and not lock_changed:
+                    plan.kept.append(f"{directory} (lockfiles unchanged)")
+                    continue
+                if name in BUILD_DIRECTORIES and not source_changed:
+                    plan.kept.append(f"{directory} (sources unchanged)")
+                    continue
+                new_path = os.path.join(self.new_root, directory)
+                live_path = os.path.join(self.live_root, directory)
+                self._diff(
+                    plan,
+                    self._prefix(directory, scan_tree(new_path)),
+                    self._prefix(directory, scan_tree(live_path)),
+                )
+        return plan
+
+    @staticmethod
+    def _prefix(directory, files):
+        return {os.path.join(directory, rel): value for rel, value in files.items()}
+
+    def _backup(self, rel):
+        live_path = os.path.join(self.live_root, rel)
+        if not os.path.lexists(live_path):
+            return
+        backup_path = os.path.join(self.backup_root, rel)
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        os.replace(live_path, backup_path)
+        self._record("backup", live_path, backup_path)
+
+    def _copy(self, rel):
+        new_path = os.path.join(self.new_root, rel)
+        live_path = os.path.join(self.live_root, rel)
+        self._makedirs(os.path.dirname(live_path))
+        self._backup(rel)
+        if os.path.islink(new_path):
+            os.symlink(os.readlink(new_path), live_path)
+            self._record("created", live_path)
+            return 0
+        # move when possible, the decrypted tree is removed after the update
+        try:
+            try:
+                os.replace(new_path, live_path)
+            except OSError:
+                shutil.copy2(new_path, live_path)
+        finally:
+            if os.path.lexists(live_path):
+                self._record("created", live_path)
+        return os.lstat(live_path).st_size
+
+    def rollback(self):
+        # live tree as it was before apply(), the UI is down at this point
+        with self.journal_lock:
+            journal, self.journal = self.journal, []
+        directories = []
+        for entry in reversed(journal):
+            if entry[0] == "created":
+                if os.path.lexists(entry[1]):
+                    os.remove(entry[1])
+            elif entry[0] == "backup":
+                os.replace(entry[2], entry[1])
+            else:
+                directories.append(entry[1])
+        # deepest first, entries of other threads may precede their directory
+        for directory in sorted(directories, key=len, reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def apply(self, plan):
+        os.makedirs(self.backup_root, exist_ok=True)
+        self.journal = []
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                self.copied_bytes = sum(executor.map(self._copy, plan.copy))
+                list(executor.map(self._backup, plan.delete))
+        except BaseException:
+            self.rollback()
+            raise
+        self.journal = []
+        report = plan.report()
+        report["copied_bytes"] = self.copied_bytes
+        return report
+
+
+def format_report(report):
+    lines = [
+        f"copied {report['copied']} files ({report['copied_bytes']} bytes), "
+        f"deleted {report['deleted']}, unchanged {report['unchanged']}",
+    ]
+    lines += [f"kept {kept}" for kept in report["kept"]]
+    if not report["catkin_changed"]:
+        lines.append("catkin build skipped (no message or package changes)")
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="FS Update Sync")
+    parser.add_argument("new_root", type=str)
+    parser.add_argument("live_root", type=str)
+    parser.add_argument("backup_root", type=str)
+    parser.add_argument("--dry-run", action="store_true")
+    opts = parser.parse_args(argv)
+
+    sync = FsSync(opts.new_root, opts.live_root, opts.backup_root)
+    plan = sync.plan()
+    if opts.dry_run:
+        print(json.dumps(plan.report(), indent=1))
+        return 0
+    print(format_report(sync.apply(plan)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -15,14 +15,20 @@ update() {
     local SCRIPT_DIR="$(dirname "$(realpath "$0")")"
     local DECRYPTED_SRC_UI_PATH="$SCRIPT_DIR/$NEW_VERSION_PATH"
 
-    run_ui_shutdown
+    if [[ "$FS_SYNC" == "server" ]]; then
+        # the update server already shut down the UI and synced the changed files
+        log_message "UI tree synced by the update server."
+        run_docker_commands "/home/roboe_fullstack/catkin_ws/src"
+    else
+        run_ui_shutdown
 
-    if [[ $? -ne 0 ]]; then
-        log_message "Failed to run 'ui_shutdown.sh'."
-        return 1
-    fi
+        if [[ $? -ne 0 ]]; then
+            log_message "Failed to run 'ui_shutdown.sh'."
+            return 1
+        fi
 
-    handle_backup_and_copy "$DECRYPTED_SRC_UI_PATH"
+        handle_backup_and_copy "$DECRYPTED_SRC_UI_PATH"
+    fi
 
     # Final step: Remove the decrypted_src folder and decrypted tar file
     cd /home/roboe_fullstack/catkin_ws/
@@ -99,6 +105,17 @@ copy_robot_api_data() {
     local BACKUP_DIR="$1"
     local ORIGINAL_FS="$2"
 
+    if [[ -n "$FS_DB_SNAPSHOT" ]]; then
+        # the update server took an online snapshot while robot-api was running
+        log_message "Activating database snapshot '$FS_DB_SNAPSHOT'..."
+        if python3 "$ORIGINAL_FS/ui/robot-api/src/update_server/db_carryover.py" activate "$FS_DB_SNAPSHOT" "$BACKUP_DIR/ui/robot-api/prisma/data" "$ORIGINAL_FS/ui/robot-api/prisma/data"; then
+            log_message "Database snapshot activated."
+            run_docker_commands "$DOCKER_DEST_PATH"
+            return
+        fi
+        log_message "Failed to activate the database snapshot, copying files instead."
+    fi
+
     log_message "Copying files from '$BACKUP_DIR/ui/robot-api/prisma/data' to '$ORIGINAL_FS/ui/robot-api/prisma/data'..."
     cp -r "$BACKUP_DIR/ui/robot-api/prisma/data/"* "$ORIGINAL_FS/ui/robot-api/prisma/data/"
 
@@ -115,8 +132,12 @@ copy_robot_api_data() {
 run_docker_commands() {
     local DOCKER_DEST_PATH="$1"
 
-    log_message "Do catkin build (cb) for morrow_msg..."
-    cd ~/catkin_ws && catkin build --save-config --cmake-args -DCMAKE_BUILD_TYPE=Release
+    if [[ "$FS_CATKIN_BUILD" == "no" ]]; then
+        log_message "Skip catkin build, morrow_msg is unchanged."
+    else
+        log_message "Do catkin build (cb) for morrow_msg..."
+        cd ~/catkin_ws && catkin build --save-config --cmake-args -DCMAKE_BUILD_TYPE=Release
+    fi
 
     log_message "Changing directory to '$DOCKER_DEST_PATH/ui/robot-api' & update db"
     cd "$DOCKER_DEST_PATH/ui/robot-api" || return 1
@@ -195,7 +216,9 @@ if [ "$1" == "update" ]; then
     fi
 
     update "$2" "$BUILD"
+elif [ "$1" == "shutdown" ]; then
+    run_ui_shutdown
 else
-    log_message "Usage: $0 update decrypted_dir [build | no]"
+    log_message "Usage: $0 update decrypted_dir [build | no] | shutdown"
     exit 1
 fi
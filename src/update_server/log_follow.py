@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+import time
+from collections import deque
+
+from log_query import is_log_file
+
+FOLLOW_POLL_INTERVAL = 1.0  # seconds, also the rescan interval with inotify
+FOLLOW_BATCH_INTERVAL = 0.2  # seconds to collect lines before sending
+FOLLOW_BATCH_SIZE = (1024 * 64) - 8
+FOLLOW_QUEUE_SIZE = 1024 * 1024 * 4  # bytes buffered per subscriber
+FOLLOW_READ_SIZE = 1024 * 1024
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _inotify_init(directory):
+    # returns an inotify fd watching the directory, None if not available
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (AttributeError, OSError, TypeError):
+        return None
+
+
+class _FollowedFile:
+    # read position of one file, survives rotation and truncation
+
+    def __init__(self, path, from_end=True):
+        self.path = path
+        self.f = None
+        self.inode = None
+        self.remainder = b""  # incomplete last line
+        self._open(from_end)
+
+    def _open(self, from_end=False):
+        try:
+            self.f = open(self.path, "rb")
+        except OSError:
+            self.f, self.inode = None, None
+            return
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        if from_end:
+            self.f.seek(0, os.SEEK_END)
+
+    def _read(self):
+        data = bytearray()
+        while True:
+            chunk = self.f.read(FOLLOW_READ_SIZE)
+            if not chunk:
+                return bytes(data)
+            data.extend(chunk)
+
+    def read_lines(self, known_inodes=()):
+        data = b""
+        if self.f is None:
+            self._open()
+        if self.f is None:
+            return []
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+
+        if st is not None and st.st_ino != self.inode:
+            # rotated: drain the old file, then continue with the new one.
+            # a file renamed onto this name was already read under its old name
+            data = self._read()
+            self.f.close()
+            self._open(from_end=st.st_ino in known_inodes)
+            if self.f is not None:
+                data += self._read()
+        else:
+            if st is not None and st.st_size < self.f.tell():
+                # truncated (copytruncate rotation)
+                self.f.seek(0)
+            data = self._read()
+
+        data = self.remainder + data
+        lines = data.split(b"\n")
+        self.remainder = lines.pop()
+        return [line + b"\n" for line in lines]
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class LogSubscriber:
+    # bounded line buffer, the oldest lines are dropped when a client is too slow
+
+    def __init__(self, names=None, max_bytes=FOLLOW_QUEUE_SIZE):
+        self.names = set(names or [])  # empty: every log file
+        self.max_bytes = max_bytes
+        self.lines = deque()  # (name, line)
+        self.size = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def wants(self, name):
+        return not self.names or name in self.names
+
+    def put(self, name, lines):
+        with self.condition:
+            for line in lines:
+                self.lines.append((name, line))
+                self.size += len(line)
+            while self.size > self.max_bytes:
+                _, line = self.lines.popleft()
+                self.size -= len(line)
+                self.dropped += 1
+            self.condition.notify_all()
+
+    def get_batch(self, timeout=FOLLOW_BATCH_INTERVAL, max_bytes=FOLLOW_BATCH_SIZE):
+        # returns ([(name, data)], dropped), lines of a file are grouped together
+        with self.condition:
+            if not self.lines:
+                self.condition.wait(timeout)
+            batch, size = [], 0
+            while self.lines and size + len(self.lines[0][1]) <= max_bytes:
+                name, line = self.lines.popleft()
+                self.size -= len(line)
+                size += len(line)
+                if batch and batch[-1][0] == name:
+                    batch[-1][1].extend(line)
+                else:
+                    batch.append((name, bytearray(line)))
+            if not batch and self.lines:
+                # a single line longer than a packet
+                name, line = self.lines.popleft()
+                self.size -= len(line)
+                batch.append((name, bytearray(line[:max_bytes])))
+            dropped, self.dropped = self.dropped, 0
+        return [(name, bytes(data)) for name, data in batch], dropped
+
+
+class LogWatcher:
+    # one thread per log directory, shared by all of its subscribers
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.subscribers = []
+        self.files = {}  # name -> _FollowedFile
+        self.scanned = False
+        self.inodes = set()  # every file already followed, under any name
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.inotify_fd = _inotify_init(directory)
+        # poll instead of select.select, which fails for fds above FD_SETSIZE
+        self.poller = None
+        if self.inotify_fd is not None:
+            self.poller = select.poll()
+            self.poller.register(self.inotify_fd, select.POLLIN)
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, subscriber):
+        with self.lock:
+            self.subscribers.append(subscriber)
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            return len(self.subscribers)
+
+    def _scan(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                names = [
+                    entry.name
+                    for entry in entries
+                    if entry.is_file()
+                    and is_log_file(entry.name)
+                    and not entry.name.endswith(".gz")
+                ]
+        except OSError:
+            return
+
+        for name in names:
+            if name not in self.files:
+                # files created after the watcher started are read from the top,
+                # renamed (rotated) files were already read under their old name
+                path = os.path.join(self.directory, name)
+                try:
+                    inode = os.stat(path).st_ino
+                except OSError:
+                    continue
+                self.files[name] = _FollowedFile(
+                    path, from_end=not self.scanned or inode in self.inodes
+                )
+        self.scanned = True
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for name, followed in self.files.items():
+            lines = followed.read_lines(self.inodes)
+            self.inodes.add(followed.inode)
+            if not lines:
+                continue
+            for subscriber in subscribers:
+                if subscriber.wants(name):
+                    subscriber.put(name, lines)
+
+    def _wait(self):
+        if self.inotify_fd is None:
+            self.stop_event.wait(FOLLOW_POLL_INTERVAL)
+            return
+        if self.poller.poll(FOLLOW_POLL_INTERVAL * 1000):
+            try:
+                # the events only wake us up, the files are checked by _scan
+                while os.read(self.inotify_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            # let the writer finish the burst before reading
+            time.sleep(FOLLOW_BATCH_INTERVAL / 4)
+
+    def _run(self):
+        self._scan()
+        while not self.stop_event.is_set():
+            self._wait()
+            self._scan()
+
+        for followed in self.files.values():
+            followed.close()
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class LogWatcherHub:
+
+    def __init__(self):
+        self.watchers = {}  # directory -> LogWatcher
+        self.lock = threading.Lock()
+
+    def subscribe(self, directory, names=None):
+        subscriber = LogSubscriber(names)
+        with self.lock:
+            watcher = self.watchers.get(directory)
+            if watcher is None:
+                watcher = self.watchers[directory] = LogWatcher(directory)
+            watcher.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, directory, subscriber):
+        with self.lock:
+            watcher = self.watchers.get(directory)
+            if watcher is not None and watcher.remove(subscriber) == 0:
+                watcher.stop()
+                del self.watchers[directory]
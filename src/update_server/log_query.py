@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import re
+import time
+import zlib
+
+LOG_ROOT_DIRECTORY = "~/shared/Logs/morow"
+
+QUERY_BATCH_SIZE = (1024 * 64) - 8  # one MDAT packet worth of lines
+
+# "2024-10-23 12:34:56", "[2024-10-23T12:34:56.123]", ...
+LINE_TIME_PATTERN = re.compile(
+    rb"^\W{0,2}(\d{4})[-/](\d{2})[-/](\d{2})[ T_](\d{2}):(\d{2}):(\d{2})"
+)
+
+
+def get_log_directory(log_type):
+    # log types are plain directory names below the log root
+    if not log_type or log_type in (".", "..") or "/" in log_type:
+        return None
+    return os.path.join(os.path.expanduser(LOG_ROOT_DIRECTORY), log_type)
+
+
+def is_log_file(name):
+    # eventlog.log, eventlog.log.1, eventlog.log.2.gz, eventlog_241023.log
+    return name.endswith(".log") or ".log." in name
+
+
+def parse_line_time(line):
+    match = LINE_TIME_PATTERN.match(line)
+    if not match:
+        return None
+    try:
+        return time.mktime(tuple(int(v) for v in match.groups()) + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+class LogQuery:
+
+    def __init__(
+        self,
+        log_type,
+        since=None,
+        until=None,
+        pattern="",
+        regex=False,
+        ignore_case=False,
+        compress=False,
+    ):
+        self.log_type = log_type
+        self.since = since  # epoch seconds, None = open
+        self.until = until
+        self.pattern = pattern
+        self.regex = regex
+        self.ignore_case = ignore_case
+        self.compress = compress
+
+        self.matcher = None
+        if pattern and regex:
+            flags = re.IGNORECASE if ignore_case else 0
+            self.matcher = re.compile(pattern.encode("utf-8"), flags).search
+        elif pattern:
+            needle = pattern.encode("utf-8")
+            if ignore_case:
+                needle = needle.lower()
+                self.matcher = lambda line: needle in line.lower()
+            else:
+                self.matcher = lambda line: needle in line
+
+    def dumps(self):
+        return json.dumps(
+            {
+                "type": self.log_type,
+                "since": self.since,
+                "until": self.until,
+                "pattern": self.pattern,
+                "regex": self.regex,
+                "ignore_case": self.ignore_case,
+                "compress": self.compress,
+            }
+        ).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data):
+        query = json.loads(data)
+        return cls(
+            query["type"],
+            query.get("since"),
+            query.get("until"),
+            query.get("pattern", ""),
+            query.get("regex", False),
+            query.get("ignore_case", False),
+            query.get("compress", False),
+        )
+
+    def in_window(self, timestamp):
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.until is not None and timestamp > self.until:
+            return False
+        return True
+
+    def select_files(self, directory):
+        # rotated files cover [mtime of the previous file, own mtime],
+        # files outside the window are skipped without being opened
+        with os.scandir(directory) as entries:
+            files = [
+                (entry.stat().st_mtime, entry)
+                for entry in entries
+                if entry.is_file() and is_log_file(entry.name)
+            ]
+        files.sort(key=lambda item: item[0])
+
+        selected, skipped = [], []
+        start = None
+        for mtime, entry in files:
+            if (self.since is not None and mtime < self.since) or (
+                self.until is not None and start is not None and start > self.until
+            ):
+                skipped.append(entry)
+            else:
+                selected.append(entry)
+            start = mtime
+        return selected, skipped
+
+    def match_lines(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        timestamp = None
+        check_time = self.since is not None or self.until is not None
+        with opener(path, "rb") as f:
+            for line in f:
+                if check_time:
+                    # continuation lines belong to the last timestamped line
+                    timestamp = parse_line_time(line) or timestamp
+                    if timestamp is not None and not self.in_window(timestamp):
+                        if self.until is not None and timestamp > self.until:
+                            break
+                        continue
+                if self.matcher is None or self.matcher(line):
+                    yield line
+
+    def batches(self, path):
+        # matching lines of a file grouped into packets
+        batch = bytearray()
+        for line in self.match_lines(path):
+            if batch and len(batch) + len(line) > QUERY_BATCH_SIZE:
+                yield bytes(batch)
+                batch = bytearray()
+            batch.extend(line[:QUERY_BATCH_SIZE])
+        if batch:
+            yield bytes(batch)
+
+
+class LogCompressor:
+    # one deflate stream per query, flushed per packet so it can be read as it arrives
+
+    def __init__(self, enabled):
+        self.compressor = zlib.compressobj() if enabled else None
+
+    def compress(self, data):
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
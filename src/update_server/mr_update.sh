@@ -86,8 +86,15 @@ install_morow_packages() {
 build_morow_catkin() {
     log_message "building morow..."
 
+    local CMAKE_ARGS="-DCMAKE_BUILD_TYPE=Release"
+    # compiler cache prewarmed by the update server (CCACHE_* env)
+    if [ "$MOROW_BUILD_CACHE" == "ccache" ] && command -v ccache > /dev/null; then
+        log_message "Using compiler cache $CCACHE_DIR"
+        CMAKE_ARGS="$CMAKE_ARGS -DCMAKE_C_COMPILER_LAUNCHER=ccache -DCMAKE_CXX_COMPILER_LAUNCHER=ccache"
+    fi
+
     cd ~/catkin_ws && catkin clean -y
-    cd ~/catkin_ws && catkin build -DCMAKE_BUILD_TYPE=Release
+    cd ~/catkin_ws && catkin build $CMAKE_ARGS
     source /opt/ros/noetic/setup.bash
     source ~/catkin_ws/devel/setup.bash
 
@@ -95,11 +102,16 @@ build_morow_catkin() {
 }
 
 build_once() {
-    # extra 패키지 추가
-    install_extra_packages
+    # update server installs python packages itself (package_installer.py)
+    if [ "$MOROW_PIP_INSTALL" == "server" ]; then
+        log_message "Python packages are installed by the update server."
+    else
+        # extra 패키지 추가
+        install_extra_packages
 
-    # morow 패키지 추가
-    install_morow_packages
+        # morow 패키지 추가
+        install_morow_packages
+    fi
 
     # morow catkin 빌드
     build_morow_catkin
@@ -123,11 +135,16 @@ update() {
         sync
 
         # 설정 파일 복사
-        log_message "copying files..."
-        cp "$OLD_VERSION_PATH/integration/morow/launch/morow.launch" src/integration/morow/launch/morow.launch
-        cp "$OLD_VERSION_PATH/integration/morow/morow/assets/morowConfig.yaml" src/integration/morow/morow/assets/morowConfig.yaml
-        cp "$OLD_VERSION_PATH/integration/morow/morow/assets/serial_number" src/integration/morow/morow/assets/serial_number
-        copy_recursive "$OLD_VERSION_PATH/integration/morow/morow/assets" "src/integration/morow/morow/assets/" "platform.yaml"
+        # update server carries them over itself (config_carryover.py, MR_CARRYOVER)
+        if [ "$MOROW_CARRYOVER" == "server" ]; then
+            log_message "Config files are carried over by the update server."
+        else
+            log_message "copying files..."
+            cp "$OLD_VERSION_PATH/integration/morow/launch/morow.launch" src/integration/morow/launch/morow.launch
+            cp "$OLD_VERSION_PATH/integration/morow/morow/assets/morowConfig.yaml" src/integration/morow/morow/assets/morowConfig.yaml
+            cp "$OLD_VERSION_PATH/integration/morow/morow/assets/serial_number" src/integration/morow/morow/assets/serial_number
+            copy_recursive "$OLD_VERSION_PATH/integration/morow/morow/assets" "src/integration/morow/morow/assets/" "platform.yaml"
+        fi
         sync
         sync
 
@@ -155,7 +172,11 @@ if [ "$1" == "update" ]; then
     fi
     update "$2" "$BUILD"
 
+elif [ "$1" == "build" ]; then
+    # MOROW_PIP_INSTALL=server: "update decrypted_dir no", packages, then build
+    build_once
+
 else
-    log_message "Usage: $0 update decrypted_dir [build | no]"
+    log_message "Usage: $0 update decrypted_dir [build | no] | build"
     exit 1
 fi
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_manifest import hash_file
+
+INSTALL_WORKSPACE = "~/catkin_ws/src"
+INSTALL_STATE_PATH = "~/.cache/morow_update/install_state.json"
+INSTALL_CACHE_DIRECTORY = "~/.cache/morow_update/pip"
+WHEELHOUSE_NAME = "wheels"  # dependencies downloaded ahead, below the cache
+
+# same packages as install_extra_packages / install_morow_packages in mr_update.sh
+EXTRA_PACKAGES_DIRECTORY = "utils/packages"
+MOROW_PACKAGES = [
+    "roboesim",
+    "roboe-pm",
+    "utils/robotics/robotics_lib",
+]
+# editable installs only have to run again when their metadata changes
+EDITABLE_METADATA = ["setup.py", "setup.cfg", "pyproject.toml", "requirements.txt"]
+
+
+class InstallTask:
+
+    def __init__(self, name, args, digest):
+        self.name = name
+        self.args = args  # pip install arguments
+        self.digest = digest
+        self.output = ""
+
+    def requirement(self):
+        # the path without -e, for pip download
+        return self.args[-1]
+
+
+def _editable_digest(path):
+    sha256 = hashlib.sha256(os.path.realpath(path).encode())
+    for name in EDITABLE_METADATA:
+        metadata_path = os.path.join(path, name)
+        if os.path.exists(metadata_path):
+            sha256.update(name.encode())
+            sha256.update(hash_file(metadata_path).encode())
+    return sha256.hexdigest()
+
+
+class PackageInstaller:
+
+    def __init__(
+        self,
+        workspace=INSTALL_WORKSPACE,
+        state_path=INSTALL_STATE_PATH,
+        cache_directory=INSTALL_CACHE_DIRECTORY,
+        workers=4,
+        pip="pip",
+    ):
+        self.workspace = os.path.expanduser(workspace)
+        self.state_path = os.path.expanduser(state_path)
+        self.cache_directory = os.path.expanduser(cache_directory)
+        self.wheelhouse = os.path.join(self.cache_directory, WHEELHOUSE_NAME)
+        self.workers = workers
+        self.pip = pip
+        self.state = {}  # task name -> digest of the installed version
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temp_path, self.state_path)
+
+    def collect_wheels(self):
+        directory = os.path.join(self.workspace, EXTRA_PACKAGES_DIRECTORY)
+        if not os.path.isdir(directory):
+            return []
+        with os.scandir(directory) as entries:
+            wheels = [
+                entry
+                for entry in sorted(entries, key=lambda e: e.name)
+                if entry.is_file() and entry.name.endswith(".whl")
+            ]
+        with ThreadPoolExecutor(max(1, self.workers)) as executor:
+            digests = executor.map(lambda entry: hash_file(entry.path), wheels)
+            return [
+                InstallTask(entry.name, [entry.path], digest)
+                for entry, digest in zip(wheels, digests)
+            ]
+
+    def collect_editables(self):
+        packages = [
+            (package, os.path.join(self.workspace, package))
+            for package in MOROW_PACKAGES
+            if os.path.isdir(os.path.join(self.workspace, package))
+        ]
+        with ThreadPoolExecutor(max(1, self.workers)) as executor:
+            digests = executor.map(lambda item: _editable_digest(item[1]), packages)
+            return [
+                InstallTask(package, ["-e", path], digest)
+                for (package, path), digest in zip(packages, digests)
+            ]
+
+    def _download(self, task):
+        # only fills the wheelhouse, a failure leaves the download to pip install
+        subprocess.run(
+            [
+                self.pip,
+                "download",
+                "--cache-dir",
+                self.cache_directory,
+                "--dest",
+                self.wheelhouse,
+                task.requirement(),
+            ],
+            capture_output=True,
+        )
+
+    def _install(self, task):
+        result = subprocess.run(
+            [
+                self.pip,
+                "install",
+                "--cache-dir",
+                self.cache_directory,
+                "--find-links",
+                self.wheelhouse,
+            ]
+            + task.args,
+            capture_output=True,
+            text=True,
+        )
+        task.output = result.stdout + result.stderr
+        return result.returncode == 0
+
+    def _install_group(self, tasks, report):
+        pending = []
+        for task in tasks:
+            if self.state.get(task.name) == task.digest:
+                report["skipped"].append(task.name)
+            else:
+                pending.append(task)
+
+        # downloads run in parallel, pip install is not safe to run concurrently
+        # in one environment (shared dependencies are uninstalled and reinstalled)
+        with ThreadPoolExecutor(max(1, self.workers)) as executor:
+            list(executor.map(self._download, pending))
+        for task in pending:
+            if self._install(task):
+                self.state[task.name] = task.digest
+                report["installed"].append(task.name)
+            else:
+                self.state.pop(task.name, None)
+                report["failed"].append(task.name)
+                report["log"] += f"\n\n====== {task.name} ======\n\n{task.output}"
+
+    def run(self):
+        # wheels first, the editable packages may depend on them
+        report = {"installed": [], "skipped": [], "failed": [], "log": ""}
+        self.load_state()
+        os.makedirs(self.wheelhouse, exist_ok=True)
+        self._install_group(self.collect_wheels(), report)
+        self._install_group(self.collect_editables(), report)
+        self.save_state()
+        return report
+
+
+def format_report(report):
+    return (
+        f"installed {len(report['installed'])}: {', '.join(report['installed'])}\n"
+        f"skipped {len(report['skipped'])}: {', '.join(report['skipped'])}\n"
+        f"failed {len(report['failed'])}: {', '.join(report['failed'])}"
+    )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Package Installer")
+    parser.add_argument("--workspace", type=str, default=INSTALL_WORKSPACE)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pip", type=str, default="pip")
+    opts = parser.parse_args(argv)
+
+    report = PackageInstaller(opts.workspace, workers=opts.workers, pip=opts.pip).run()
+    print(report["log"])
+    print(format_report(report))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config_carryover import MR_CARRYOVER, ConfigCarryOver
+
+ASSETS = "integration/morow/morow/assets"
+
+
+def write(root, rel, content):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def read(root, rel):
+    with open(os.path.join(root, rel)) as f:
+        return f.read()
+
+
+class ConfigCarryOverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.old_root = self.make_tree("old", "robot")
+        write(self.old_root, "integration/morow/launch/morow.launch", "robot")
+        write(self.old_root, f"{ASSETS}/serial_number", "SN-1")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_tree(self, name, content):
+        root = os.path.join(self.directory, name)
+        write(root, f"{ASSETS}/morowConfig.yaml", content)
+        write(root, f"{ASSETS}/platform_a/platform.yaml", content)
+        write(root, f"{ASSETS}/deep/platform_b/platform.yaml", content)
+        write(root, "integration/morow/launch/morow.launch", content)
+        return root
+
+    def carry_over(self, old_root, new_root):
+        return ConfigCarryOver(old_root, new_root, index_path=self.index_path).apply()
+
+    def test_files_are_carried_over(self):
+        new_root = self.make_tree("new", "package")
+        report = self.carry_over(self.old_root, new_root)
+        self.assertEqual(report["missing"], [])
+        self.assertEqual(len(report["copied"]), 5)
+        self.assertEqual(read(new_root, f"{ASSETS}/serial_number"), "SN-1")
+        self.assertEqual(
+            read(new_root, f"{ASSETS}/deep/platform_b/platform.yaml"), "robot"
+        )
+
+        # a repeated run finds everything in place
+        report = self.carry_over(self.old_root, new_root)
+        self.assertEqual((report["copied"], report["unchanged"]), ([], 5))
+
+    def test_index_is_reused_until_the_tree_changes(self):
+        globs = sum("*" in pattern for pattern in MR_CARRYOVER)
+        report = self.carry_over(self.old_root, self.make_tree("new", "package"))
+        self.assertEqual((report["index_hits"], report["index_scans"]), (0, globs))
+
+        # the new tree was indexed as the running version of the next update
+        next_root = self.make_tree("next", "package")
+        report = self.carry_over(os.path.join(self.directory, "new"), next_root)
+        self.assertEqual((report["index_hits"], report["index_scans"]), (globs, 0))
+        self.assertEqual(report["missing"], [])
+        self.assertEqual(len(report["copied"]), 5)
+
+        # a new directory below the glob base invalidates the entry
+        write(next_root, f"{ASSETS}/platform_c/platform.yaml", "robot")
+        report = self.carry_over(next_root, self.make_tree("last", "package"))
+        self.assertEqual((report["index_hits"], report["index_scans"]), (0, globs))
+        self.assertIn(f"{ASSETS}/platform_c/platform.yaml", report["skipped"])
+
+
+if __name__ == "__main__":
+    unittest.main()
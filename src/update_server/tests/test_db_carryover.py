@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_carryover import DatabaseCarryOver, format_report
+
+
+def insert(path, name):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("INSERT INTO jobs (name) VALUES (?)", (name,))
+    connection.close()
+
+
+def names(path):
+    connection = sqlite3.connect(path)
+    rows = connection.execute("SELECT name FROM jobs ORDER BY id").fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+
+class DatabaseCarryOverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "backup", "data")
+        self.target = os.path.join(self.directory, "src", "data")
+        os.makedirs(self.source)
+        os.makedirs(self.target)
+        self.database = os.path.join(self.source, "dev.db")
+        connection = sqlite3.connect(self.database)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.close()
+        insert(self.database, "before")
+        with open(os.path.join(self.source, "uploads.txt"), "w") as f:
+            f.write("kept")
+        # packaged database and a stale wal of the new tree
+        for name in ["dev.db", "dev.db-wal"]:
+            with open(os.path.join(self.target, name), "w") as f:
+                f.write("packaged")
+        self.carry_over = DatabaseCarryOver(os.path.join(self.directory, "snapshot"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_snapshot_is_activated_without_copy(self):
+        self.assertEqual(self.carry_over.snapshot(self.source)["snapshot"], ["dev.db"])
+
+        report = self.carry_over.activate(self.source, self.target)
+        self.assertEqual(report["refreshed"], [])
+        self.assertEqual(report["copied"], ["uploads.txt"])
+        self.assertEqual(names(os.path.join(self.target, "dev.db")), ["before"])
+        self.assertFalse(os.path.exists(os.path.join(self.target, "dev.db-wal")))
+
+    def test_write_after_snapshot_is_copied_again(self):
+        self.carry_over.snapshot(self.source)
+        insert(self.database, "after")
+
+        report = self.carry_over.activate(self.source, self.target)
+        self.assertEqual(report["refreshed"], ["dev.db"])
+        self.assertIn("copied again during the downtime", format_report(report))
+        self.assertEqual(
+            names(os.path.join(self.target, "dev.db")), ["before", "after"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
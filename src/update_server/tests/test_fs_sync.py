@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fs_sync import FsSync, scan_tree
+
+DATABASE = "ui/robot-api/prisma/data/dev.db"
+
+
+def write(root, rel, content):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def read(root, rel):
+    with open(os.path.join(root, rel)) as f:
+        return f.read()
+
+
+def snapshot(root):
+    return {rel: read(root, rel) for rel in scan_tree(root)}
+
+
+class FsSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.new_root = os.path.join(self.directory, "new")
+        self.live_root = os.path.join(self.directory, "live")
+        self.backup_root = os.path.join(self.directory, "backup")
+        write(self.live_root, DATABASE, "live jobs")
+        write(self.live_root, "ui/robot-web/index.js", "old web")
+        write(self.live_root, "ui/robot-web/removed.js", "removed")
+        write(self.live_root, "ui/robot-api/main.js", "old api")
+        write(self.new_root, DATABASE, "packaged jobs")
+        write(self.new_root, "ui/robot-web/index.js", "new web")
+        write(self.new_root, "ui/robot-api/main.js", "new api")
+        write(self.new_root, "ui/robot-api/routes/added.js", "added")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_preserved_data_is_not_replaced(self):
+        sync = FsSync(self.new_root, self.live_root, self.backup_root)
+        plan = sync.plan()
+        self.assertNotIn(DATABASE, plan.copy)
+        self.assertNotIn(DATABASE, plan.delete)
+
+        sync.apply(plan)
+        self.assertEqual(read(self.live_root, DATABASE), "live jobs")
+        self.assertEqual(read(self.live_root, "ui/robot-web/index.js"), "new web")
+        self.assertEqual(read(self.live_root, "ui/robot-api/routes/added.js"), "added")
+        self.assertFalse(
+            os.path.exists(os.path.join(self.live_root, "ui/robot-web/removed.js"))
+        )
+
+    def test_failed_apply_restores_live_tree(self):
+        before = snapshot(self.live_root)
+
+        class FailingSync(FsSync):
+            def _copy(self, rel):
+                if rel == "ui/robot-api/main.js":
+                    raise OSError("disk full")
+                return FsSync._copy(self, rel)
+
+        sync = FailingSync(self.new_root, self.live_root, self.backup_root)
+        with self.assertRaises(OSError):
+            sync.apply(sync.plan())
+        self.assertEqual(snapshot(self.live_root), before)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.live_root, "ui/robot-api/routes"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
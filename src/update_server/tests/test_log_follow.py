@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from log_follow import LogSubscriber, _FollowedFile
+
+
+class FollowedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "eventlog.log")
+        self.append(b"old line\n")
+        self.followed = _FollowedFile(self.path)
+
+    def tearDown(self):
+        self.followed.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def append(self, data, path=None):
+        with open(path or self.path, "ab") as f:
+            f.write(data)
+
+    def test_starts_at_the_end_and_keeps_partial_lines(self):
+        self.assertEqual(self.followed.read_lines(), [])
+        self.append(b"one\ntw")
+        self.assertEqual(self.followed.read_lines(), [b"one\n"])
+        self.append(b"o\n")
+        self.assertEqual(self.followed.read_lines(), [b"two\n"])
+
+    def test_rename_rotation(self):
+        self.append(b"before\n")
+        os.rename(self.path, self.path + ".1")
+        self.append(b"after\n")
+        self.assertEqual(self.followed.read_lines(), [b"before\n", b"after\n"])
+        self.append(b"more\n")
+        self.assertEqual(self.followed.read_lines(), [b"more\n"])
+
+    def test_renamed_onto_a_followed_name(self):
+        # eventlog.log.1 -> eventlog.log was already read under its old name
+        other = self.path + ".1"
+        self.append(b"seen\n", other)
+        inode = os.stat(other).st_ino
+        os.rename(other, self.path)
+        self.assertEqual(self.followed.read_lines(known_inodes={inode}), [])
+
+    def test_copytruncate_rotation(self):
+        self.append(b"before\n")
+        self.assertEqual(self.followed.read_lines(), [b"before\n"])
+        with open(self.path, "wb") as f:
+            f.write(b"new\n")
+        self.assertEqual(self.followed.read_lines(), [b"new\n"])
+
+    def test_missing_file(self):
+        os.remove(self.path)
+        self.followed.close()
+        self.followed = _FollowedFile(self.path)
+        self.assertEqual(self.followed.read_lines(), [])
+        self.append(b"created\n")
+        self.assertEqual(self.followed.read_lines(), [b"created\n"])
+
+
+class LogSubscriberTest(unittest.TestCase):
+
+    def test_slow_client_drops_oldest_lines(self):
+        subscriber = LogSubscriber(max_bytes=10)
+        subscriber.put("a.log", [b"1234\n", b"5678\n", b"90ab\n"])
+        subscriber.put("b.log", [b"c\n"])
+        batch, dropped = subscriber.get_batch(timeout=0)
+        self.assertEqual(dropped, 2)
+        self.assertEqual(batch, [("a.log", b"90ab\n"), ("b.log", b"c\n")])
+
+    def test_batches_are_limited(self):
+        subscriber = LogSubscriber(names=["a.log"])
+        self.assertFalse(subscriber.wants("b.log"))
+        subscriber.put("a.log", [b"x" * 20 + b"\n", b"y\n"])
+        self.assertEqual(
+            subscriber.get_batch(timeout=0, max_bytes=8), ([("a.log", b"x" * 8)], 0)
+        )
+        self.assertEqual(
+            subscriber.get_batch(timeout=0, max_bytes=8), ([("a.log", b"y\n")], 0)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from log_query import LogQuery, parse_line_time
+
+LINES = [
+    b"2024-10-23 12:00:00 start\n",
+    b"2024-10-23 12:01:00 error: motor\n",
+    b"  at joint 2\n",  # continuation of the error
+    b"2024-10-23 12:02:00 Error: gripper\n",
+    b"2024-10-23 12:03:00 stop\n",
+]
+
+
+def at(clock):
+    return parse_line_time(f"2024-10-23 {clock}".encode())
+
+
+class LogQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, name, lines, mtime=None):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wb") as f:
+            f.writelines(lines)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def selected(self, since=None, until=None):
+        # rotated files, each covers the time since the previous one
+        for name, mtime in [
+            ("eventlog.log.3.gz", 100),
+            ("eventlog.log.2", 200),
+            ("eventlog.log.1", 300),
+            ("eventlog.log", 400),
+            ("notes.txt", 250),
+        ]:
+            self.write(name, [], mtime)
+        selected, skipped = LogQuery("eventlog", since, until).select_files(
+            self.directory
+        )
+        return [entry.name for entry in selected], len(skipped)
+
+    def test_files_outside_the_window_are_skipped(self):
+        self.assertEqual(
+            self.selected(since=250, until=320),
+            (["eventlog.log.1", "eventlog.log"], 2),
+        )
+        self.assertEqual(
+            self.selected(until=150), (["eventlog.log.3.gz", "eventlog.log.2"], 2)
+        )
+        self.assertEqual(self.selected()[1], 0)
+
+    def test_lines_in_the_window(self):
+        path = self.write("eventlog.log", LINES)
+        query = LogQuery("eventlog", since=at("12:01:00"), until=at("12:02:00"))
+        self.assertEqual(list(query.match_lines(path)), LINES[1:4])
+
+    def test_pattern_with_continuation_lines(self):
+        path = self.write("eventlog.log.1.gz", LINES)
+        query = LogQuery("eventlog", since=at("12:00:30"), pattern="joint")
+        self.assertEqual(list(query.match_lines(path)), [LINES[2]])
+
+        query = LogQuery("eventlog", pattern="^.{20}error", regex=True)
+        self.assertEqual(list(query.match_lines(path)), [LINES[1]])
+        query.__init__("eventlog", pattern="ERROR", ignore_case=True)
+        self.assertEqual(list(query.match_lines(path)), [LINES[1], LINES[3]])
+
+    def test_query_round_trip(self):
+        query = LogQuery("eventlog", 1.0, 2.0, "motor", True, True, True)
+        self.assertEqual(LogQuery.loads(query.dumps()).dumps(), query.dumps())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from package_installer import PackageInstaller
+
+# records "install <requirement>" per call, fails for requirements named broken
+FAKE_PIP = """#!{python}
+import sys
+command, requirement = sys.argv[1], sys.argv[-1]
+with open({calls!r}, "a") as f:
+    f.write(command + " " + requirement + "\\n")
+sys.exit(1 if command == "install" and "broken" in requirement else 0)
+"""
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class PackageInstallerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.workspace = os.path.join(self.directory, "src")
+        self.packages = os.path.join(self.workspace, "utils", "packages")
+        self.editable = os.path.join(self.workspace, "roboesim")
+        write(os.path.join(self.packages, "a.whl"), "a 1")
+        write(os.path.join(self.packages, "b.whl"), "b 1")
+        write(os.path.join(self.editable, "setup.py"), "version 1")
+        write(os.path.join(self.editable, "roboesim", "sim.py"), "code 1")
+
+        self.calls = os.path.join(self.directory, "calls.txt")
+        self.pip = os.path.join(self.directory, "pip")
+        write(self.pip, FAKE_PIP.format(python=sys.executable, calls=self.calls))
+        os.chmod(self.pip, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_installer(self):
+        if os.path.exists(self.calls):
+            os.remove(self.calls)
+        installer = PackageInstaller(
+            self.workspace,
+            state_path=os.path.join(self.directory, "state.json"),
+            cache_directory=os.path.join(self.directory, "cache"),
+            pip=self.pip,
+        )
+        report = installer.run()
+        installs = []
+        if os.path.exists(self.calls):
+            with open(self.calls) as f:
+                installs = [
+                    os.path.basename(line.split()[1])
+                    for line in f
+                    if line.startswith("install ")
+                ]
+        return report, installs
+
+    def test_unchanged_packages_are_skipped(self):
+        report, installs = self.run_installer()
+        self.assertEqual(report["installed"], ["a.whl", "b.whl", "roboesim"])
+        self.assertEqual(installs, ["a.whl", "b.whl", "roboesim"])
+
+        report, installs = self.run_installer()
+        self.assertEqual(report["skipped"], ["a.whl", "b.whl", "roboesim"])
+        self.assertEqual(installs, [])
+
+    def test_changed_packages_are_installed_again(self):
+        self.run_installer()
+        write(os.path.join(self.packages, "a.whl"), "a 2")
+        # sources of an editable install are used in place
+        write(os.path.join(self.editable, "roboesim", "sim.py"), "code 2")
+        report, installs = self.run_installer()
+        self.assertEqual(report["installed"], ["a.whl"])
+        self.assertEqual(report["skipped"], ["b.whl", "roboesim"])
+
+        write(os.path.join(self.editable, "setup.py"), "version 2")
+        report, installs = self.run_installer()
+        self.assertEqual(installs, ["roboesim"])
+
+    def test_failed_install_is_retried(self):
+        write(os.path.join(self.packages, "broken.whl"), "broken")
+        report, _ = self.run_installer()
+        self.assertEqual(report["failed"], ["broken.whl"])
+
+        report, installs = self.run_installer()
+        self.assertEqual(installs, ["broken.whl"])
+        self.assertEqual(report["failed"], ["broken.whl"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import update_server
+from update_server import ParallelUpload
+
+
+class ParallelUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.upload = ParallelUpload(os.path.join(self.directory, "package"), 8)
+
+    def tearDown(self):
+        self.upload.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_close_waits_for_running_write(self):
+        writing = threading.Event()
+        release = threading.Event()
+        pwrite = os.pwrite
+
+        def slow_pwrite(fd, data, offset):
+            writing.set()
+            release.wait(5)
+            return pwrite(fd, data, offset)
+
+        with mock.patch.object(update_server.os, "pwrite", slow_pwrite):
+            writer = threading.Thread(target=self.upload.write, args=(0, b"data"))
+            writer.start()
+            self.assertTrue(writing.wait(5))
+            closer = threading.Thread(target=self.upload.close)
+            closer.start()
+            closer.join(0.2)
+            self.assertTrue(closer.is_alive())
+            self.assertIsNotNone(self.upload.fd)
+            release.set()
+            writer.join(5)
+            closer.join(5)
+
+        self.assertIsNone(self.upload.fd)
+        self.assertTrue(self.upload.is_covered(0, 4))
+        with self.assertRaises(ValueError):
+            self.upload.write(4, b"late")
+
+
+if __name__ == "__main__":
+    unittest.main()
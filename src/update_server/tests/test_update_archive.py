@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_archive import UpdateArchive
+from update_manifest import UpdateManifest, verify_tree
+from update_packer import UpdatePacker
+
+PASSWORD = "test-password"
+
+
+class UpdateArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "source")
+        os.makedirs(os.path.join(self.source, "config"))
+        with open(os.path.join(self.source, "version_info.txt"), "w") as f:
+            f.write("software_version: MR1.2.0\n")
+        self.shared = os.path.join(self.source, "config", "shared.yaml")
+        with open(self.shared, "w") as f:
+            f.write("group: writable\n")
+        os.chmod(self.shared, 0o664)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def extract(self):
+        packer = UpdatePacker(
+            self.source, "mr1.2.0_test", password=PASSWORD, package_format=2
+        )
+        package = os.path.join(self.directory, packer.filename)
+        for _ in packer.pack(package):
+            pass
+
+        target = os.path.join(self.directory, "extracted")
+        with UpdateArchive(package, PASSWORD) as archive:
+            archive.extract(target)
+        return target
+
+    def test_group_writable_file_round_trip(self):
+        target = self.extract()
+
+        mode = stat.S_IMODE(os.stat(os.path.join(target, "config/shared.yaml")).st_mode)
+        self.assertEqual(mode, 0o664)
+        manifest = UpdateManifest.load(target, PASSWORD)
+        self.assertEqual(verify_tree(target, manifest), [])
+
+    def test_unlisted_files_are_rejected(self):
+        target = self.extract()
+        with open(os.path.join(target, "config", "injected.py"), "w") as f:
+            f.write("print('not signed')\n")
+        os.makedirs(os.path.join(target, "hooks", "post"))
+        with open(os.path.join(target, "hooks", "post", "run.sh"), "w") as f:
+            f.write("#!/bin/bash\n")
+
+        manifest = UpdateManifest.load(target, PASSWORD)
+        self.assertCountEqual(
+            verify_tree(target, manifest),
+            ["config/injected.py: not in manifest", "hooks: not in manifest"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_client import MuxConnection, MuxUpdateClient, UpdateClient
+from update_util import MUX_CHANNEL_FS, PROTOCOL_ACK, PROTOCOL_LENGTH, PROTOCOL_RATE
+
+
+class RateClient(UpdateClient):
+    # answers RATE like a server without a ceiling
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def _send_packet(self, msg_bytes):
+        self.sent.append(msg_bytes)
+
+    async def _read_packet(self):
+        return PROTOCOL_ACK + self.sent[-1][PROTOCOL_LENGTH:]
+
+
+class ClientTestCase(unittest.TestCase):
+    # clients run their coroutines on the current event loop
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+
+class UpdateClientRateTest(ClientTestCase):
+
+    def send_rate(self, client, upload, download):
+        client.set_rate_limit(upload, download)
+        del client.sent[:]
+        self.loop.run_until_complete(client._async_send_rate())
+        return client.sent
+
+    def test_kept_connection_resets_limits(self):
+        client = RateClient()
+        # a new connection is unlimited, nothing to send
+        self.assertEqual(self.send_rate(client, 0, 0), [])
+
+        self.assertEqual(
+            self.send_rate(client, 1000, 2000), [PROTOCOL_RATE + b"1000,2000,0"]
+        )
+        self.assertEqual(client.upload_bucket.rate, 1000)
+        self.assertEqual(self.send_rate(client, 1000, 2000), [])
+
+        # the next operation on the same connection is unlimited again
+        self.assertEqual(self.send_rate(client, 0, 0), [PROTOCOL_RATE + b"0,0,0"])
+        self.assertEqual(client.upload_bucket.rate, 0)
+        self.assertEqual(client.download_bucket.rate, 0)
+
+
+class UploadClient(UpdateClient):
+    # records what an update sends instead of talking to a server
+
+    def __init__(self):
+        super().__init__()
+        self.connected = True
+        self.uploads = []
+
+    async def _async_authenticate(self):
+        pass
+
+    async def _async_send_info(self):
+        pass
+
+    async def _async_send_file(self, show_progress=False):
+        streamed = self.packer is not None
+        self.uploads.append((self.filename, streamed, self.filesize, self.filepath))
+        if not streamed:
+            self.sent_size = os.path.getsize(self.filepath)
+
+    async def _async_send_bash(self):
+        pass
+
+    async def _async_send_logs(self, save_logs=False):
+        pass
+
+
+class UpdateClientStreamTest(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        with open(os.path.join(self.source, "version_info.txt"), "w") as f:
+            f.write("software_version: MR1.2.0\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.source, ignore_errors=True)
+        super().tearDown()
+
+    def update(self, capabilities):
+        client = UploadClient()
+        client.select_source(self.source, "mr1.2.0_test")
+        client.server_capabilities = capabilities
+        self.assertTrue(self.loop.run_until_complete(client._async_update()))
+        return client
+
+    def test_streams_to_servers_with_capabilities(self):
+        client = self.update({"packages": ["1", "2"], "compression": ["zlib"]})
+        self.assertEqual(
+            client.uploads, [("mr1.2.0_test.enc.mrpk", True, -1, self.source)]
+        )
+
+    def test_packs_first_for_servers_without_capabilities(self):
+        client = self.update({})
+        [(filename, streamed, size, path)] = client.uploads
+        self.assertEqual(filename, "mr1.2.0_test.enc.tar.gz")
+        self.assertFalse(streamed)
+        self.assertEqual(size, client.sent_size)
+        # the temporary package is removed, the source stays selected
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNotNone(client.packer)
+        self.assertEqual((client.filepath, client.filesize), (self.source, -1))
+
+
+class MuxUpdateClientTest(ClientTestCase):
+
+    def test_channel_streams_use_mux_server(self):
+        # parallel upload streams have to reach the server holding the token
+        mux = MuxConnection()
+        mux.host, mux.port, mux.connected = "10.0.0.2", 23456, True
+        client = MuxUpdateClient(mux, MUX_CHANNEL_FS)
+        self.assertTrue(self.loop.run_until_complete(client._async_connect()))
+        self.assertEqual((client.host, client.port), ("10.0.0.2", 23456))
+
+
+if __name__ == "__main__":
+    unittest.main()
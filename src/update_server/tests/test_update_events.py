@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_events import EventHub, EventServer, EventSubscriber
+
+
+class EventHubTest(unittest.TestCase):
+
+    def test_history_keeps_latest_progress_of_a_session(self):
+        hub = EventHub()
+        hub.publish("session_started", 1)
+        hub.publish("progress", 1, percent=10)
+        hub.publish("progress", 2, percent=20)
+        hub.publish("progress", 1, percent=30)
+        events = [(e["type"], e["session"], e.get("percent")) for e in hub.history]
+        self.assertEqual(
+            events,
+            [
+                ("session_started", 1, None),
+                ("progress", 2, 20),
+                ("progress", 1, 30),
+            ],
+        )
+        hub.publish("session_ended", 1)
+        hub.publish("progress", 1, percent=0)
+        self.assertEqual(len(hub.history), 5)
+
+    def test_subscribe_replays_after_since(self):
+        hub = EventHub()
+        for session in range(3):
+            hub.publish("session_started", session)
+        subscriber = hub.subscribe(since=2)
+        self.assertEqual([e["seq"] for e in subscriber.events], [3])
+        # a seq from before a server restart replays everything
+        self.assertEqual(len(hub.subscribe(since=99).events), 3)
+
+        hub.publish("session_ended", 0)
+        hub.unsubscribe(subscriber)
+        self.assertEqual([e["seq"] for e in subscriber.events], [3, 4])
+        self.assertTrue(subscriber.closed)
+        hub.publish("session_ended", 1)
+        self.assertEqual(len(subscriber.events), 2)
+
+
+class EventSubscriberTest(unittest.TestCase):
+
+    def test_slow_subscriber(self):
+        subscriber = EventSubscriber(max_events=3)
+        for seq in range(1, 6):
+            subscriber.put(dict(seq=seq, type="bytes", session=seq % 2))
+        subscriber.put(dict(seq=6, type="log", session=0))
+        subscriber.put(dict(seq=7, type="log", session=0))
+        subscriber.close()
+        batch, dropped = subscriber.get_batch(timeout=0)
+        # bytes events are coalesced per session, then the oldest are dropped
+        self.assertEqual([e["seq"] for e in batch], [5, 6, 7])
+        self.assertEqual(dropped, 1)
+        self.assertEqual(subscriber.pending, {})
+
+
+class EventServerTest(unittest.TestCase):
+
+    def test_subscriber_receives_replay_and_new_events(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        hub = EventHub()
+        hub.publish("session_started", 1)
+        server = EventServer(hub, os.path.join(directory, "events.sock"))
+        server.start()
+        self.addCleanup(server.stop)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(server.socket_path)
+            sock.sendall(b'{"since": 0}\n')
+            with sock.makefile("rb") as f:
+                batch = json.loads(f.readline())
+                self.assertEqual(batch["events"][0]["type"], "session_started")
+                hub.publish("session_ended", 1, result="ok")
+                batch = json.loads(f.readline())
+                self.assertEqual(batch["events"][0]["result"], "ok")
+                self.assertEqual(batch["events"][0]["seq"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
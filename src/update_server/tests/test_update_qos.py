@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import struct
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_qos import (
+    TCP_INFO_RCV_RTT_OFFSET,
+    TCP_INFO_RTT_OFFSET,
+    AdaptiveRate,
+    TokenBucket,
+    get_tcp_rtt,
+)
+
+
+class FakeSocket:
+    # tcp_info with a stale send rtt and a growing receive rtt
+
+    def __init__(self):
+        self.rtt = 1000
+        self.rcv_rtt = 1000
+
+    def getsockopt(self, level, option, length):
+        info = bytearray(length)
+        struct.pack_into("I", info, TCP_INFO_RTT_OFFSET, self.rtt)
+        struct.pack_into("I", info, TCP_INFO_RCV_RTT_OFFSET, self.rcv_rtt)
+        return bytes(info)
+
+
+class AdaptiveRateTest(unittest.TestCase):
+
+    def test_rtt_of_the_direction(self):
+        sock = FakeSocket()
+        sock.rcv_rtt = 5000
+        self.assertEqual(get_tcp_rtt(sock), 0.001)
+        self.assertEqual(get_tcp_rtt(sock, receiving=True), 0.005)
+
+    def test_receiver_backs_off_on_receive_rtt(self):
+        sock = FakeSocket()
+        bucket = TokenBucket(1000000)
+        adaptive = AdaptiveRate(bucket, 1000000, min_rate=1000, receiving=True)
+        adaptive.update(sock)
+        self.assertEqual(bucket.rate, 1000000)
+
+        # the send rtt stays at its last sample, only rcv_rtt shows the queue
+        sock.rcv_rtt = 10000
+        adaptive.timestamp = 0.0
+        adaptive.update(sock)
+        self.assertLess(bucket.rate, 1000000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_server import UpdateServer
+from update_util import (
+    PROTOCOL_ACK,
+    PROTOCOL_AUTH,
+    PROTOCOL_DATA,
+    PROTOCOL_FAIL,
+    PROTOCOL_INFO,
+    PROTOCOL_LENGTH,
+    PROTOCOL_MUXO,
+    PROTOCOL_VERS,
+    encode_auth_token,
+)
+
+
+class UpdateServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = None
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        if self.server is not None:
+            self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def start_server(self, **options):
+        self.server = UpdateServer(
+            "127.0.0.1",
+            0,
+            install_directory=self.directory,
+            script_directory=self.directory,
+            event_socket=None,
+            **options,
+        )
+        self.server.start()
+
+    def connect(self):
+        sock = socket.create_connection(self.server.server_address, timeout=5)
+        self.sockets.append(sock)
+        return sock
+
+    @staticmethod
+    def send(sock, msg_bytes):
+        sock.sendall(struct.pack(">I", len(msg_bytes)) + msg_bytes)
+
+    @staticmethod
+    def receive(sock):
+        # None when the server closed the connection
+        header = sock.recv(4, socket.MSG_WAITALL)
+        if len(header) < 4:
+            return None
+        return sock.recv(struct.unpack(">I", header)[0], socket.MSG_WAITALL)
+
+    def authenticate(self, sock):
+        address, port = sock.getsockname()
+        self.send(sock, PROTOCOL_AUTH + encode_auth_token(address, port).encode())
+        self.assertEqual(self.receive(sock), PROTOCOL_ACK)
+
+    def wait_closed(self, sock, timeout=5):
+        # seconds until the server closed the connection
+        started = time.monotonic()
+        sock.settimeout(timeout)
+        self.assertIsNone(self.receive(sock))
+        return time.monotonic() - started
+
+    def test_mux_requires_authentication(self):
+        self.start_server()
+        sock = self.connect()
+        self.send(sock, PROTOCOL_MUXO)
+        self.assertEqual(
+            self.receive(sock), PROTOCOL_FAIL + b"Authentication required."
+        )
+
+        self.authenticate(sock)
+        self.send(sock, PROTOCOL_MUXO)
+        self.assertEqual(self.receive(sock)[:PROTOCOL_LENGTH], PROTOCOL_ACK)
+
+    def test_oversized_frames_are_refused(self):
+        self.start_server()
+        for command, size in [
+            (PROTOCOL_INFO, 1024 * 1024),  # control message
+            (PROTOCOL_DATA, 1024 * 64 + 1),  # larger than a chunk
+        ]:
+            sock = self.connect()
+            self.authenticate(sock)
+            # only the header is sent, the body is never read
+            sock.sendall(struct.pack(">I", PROTOCOL_LENGTH + size) + command)
+            reply = self.receive(sock)
+            self.assertTrue(reply.startswith(PROTOCOL_FAIL + b"Frame too large."))
+            self.wait_closed(sock)
+
+    def test_largest_data_frame_is_accepted(self):
+        self.start_server()
+        sock = self.connect()
+        self.authenticate(sock)
+        self.send(sock, PROTOCOL_DATA + bytes(1024 * 64 - 8))
+        # no upload was started, the frame itself was read
+        self.assertEqual(
+            self.receive(sock), PROTOCOL_FAIL + b"Info verification failed."
+        )
+
+    def test_unauthenticated_connection_is_reaped(self):
+        self.start_server(auth_timeout=0.3, idle_timeout=30)
+        sock = self.connect()
+        self.assertLess(self.wait_closed(sock), 2)
+
+    def test_idle_session_is_reaped(self):
+        self.start_server(auth_timeout=0.3, idle_timeout=0.8)
+        sock = self.connect()
+        self.authenticate(sock)
+        # authenticated sessions get the idle timeout, frames restart it
+        for _ in range(3):
+            time.sleep(0.4)
+            self.send(sock, PROTOCOL_VERS)
+            self.assertEqual(self.receive(sock)[:PROTOCOL_LENGTH], PROTOCOL_VERS)
+        self.assertGreater(self.wait_closed(sock), 0.6)
+
+    def test_connections_over_the_limit_are_rejected(self):
+        self.start_server(max_connections=1)
+        first = self.connect()
+        self.authenticate(first)
+        second = self.connect()
+        self.assertEqual(self.receive(second), PROTOCOL_FAIL + b"Server busy.")
+        self.wait_closed(second)
+
+        first.close()
+        time.sleep(0.2)
+        third = self.connect()
+        self.authenticate(third)
+
+
+if __name__ == "__main__":
+    unittest.main()
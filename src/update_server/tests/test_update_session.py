@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import update_server
+from update_events import EventHub
+from update_server import MR_UPDATE_PORT, UpdateSession
+from update_util import (
+    PROTOCOL_ACK,
+    PROTOCOL_BASH,
+    PROTOCOL_DATA,
+    PROTOCOL_DCHK,
+    PROTOCOL_FAIL,
+    PROTOCOL_INFO,
+)
+
+VERSION_INFO = b"software_version: MR1.2.0\n"
+
+
+class UpdateSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.install_directory = os.path.join(self.directory, "catkin_ws")
+        script_directory = os.path.join(self.install_directory, "src", "update")
+        os.makedirs(script_directory)
+        for name in ["script.sh", "mr_update.sh"]:
+            with open(os.path.join(script_directory, name), "w") as f:
+                f.write("#!/bin/bash\n")
+        server = types.SimpleNamespace(
+            max_upload_rate=0,
+            max_download_rate=0,
+            install_directory=self.install_directory,
+            script_directory=script_directory,
+            events=EventHub(),
+            umask=0o022,
+            managed_install=False,
+            config_carryover=False,
+            build_prewarm=True,
+        )
+        self.sent = []
+        self.session = UpdateSession(
+            server, ("127.0.0.1", 0), MR_UPDATE_PORT, self.sent.append
+        )
+        self.session.is_auth_verified = True
+        self.session.excute_bash = self._decrypt
+
+    def tearDown(self):
+        self.session._cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _decrypt(self, command, *args, **kwargs):
+        # the package holds its version_info, decrypt prints it like script.sh
+        session = self.session
+        with open(os.path.join(session.save_directory, session.filename), "rb") as f:
+            version_info = f.read()
+        os.makedirs(os.path.join(session.save_directory, session.decrypted_name))
+        session.log_string += "\n\n" + version_info.decode()
+        return 0
+
+    def _failing_build(self, command, *args, **kwargs):
+        self.session.log_string += "\n\nbuild failed"
+        return 1
+
+    def _upload(self, name, content):
+        del self.sent[:]
+        filename = f"{name}.enc.tar.gz"
+        self.session.process_message(
+            PROTOCOL_INFO + f"{filename},{len(content)}".encode()
+        )
+        self.session.process_message(PROTOCOL_DATA + content)
+        self.session.process_message(PROTOCOL_DCHK)
+        return self.sent[-1]
+
+    def test_kept_connection_checks_each_package(self):
+        self.assertEqual(self._upload("mr1.2.0_a", VERSION_INFO), PROTOCOL_ACK)
+        first = self.session.install_target
+        self.assertTrue(os.path.isdir(first))
+
+        # the version of the first package must not validate the second
+        reply = self._upload("mr1.2.0_b", b"no version\n")
+        self.assertEqual(reply, PROTOCOL_FAIL + b"File is not valid.")
+        self.assertNotIn("MR1.2.0", self.session.log_string)
+        # the first package was verified but never installed
+        self.assertFalse(os.path.exists(first))
+        self.assertIsNone(self.session.install_target)
+
+    def test_failed_prewarm_removes_package(self):
+        self.assertEqual(self._upload("mr1.2.0_a", VERSION_INFO), PROTOCOL_ACK)
+        target = self.session.install_target
+
+        prewarm = mock.patch.multiple(
+            update_server.BuildPrewarm,
+            is_available=mock.Mock(return_value=True),
+            prepare=mock.Mock(),
+        )
+        with prewarm, mock.patch.object(update_server, "read_cache_stats") as stats:
+            stats.return_value = None  # no ccache
+            self.session.excute_bash = self._failing_build
+            self.session.process_message(PROTOCOL_BASH)
+
+        self.assertEqual(
+            self.sent[-1],
+            PROTOCOL_FAIL + b"Prewarm build failed, current version kept.",
+        )
+        self.assertFalse(os.path.exists(target))
+        self.assertIsNone(self.session.install_target)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import socket
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from update_simulator import (
+    UpdateSimulator,
+    format_report,
+    parse_faults,
+    percentile,
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SimulatorHelpersTest(unittest.TestCase):
+
+    def test_parse_faults(self):
+        self.assertEqual(
+            parse_faults("slow_reader=0.05,idle"), {"slow_reader": 0.05, "idle": 0.0}
+        )
+        self.assertEqual(parse_faults(""), {})
+        with self.assertRaises(ValueError):
+            parse_faults("crash=0.1")
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        values = list(range(100, 0, -1))
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 99), 100)
+        self.assertEqual(percentile([3], 90), 3)
+
+    def test_faults_follow_their_ratio(self):
+        simulator = UpdateSimulator(faults={"idle": 0.25, "disconnect": 0.25})
+        chosen = [simulator._choose_fault() for _ in range(2000)]
+        for fault, ratio in (("idle", 0.25), ("disconnect", 0.25), (None, 0.5)):
+            self.assertAlmostEqual(chosen.count(fault) / 2000, ratio, delta=0.05)
+
+
+class SimulatorRunTest(unittest.TestCase):
+
+    def test_sessions_with_a_fault(self):
+        simulator = UpdateSimulator(
+            sessions=4,
+            concurrency=4,
+            payload_size=256 * 1024,
+            faults={"disconnect": 0.5},
+            hold=0.1,
+            decrypt_time=0,
+            build_time=0,
+            session_timeout=30,
+            sample_interval=0.5,
+            port=free_port(),
+            seed=1,
+        )
+        # seed 1 disconnects two of the four sessions
+        report = simulator.run()
+        self.assertEqual(report["completed"], 2)
+        self.assertEqual(
+            report["outcomes"], {"none": {"ok": 2}, "disconnect": {"fault": 2}}
+        )
+        self.assertEqual(report["errors"], {})
+        self.assertTrue(report["server_alive"])
+        self.assertIn("upload", report["latencies"])
+        self.assertIn("server alive", format_report(report))
+        self.assertIsNone(simulator.sandbox)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import tarfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_util import get_package_password
+
+# v2 package: seekable container of independently compressed, encrypted frames
+#   ARCHIVE_MAGIC
+#   frame 0 .. n      encrypt(compress(tar stream block))
+#   index             encrypt(zlib(json)): frames and tar member offsets
+#   footer            index offset, index length, ARCHIVE_MAGIC
+ARCHIVE_MAGIC = b"MRPK\x00\x00\x00\x02"
+ARCHIVE_FOOTER = struct.Struct(">QQ8s")
+ARCHIVE_FORMAT = 2
+ARCHIVE_SUFFIX = ".enc.mrpk"
+ARCHIVE_FRAME_SIZE = 1024 * 1024 * 4  # tar bytes per frame
+
+PACKAGE_FORMATS = [1, 2]  # 1: nested tar.gz of script.sh, 2: this archive
+PACKAGE_NAME_PATTERN = re.compile(r"^(.*)(\.enc\.tar\.gz|\.enc\.mrpk)$")
+
+PBKDF2_ITERATIONS = 10000  # openssl enc -pbkdf2 default
+SALT_HEADER = b"Salted__"
+
+
+def split_package_name(filename):
+    # "mr1.0.0_241017_1823_80.enc.tar.gz" -> "mr1.0.0_241017_1823_80", None if invalid
+    match = PACKAGE_NAME_PATTERN.match(filename)
+    return match.group(1) if match else None
+
+
+def supported_compressions():
+    return ["zlib", "zstd"] if zstandard is not None else ["zlib"]
+
+
+def format_capabilities():
+    # sent with PROTOCOL_VERS, "packages=1,2;compression=zlib,zstd"
+    return (
+        f"packages={','.join(str(f) for f in PACKAGE_FORMATS)};"
+        f"compression={','.join(supported_compressions())}"
+    )
+
+
+def parse_capabilities(text):
+    # {"packages": ["1", "2"], "compression": ["zlib"]}, empty for old peers
+    capabilities = {}
+    for item in text.split(";"):
+        key, _, value = item.partition("=")
+        if key.strip() and value:
+            capabilities[key.strip()] = value.split(",")
+    return capabilities
+
+
+def compress_frame(data, compression="zlib", level=6):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress_frame(data, compression="zlib"):
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd compressed package, zstandard is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def encrypt_block(data, password):
+    # openssl enc -aes-256-cbc -salt -pbkdf2 compatible output
+    try:
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    except ImportError:
+        result = subprocess.run(
+            ["openssl", "enc", "-aes-256-cbc", "-salt", "-pbkdf2", "-k", password],
+            input=data,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            raise Exception(result.stderr.decode())
+        return result.stdout
+
+    salt = os.urandom(8)
+    key_iv = hashlib.pbkdf2_hmac(
+        "sha256", password.encode(), salt, PBKDF2_ITERATIONS, 48
+    )
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key_iv[:32]), modes.CBC(key_iv[32:])).encryptor()
+    data = padder.update(data) + padder.finalize()
+    return SALT_HEADER + salt + encryptor.update(data) + encryptor.finalize()
+
+
+def decrypt_block(data, password):
+    # inverse of encrypt_block, openssl enc -d -aes-256-cbc -pbkdf2 compatible
+    try:
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    except ImportError:
+        result = subprocess.run(
+            ["openssl", "enc", "-d", "-aes-256-cbc", "-pbkdf2", "-k", password],
+            input=data,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            raise Exception("Package decryption failed.")
+        return result.stdout
+
+    if data[: len(SALT_HEADER)] != SALT_HEADER:
+        raise Exception("Package decryption failed.")
+    salt = data[len(SALT_HEADER) : len(SALT_HEADER) + 8]
+    key_iv = hashlib.pbkdf2_hmac(
+        "sha256", password.encode(), salt, PBKDF2_ITERATIONS, 48
+    )
+    decryptor = Cipher(algorithms.AES(key_iv[:32]), modes.CBC(key_iv[32:])).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    try:
+        data = decryptor.update(data[len(SALT_HEADER) + 8 :]) + decryptor.finalize()
+        return unpadder.update(data) + unpadder.finalize()
+    except ValueError:
+        raise Exception("Package decryption failed.")
+
+
+def is_archive(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+class ArchiveWriter:
+    # lays out the frames of UpdatePacker, the index is known only at the end
+
+    def __init__(self, password, compression="zlib"):
+        self.password = password
+        self.compression = compression
+        self.frames = []  # [offset, length, size]
+        self.offset = len(ARCHIVE_MAGIC)
+
+    def header(self):
+        return ARCHIVE_MAGIC
+
+    def add_frame(self, data, size):
+        self.frames.append([self.offset, len(data), size])
+        self.offset += len(data)
+        return data
+
+    def finish(self, members):
+        # members: {arcname: [start, end]} in the uncompressed tar stream
+        index = {
+            "format": ARCHIVE_FORMAT,
+            "compression": self.compression,
+            "frames": self.frames,
+            "members": members,
+        }
+        index_bytes = encrypt_block(
+            zlib.compress(json.dumps(index, separators=(",", ":")).encode("utf-8")),
+            self.password,
+        )
+        footer = ARCHIVE_FOOTER.pack(self.offset, len(index_bytes), ARCHIVE_MAGIC)
+        return index_bytes + footer
+
+
+class _FrameReader:
+    # file object over decompressed frames for tarfile stream mode
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.buffer = b""
+        self.position = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) - self.position < size:
+            frame = next(self.frames, None)
+            if frame is None:
+                break
+            self.buffer = self.buffer[self.position :] + frame
+            self.position = 0
+        if size < 0:
+            size = len(self.buffer) - self.position
+        data = self.buffer[self.position : self.position + size]
+        self.position += len(data)
+        return data
+
+
+class UpdateArchive:
+    # reads v2 packages: the index locates every tar member, so single files
+    # are read without the rest and all frames are decompressed in parallel
+
+    def __init__(self, path, password=None, workers=None):
+        self.path = path
+        self.password = password or get_package_password()
+        self.workers = workers or os.cpu_count() or 1
+        self.f = open(path, "rb")
+        try:
+            self._read_index()
+        except Exception:
+            self.f.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def _read_at(self, offset, length):
+        # os.pread, frames are read from several threads
+        return os.pread(self.f.fileno(), length, offset)
+
+    def _read_index(self):
+        size = os.fstat(self.f.fileno()).st_size
+        if size < len(ARCHIVE_MAGIC) + ARCHIVE_FOOTER.size:
+            raise Exception("Package is truncated.")
+        if self._read_at(0, len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise Exception("Unknown package format.")
+        offset, length, magic = ARCHIVE_FOOTER.unpack(
+            self._read_at(size - ARCHIVE_FOOTER.size, ARCHIVE_FOOTER.size)
+        )
+        if magic != ARCHIVE_MAGIC or offset + length + ARCHIVE_FOOTER.size != size:
+            raise Exception("Package is truncated.")
+
+        index = json.loads(
+            zlib.decompress(decrypt_block(self._read_at(offset, length), self.password))
+        )
+        if index.get("format") != ARCHIVE_FORMAT:
+            raise Exception("Unknown package format.")
+        self.compression = index["compression"]
+        self.frames = index["frames"]
+        self.members = {
+            os.path.normpath(name): tuple(span)
+            for name, span in index["members"].items()
+        }
+        # start of every frame in the uncompressed tar stream
+        self.frame_starts = []
+        position = 0
+        for _, _, frame_size in self.frames:
+            self.frame_starts.append(position)
+            position += frame_size
+
+    def names(self):
+        return list(self.members)
+
+    def _load_frame(self, number):
+        offset, length, size = self.frames[number]
+        data = decompress_frame(
+            decrypt_block(self._read_at(offset, length), self.password),
+            self.compression,
+        )
+        if len(data) != size:
+            raise Exception("Package frame is corrupt.")
+        return data
+
+    def _iter_frames(self, numbers):
+        # decompressed in order, at most two frames per worker ahead of the reader
+        numbers = iter(numbers)
+        with ThreadPoolExecutor(self.workers) as executor:
+            pending = deque()
+            for number in numbers:
+                pending.append(executor.submit(self._load_frame, number))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _frames_of(self, start, end):
+        return [
+            number
+            for number, frame_start in enumerate(self.frame_starts)
+            if frame_start < end and frame_start + self.frames[number][2] > start
+        ]
+
+    def _open_span(self, start, end):
+        # tar stream of [start, end), members are read from their header on
+        numbers = self._frames_of(start, end)
+        data = b"".join(self._iter_frames(numbers))
+        skip = start - self.frame_starts[numbers[0]] if numbers else 0
+        return tarfile.open(fileobj=io.BytesIO(data[skip : skip + end - start]))
+
+    def read(self, name):
+        # content of one regular file, KeyError if the package does not have it
+        start, end = self.members[os.path.normpath(name)]
+        with self._open_span(start, end) as tar:
+            member = tar.next()
+            f = tar.extractfile(member) if member is not None else None
+            if f is None:
+                raise KeyError(name)
+            return f.read()
+
+    def extract(self, target_directory, names=None):
+        # all members, or only the given paths (and what is below them)
+        os.makedirs(target_directory, exist_ok=True)
+        if names is None:
+            reader = _FrameReader(self._iter_frames(range(len(self.frames))))
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                for member in tar:
+                    self._extract_member(tar, member, target_directory)
+            return
+
+        prefixes = [os.path.normpath(name) for name in names]
+        for name, (start, end) in self.members.items():
+            if any(name == p or name.startswith(p + "/") for p in prefixes):
+                with self._open_span(start, end) as tar:
+                    self._extract_member(tar, tar.next(), target_directory)
+
+    @staticmethod
+    def _extract_member(tar, member, target_directory):
+        # same result as tar -xf of v1 packages: modes as packed, the manifest
+        # checks them ("tar" filter would drop group/other write bits)
+        if hasattr(tarfile, "fully_trusted_filter"):
+            tar.extract(member, target_directory, filter="fully_trusted")
+        else:
+            tar.extract(member, target_directory)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Package Archive (v2)")
+    parser.add_argument("package", type=str)
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--cat", type=str, default="", help="print one file")
+    parser.add_argument("--extract", type=str, default="", help="target directory")
+    parser.add_argument("paths", type=str, nargs="*", help="extract only these")
+    parser.add_argument("--workers", type=int, default=0)
+    opts = parser.parse_args(argv)
+
+    with UpdateArchive(opts.package, workers=opts.workers or None) as archive:
+        if opts.list:
+            for name in archive.names():
+                print(name)
+        if opts.cat:
+            sys.stdout.buffer.write(archive.read(opts.cat))
+        if opts.extract:
+            archive.extract(opts.extract, opts.paths or None)
+        if not (opts.list or opts.cat or opts.extract):
+            print(
+                f"{len(archive.frames)} frames ({archive.compression}), "
+                f"{len(archive.members)} members"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import asyncio
+import json
 import os
+import shutil
 import socket
 import struct
+import tempfile
+import zlib
+from collections import deque
 from datetime import datetime
 from os.path import exists
 
@@ -16,23 +21,54 @@ from update_util import (
     FS_UPDATE_PORT,
     MAX_CHUNK_SIZE,
     MR_UPDATE_PORT,
+    MUX_CHANNEL_CTRL,
+    MUX_CHANNEL_FS,
+    MUX_CHANNEL_MR,
+    MUX_MAX_WEIGHT,
+    MUX_QUANTUM,
+    MUX_QUEUE_SIZE,
+    PARALLEL_OFFSET_SIZE,
     PROTOCOL_ACK,
     PROTOCOL_AUTH,
     PROTOCOL_BASH,
     PROTOCOL_DATA,
     PROTOCOL_DCHK,
+    PROTOCOL_DEND,
     PROTOCOL_FAIL,
     PROTOCOL_INFO,
     PROTOCOL_LENGTH,
     PROTOCOL_LOGS,
     PROTOCOL_MDAT,
+    PROTOCOL_MFOL,
     PROTOCOL_MINF,
     PROTOCOL_MLOG,
+    PROTOCOL_MQRY,
+    PROTOCOL_MSTP,
+    PROTOCOL_MUXO,
+    PROTOCOL_MUXW,
+    PROTOCOL_PDAT,
+    PROTOCOL_PEND,
+    PROTOCOL_PINF,
+    PROTOCOL_PJON,
+    PROTOCOL_RATE,
     PROTOCOL_STEP,
     PROTOCOL_VERS,
     encode_auth_token,
+    format_mux_weights,
     get_ip_address,
+    pack_mux_frame,
+    unpack_mux_frame,
 )
+from log_query import LogQuery
+from update_archive import (
+    ARCHIVE_FORMAT,
+    format_capabilities,
+    is_archive,
+    parse_capabilities,
+    supported_compressions,
+)
+from update_packer import UpdatePacker, default_package_name
+from update_qos import AdaptiveRate, TokenBucket, format_rate_limit, parse_rate_limit
 
 
 class UpdateClient:
@@ -41,7 +77,10 @@ class UpdateClient:
     ):
         self.filename = ""
         self.filepath = ""
-        self.filesize = 0
+        self.filesize = 0  # -1: streamed from the packer
+        self.packer = None
+        self.artifact_path = None
+        self.parallel_streams = 1  # connections used for one upload
 
         self.pattern = r"^mr.*\.gz$"
         self.filetype = 0
@@ -50,15 +89,28 @@ class UpdateClient:
         self.writer = None
 
         self.connected = False
-        self.host = get_ip_address()
+        self.authenticated = False
+        self.host = None  # resolved on connect, get_ip_address() is slow
         self.port = MR_UPDATE_PORT  # FS_UPDATE_PORT
 
         self.fnLogDebug = None
+        self.fnLogLine = None  # followed log lines: fn(filename, data)
         self.log_prefix = ""
         self.log_details = ""
         self.protocol_version = ""
+        self.server_capabilities = {}  # empty for servers without package formats
         self.loop = asyncio.get_event_loop()
 
+        # rate limits (bytes/sec, 0 = unlimited)
+        self.upload_rate = 0
+        self.download_rate = 0
+        self.adaptive_rate = False
+        self.upload_bucket = TokenBucket()
+        self.download_bucket = TokenBucket()
+        self.upload_adaptive = None
+        # limits in effect on the connection, the server starts unlimited
+        self.session_rate = (0, 0, False)
+
     def log_debug(self, msg):
         log_string = self.log_prefix + msg
 
@@ -97,9 +149,13 @@ class UpdateClient:
         self.log_prefix = "[MR] " if port == MR_UPDATE_PORT else "[FS] "
         self.log_debug("Connecting to server...")
 
-        if host != "":
+        if host:
             self.host = host
+        elif not self.host:
+            self.host = get_ip_address()
         self.port = port
+        self.authenticated = False
+        self.session_rate = (0, 0, False)
 
         result = False
         try:
@@ -111,13 +167,17 @@ class UpdateClient:
             self.connected = True
             result = True
 
-            # request version information
-            await self._send_packet(PROTOCOL_VERS)
+            # request version information, offering the package formats
+            await self._send_packet(PROTOCOL_VERS + format_capabilities().encode())
             response = await self._read_packet()
             if response[:PROTOCOL_LENGTH] == PROTOCOL_FAIL:
                 raise Exception(response[PROTOCOL_LENGTH:].decode())
             elif response[:PROTOCOL_LENGTH] == PROTOCOL_VERS:
-                self.protocol_version = response[PROTOCOL_LENGTH:].decode()
+                version, _, capabilities = (
+                    response[PROTOCOL_LENGTH:].decode().partition(";")
+                )
+                self.protocol_version = version
+                self.server_capabilities = parse_capabilities(capabilities)
 
         except (asyncio.TimeoutError, socket.gaierror, ConnectionRefusedError):
             self.log_debug("Connection timed out.")
@@ -125,6 +185,10 @@ class UpdateClient:
         return result
 
     async def _async_authenticate(self):
+        # once per connection, a kept connection skips the handshake
+        if self.authenticated:
+            return
+
         # generate authentication token
         local_address, local_port = self.writer.get_extra_info("sockname")
         auth_info = encode_auth_token(local_address, local_port).encode()
@@ -137,8 +201,86 @@ class UpdateClient:
         if response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
             raise Exception(response[PROTOCOL_LENGTH:].decode())
 
+        self.authenticated = True
         self.log_debug("Authentication successful.")
 
+    async def _async_send_rate(self):
+        # a kept connection still has the limits of its previous operation,
+        # they are replaced whenever they differ (0/0 restores unlimited)
+        requested = (self.upload_rate, self.download_rate, self.adaptive_rate)
+        if requested == self.session_rate:
+            return
+
+        # send rate limits
+        rate_info = format_rate_limit(
+            self.upload_rate, self.download_rate, self.adaptive_rate
+        )
+        await self._send_packet(PROTOCOL_RATE + rate_info.encode())
+
+        # wait for ACK with the limits granted by the server
+        response = await self._read_packet()
+        if response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            raise Exception(response[PROTOCOL_LENGTH:].decode())
+
+        upload, download, adaptive = parse_rate_limit(
+            response[PROTOCOL_LENGTH:].decode()
+        )
+        self.upload_bucket.set_rate(upload)
+        self.download_bucket.set_rate(download)
+        self.upload_adaptive = (
+            AdaptiveRate(self.upload_bucket, upload) if adaptive and upload else None
+        )
+        self.session_rate = requested
+
+        self.log_debug(f"Rate limit: upload {upload} B/s, download {download} B/s.")
+
+    def _negotiate_format(self):
+        # v2 packages only go to servers that announced them
+        supports_archive = str(ARCHIVE_FORMAT) in self.server_capabilities.get(
+            "packages", []
+        )
+        if self.packer is not None:
+            if supports_archive:
+                compression = (
+                    "zstd"
+                    if "zstd" in self.server_capabilities.get("compression", [])
+                    and "zstd" in supported_compressions()
+                    else "zlib"
+                )
+                self.packer.set_format(ARCHIVE_FORMAT, compression)
+            else:
+                self.packer.set_format(1)
+            self.filename = self.packer.filename
+        elif is_archive(self.filepath) and not supports_archive:
+            raise Exception("Server does not support package format 2.")
+
+    async def _async_pack_file(self):
+        # servers without capabilities predate streamed uploads (size -1, DEND),
+        # the package is packed to a file first and sent as a normal file.
+        # returns the temporary directory, None when packed to the artifact
+        directory = None
+        if self.artifact_path:
+            path = self.artifact_path
+        else:
+            directory = tempfile.mkdtemp(prefix="morow_package_")
+            path = os.path.join(directory, self.packer.filename)
+        self.log_debug("Server does not accept streamed packages, packing first...")
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(
+                None, lambda: deque(self.packer.pack(path), maxlen=0)
+            )
+        except BaseException:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        self.packer = None
+        self.filepath = path
+        self.filesize = os.path.getsize(path)
+        self.log_debug(f"Package packed. ({self.filesize} bytes)")
+        return directory
+
     async def _async_send_info(self):
         # check if file is selected
         if len(self.filename) == 0:
@@ -168,19 +310,22 @@ class UpdateClient:
         #         unit_divisor=1024,
         #     )
 
-        # read and send file data
-        async with aiofiles.open(self.filepath, "rb") as f:
-            while True:
-                # read file data
-                data = await f.read(MAX_CHUNK_SIZE)  # 64 KB buffer
-                if not data:
-                    break
-
-                # send file data
-                await self._send_packet(PROTOCOL_DATA + data)
-                # show progress
-                # if show_progress:
-                #     bar.update(len(data))
+        if self.packer is not None:
+            await self._async_send_stream()
+        else:
+            # read and send file data
+            async with aiofiles.open(self.filepath, "rb") as f:
+                while True:
+                    # read file data
+                    data = await f.read(MAX_CHUNK_SIZE)  # 64 KB buffer
+                    if not data:
+                        break
+
+                    # send file data
+                    await self._async_send_data(data)
+                    # show progress
+                    # if show_progress:
+                    #     bar.update(len(data))
 
         # wait for ACK
         response = await self._read_packet()
@@ -189,6 +334,89 @@ class UpdateClient:
 
         self.log_debug("File data transmitted.")
 
+        await self._async_check_file()
+
+    async def _async_send_file_parallel(self):
+        # send file information, the server preallocates the file
+        file_info = f"{os.path.basename(self.filename)},{self.filesize}".encode()
+        await self._send_packet(PROTOCOL_PINF + file_info)
+
+        response = await self._read_packet()
+        if response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            raise Exception(response[PROTOCOL_LENGTH:].decode())
+        token = response[PROTOCOL_LENGTH:].decode()
+
+        # split the file into one range per connection
+        chunk_size = MAX_CHUNK_SIZE - PARALLEL_OFFSET_SIZE
+        range_size = -(-self.filesize // self.parallel_streams)
+        range_size = -(-range_size // chunk_size) * chunk_size
+        ranges = [
+            (offset, min(range_size, self.filesize - offset))
+            for offset in range(0, self.filesize, range_size)
+        ] or [(0, 0)]
+
+        streams = [self]
+        try:
+            for _ in ranges[1:]:
+                stream = UpdateClient()
+                stream.fnLogDebug = self.fnLogDebug
+                stream.set_rate_limit(
+                    self.upload_rate // len(ranges), 0, self.adaptive_rate
+                )
+                if not await stream._async_connect(self.host, self.port):
+                    raise Exception("Connection failed.")
+                streams.append(stream)
+                await stream._async_authenticate()
+                await stream._async_send_rate()
+                await stream._async_join_upload(token)
+
+            await asyncio.gather(
+                *[
+                    stream._async_send_range(self.filepath, offset, length)
+                    for stream, (offset, length) in zip(streams, ranges)
+                ]
+            )
+        finally:
+            for stream in streams[1:]:
+                await stream._async_close()
+
+        self.log_debug(f"File data transmitted. ({len(ranges)} streams)")
+
+        await self._async_check_file()
+
+    async def _async_join_upload(self, token):
+        await self._send_packet(PROTOCOL_PJON + token.encode())
+
+        response = await self._read_packet()
+        if response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            raise Exception(response[PROTOCOL_LENGTH:].decode())
+
+    async def _async_send_range(self, filepath, offset, length):
+        # read and send file data of [offset, offset + length)
+        chunk_size = MAX_CHUNK_SIZE - PARALLEL_OFFSET_SIZE
+        async with aiofiles.open(filepath, "rb") as f:
+            await f.seek(offset)
+            position = offset
+            while position < offset + length:
+                data = await f.read(min(chunk_size, offset + length - position))
+                if not data:
+                    raise Exception("File read failed.")
+
+                await self.upload_bucket.async_consume(len(data))
+                if self.upload_adaptive:
+                    self.upload_adaptive.update(self.writer.get_extra_info("socket"))
+                await self._send_packet(
+                    PROTOCOL_PDAT + struct.pack(">Q", position) + data
+                )
+                position += len(data)
+
+        # wait for ACK of the whole range
+        await self._send_packet(PROTOCOL_PEND + f"{offset},{length}".encode())
+        response = await self._read_packet()
+        if response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            raise Exception(response[PROTOCOL_LENGTH:].decode())
+
+    async def _async_check_file(self):
         await self._send_packet(PROTOCOL_DCHK)
 
         response = await self._read_packet()
@@ -198,6 +426,29 @@ class UpdateClient:
 
         self.log_debug("File data check successful.")
 
+    async def _async_send_data(self, data):
+        await self.upload_bucket.async_consume(len(data))
+        if self.upload_adaptive:
+            self.upload_adaptive.update(self.writer.get_extra_info("socket"))
+        await self._send_packet(PROTOCOL_DATA + data)
+
+    async def _async_send_stream(self):
+        # pack and send at the same time, the total size is sent at the end
+        loop = asyncio.get_event_loop()
+        chunks = self.packer.pack(self.artifact_path)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                for i in range(0, len(chunk), MAX_CHUNK_SIZE):
+                    await self._async_send_data(chunk[i : i + MAX_CHUNK_SIZE])
+        finally:
+            chunks.close()
+
+        await self._send_packet(PROTOCOL_DEND + str(self.packer.size).encode())
+        self.log_debug(f"Package streamed. ({self.packer.size} bytes)")
+
     async def _async_recv_file(self, save_dir, logtype="eventlog"):
         # send log request
         await self._send_packet(PROTOCOL_MLOG + logtype.encode())
@@ -222,6 +473,7 @@ class UpdateClient:
                     os.path.join(save_dir, filename), "wb"
                 )
             elif command == PROTOCOL_MDAT:
+                await self.download_bucket.async_consume(len(data))
                 datasize += len(data)
                 await file_stream.write(data)
                 if datasize == filesize:
@@ -239,6 +491,91 @@ class UpdateClient:
 
         self.log_debug(f"{logtype} data received.")
 
+    async def _async_recv_query(self, save_dir, query):
+        # send log query
+        await self._send_packet(PROTOCOL_MQRY + query.dumps())
+
+        decompressor = zlib.decompressobj() if query.compress else None
+        file_stream = None
+        # wait for ACK
+        try:
+            while True:
+                response = await self._read_packet()
+                command, data = response[:PROTOCOL_LENGTH], response[PROTOCOL_LENGTH:]
+
+                if command == PROTOCOL_ACK:
+                    self.log_debug(data.decode())
+                    break
+                elif command == PROTOCOL_FAIL:
+                    raise Exception(data.decode())
+                elif command == PROTOCOL_MINF:
+                    # only matching lines are sent, the size is unknown
+                    filename = data.decode().split(",")[0]
+                    file_stream = await aiofiles.open(
+                        os.path.join(save_dir, filename), "wb"
+                    )
+                elif command == PROTOCOL_MDAT:
+                    if decompressor is not None:
+                        data = decompressor.decompress(data)
+                    await self.download_bucket.async_consume(len(data))
+                    await file_stream.write(data)
+                elif command == PROTOCOL_STEP:
+                    await file_stream.close()
+                    file_stream = None
+                    self.log_debug(data.decode())
+                else:
+                    self.log_debug(f"Unknown command: {command.decode()}")
+                    return
+        finally:
+            if file_stream is not None:
+                await file_stream.close()
+
+        self.log_debug(f"{query.log_type} query received.")
+
+    async def _async_recv_follow(self, log_type, files=None, duration=None):
+        # send follow request
+        follow = {"type": log_type, "files": files or []}
+        await self._send_packet(PROTOCOL_MFOL + json.dumps(follow).encode())
+
+        response = await self._read_packet()
+        if response[:PROTOCOL_LENGTH] != PROTOCOL_STEP:
+            raise Exception(response[PROTOCOL_LENGTH:].decode())
+        self.log_debug(response[PROTOCOL_LENGTH:].decode())
+
+        if duration:
+            asyncio.get_event_loop().call_later(
+                duration, lambda: asyncio.ensure_future(self._async_stop_follow())
+            )
+
+        filename = ""
+        # lines are pushed until the follow is stopped
+        while True:
+            response = await self._read_packet()
+            if response is None:
+                raise ConnectionError("Connection closed.")
+            command, data = response[:PROTOCOL_LENGTH], response[PROTOCOL_LENGTH:]
+
+            if command == PROTOCOL_ACK:
+                break
+            elif command == PROTOCOL_FAIL:
+                raise Exception(data.decode())
+            elif command == PROTOCOL_MINF:
+                filename = data.decode().split(",")[0]
+            elif command == PROTOCOL_MDAT:
+                await self.download_bucket.async_consume(len(data))
+                if self.fnLogLine is not None:
+                    self.fnLogLine(filename, bytes(data))
+                else:
+                    for line in data.decode(errors="replace").splitlines():
+                        self.log_debug(f"{filename}: {line}")
+            elif command == PROTOCOL_STEP:
+                self.log_debug(data.decode())
+
+        self.log_debug(f"{log_type} follow stopped.")
+
+    async def _async_stop_follow(self):
+        await self._send_packet(PROTOCOL_MSTP)
+
     async def _async_send_bash(self):
         # send bash script
         await self._send_packet(PROTOCOL_BASH)
@@ -282,6 +619,8 @@ class UpdateClient:
     async def _async_close(self):
         if self.connected:
             self.log_debug("Closing connection...")
+            self.connected = False
+            self.authenticated = False
             self.writer.close()
             await self.writer.wait_closed()
 
@@ -290,10 +629,20 @@ class UpdateClient:
             return False
 
         result = True
+        selection = None  # source selection replaced by its packed file
+        packed_directory = None
         try:
             await self._async_authenticate()
-            await self._async_send_info()
-            await self._async_send_file(show_progress)
+            await self._async_send_rate()
+            self._negotiate_format()
+            if self.packer is not None and not self.server_capabilities:
+                selection = (self.packer, self.filepath, self.filesize)
+                packed_directory = await self._async_pack_file()
+            if self.parallel_streams > 1 and self.packer is None:
+                await self._async_send_file_parallel()
+            else:
+                await self._async_send_info()
+                await self._async_send_file(show_progress)
             await self._async_send_bash()
         except (
             ConnectionRefusedError,
@@ -308,6 +657,10 @@ class UpdateClient:
             result = False
             self.log_debug(str(e))
         finally:
+            if selection is not None:
+                self.packer, self.filepath, self.filesize = selection
+            if packed_directory is not None:
+                shutil.rmtree(packed_directory, ignore_errors=True)
             await self._async_send_logs(save_logs)
             # await self._async_close()
 
@@ -320,6 +673,7 @@ class UpdateClient:
         result = True
         try:
             await self._async_authenticate()
+            await self._async_send_rate()
             await self._async_recv_file(saving_dir, log_type)
         except (
             ConnectionRefusedError,
@@ -336,10 +690,60 @@ class UpdateClient:
 
         return result
 
-    def connect(self, host=get_ip_address(), port=MR_UPDATE_PORT):
+    async def _async_query_log(self, saving_dir, query):
+        if not self.connected:
+            return False
+
+        result = True
+        try:
+            await self._async_authenticate()
+            await self._async_send_rate()
+            await self._async_recv_query(saving_dir, query)
+        except (
+            ConnectionRefusedError,
+            ConnectionResetError,
+            TimeoutError,
+            ConnectionError,
+            OSError,
+        ) as e:
+            result = False
+            self.log_debug(str(e))
+        except Exception as e:
+            result = False
+            self.log_debug(str(e))
+
+        return result
+
+    async def _async_follow_log(self, log_type, files=None, duration=None):
+        if not self.connected:
+            return False
+
         result = True
         try:
-            result = self.loop.run_until_complete(self._async_connect(host, port))
+            await self._async_authenticate()
+            await self._async_send_rate()
+            await self._async_recv_follow(log_type, files, duration)
+        except (
+            ConnectionRefusedError,
+            ConnectionResetError,
+            TimeoutError,
+            ConnectionError,
+            OSError,
+        ) as e:
+            result = False
+            self.log_debug(str(e))
+        except Exception as e:
+            result = False
+            self.log_debug(str(e))
+
+        return result
+
+    def connect(self, host=None, port=MR_UPDATE_PORT):
+        result = True
+        try:
+            result = self.loop.run_until_complete(
+                self._async_connect(host or "", port)
+            )
         except Exception as e:
             result = False
             self.log_debug(str(e))
@@ -362,12 +766,71 @@ class UpdateClient:
             self._async_request_log(saving_dir, log_type)
         )
 
+    def query_log(
+        self,
+        saving_dir,
+        log_type="eventlog",
+        since=None,
+        until=None,
+        pattern="",
+        regex=False,
+        compress=True,
+    ):
+        # since, until: datetime or epoch seconds
+        if not self.connected:
+            return False
+
+        query = LogQuery(
+            log_type,
+            since.timestamp() if isinstance(since, datetime) else since,
+            until.timestamp() if isinstance(until, datetime) else until,
+            pattern,
+            regex,
+            compress=compress,
+        )
+        return self.loop.run_until_complete(self._async_query_log(saving_dir, query))
+
+    def follow_log(self, log_type="eventlog", files=None, duration=None):
+        # blocks until duration (seconds) has passed, None: until disconnected
+        if not self.connected:
+            return False
+
+        return self.loop.run_until_complete(
+            self._async_follow_log(log_type, files, duration)
+        )
+
     def close(self):
         if self.connected:
             self.loop.run_until_complete(self._async_close())
 
+    def set_rate_limit(self, upload=0, download=0, adaptive=False):
+        self.upload_rate = upload
+        self.download_rate = download
+        self.adaptive_rate = adaptive
+
+    def set_parallel_streams(self, streams):
+        self.parallel_streams = max(1, streams)
+
+    def select_source(self, source_path, package_name=None, artifact_path=None):
+        # build the package from a source tree while uploading it
+        if not os.path.isdir(source_path):
+            self.log_debug("Source directory not found.")
+            return False
+
+        self.packer = UpdatePacker(
+            source_path, package_name or default_package_name(source_path)
+        )
+        self.artifact_path = artifact_path
+        self.filepath = artifact_path or source_path
+        self.filename = self.packer.filename
+        self.filesize = -1
+        return True
+
     def select_file(self, filepath):
+        if os.path.isdir(filepath):
+            return self.select_source(filepath)
         if exists(filepath):
+            self.packer = None
             self.filepath = filepath
             self.filename = os.path.basename(filepath)
             self.filesize = os.path.getsize(filepath)
@@ -377,16 +840,185 @@ class UpdateClient:
             return False
 
 
+class MuxConnection(UpdateClient):
+    # single connection carrying several update channels
+
+    def __init__(self):
+        super().__init__()
+        self.log_prefix = "[MUX] "
+        self.outbox = {}  # channel id -> deque of frames
+        self.inbox = {}  # channel id -> asyncio.Queue of packets
+        self.deficits = {}
+        self.weights = {}
+        self.pending = asyncio.Event()
+        self.space = asyncio.Event()
+        self.tasks = []
+
+    def _get_inbox(self, channel):
+        if channel not in self.inbox:
+            self.inbox[channel] = asyncio.Queue()
+        return self.inbox[channel]
+
+    async def _async_connect(self, host="", port=MR_UPDATE_PORT, weights=None):
+        result = await super()._async_connect(host, port)
+        self.log_prefix = "[MUX] "
+        if not result:
+            return False
+
+        # the server opens channels for authenticated connections only
+        try:
+            await self._async_authenticate()
+        except Exception as e:
+            self.log_debug(str(e))
+            return False
+
+        self.weights = dict(weights or {})
+        await self._send_packet(
+            PROTOCOL_MUXO + format_mux_weights(self.weights).encode()
+        )
+        response = await self._read_packet()
+        if response is None or response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            self.log_debug("Multiplexed mode is not supported.")
+            return False
+
+        self.tasks = [
+            asyncio.ensure_future(self._reader_loop()),
+            asyncio.ensure_future(self._writer_loop()),
+        ]
+        self.log_debug("Multiplexed mode started.")
+        return True
+
+    async def _async_set_weights(self, weights):
+        self.weights.update(weights)
+        await self._async_mux_send(
+            MUX_CHANNEL_CTRL, PROTOCOL_MUXW + format_mux_weights(weights).encode()
+        )
+
+    async def _async_mux_send(self, channel, msg_bytes):
+        if not isinstance(msg_bytes, bytes):
+            msg_bytes = msg_bytes.encode("utf-8")
+
+        outbox = self.outbox.setdefault(channel, deque())
+        while len(outbox) >= MUX_QUEUE_SIZE:
+            self.space.clear()
+            await self.space.wait()
+
+        frame = pack_mux_frame(channel, msg_bytes)
+        outbox.append(struct.pack(">I", len(frame)) + frame)
+        self.pending.set()
+
+    async def _async_mux_read(self, channel):
+        return await self._get_inbox(channel).get()
+
+    async def _reader_loop(self):
+        try:
+            while True:
+                frame = await self._read_packet()
+                if frame is None:
+                    break
+                channel, msg_bytes = unpack_mux_frame(frame)
+                await self._get_inbox(channel).put(msg_bytes)
+        except (ConnectionError, OSError) as e:
+            self.log_debug(str(e))
+        finally:
+            # wake up every channel waiting for a response
+            for inbox in self.inbox.values():
+                inbox.put_nowait(None)
+
+    async def _writer_loop(self):
+        # weighted fair (deficit round robin) scheduling between channels
+        while True:
+            await self.pending.wait()
+            for channel, outbox in sorted(self.outbox.items()):
+                if not outbox:
+                    self.deficits[channel] = 0
+                    continue
+                self.deficits[channel] = self.deficits.get(
+                    channel, 0
+                ) + MUX_QUANTUM * self.weights.get(channel, 1)
+                while outbox and len(outbox[0]) <= self.deficits[channel]:
+                    frame = outbox.popleft()
+                    self.deficits[channel] -= len(frame)
+                    self.writer.write(frame)
+            self.space.set()
+            await self.writer.drain()
+            if not any(self.outbox.values()):
+                self.pending.clear()
+
+    async def _async_close(self):
+        for task in self.tasks:
+            task.cancel()
+        await super()._async_close()
+
+
+class MuxUpdateClient(UpdateClient):
+    # update client bound to one channel of a MuxConnection
+
+    def __init__(self, mux, channel):
+        super().__init__()
+        self.mux = mux
+        self.channel = channel
+        self.log_prefix = {
+            MUX_CHANNEL_CTRL: "[CTRL] ",
+            MUX_CHANNEL_MR: "[MR] ",
+            MUX_CHANNEL_FS: "[FS] ",
+        }.get(channel, "")
+
+    async def _send_packet(self, msg_bytes):
+        await self.mux._async_mux_send(self.channel, msg_bytes)
+
+    async def _read_packet(self):
+        return await self.mux._async_mux_read(self.channel)
+
+    async def _async_connect(self, host="", port=MR_UPDATE_PORT):
+        # channels share the socket of the mux connection, parallel upload
+        # streams join the upload on the server of that socket
+        self.host = self.mux.host
+        self.port = self.mux.port
+        self.writer = self.mux.writer
+        self.connected = self.mux.connected
+        self.server_capabilities = self.mux.server_capabilities
+        return self.connected
+
+    async def _async_close(self):
+        pass
+
+
 class MorowClient:
     def __init__(
-        self, host=get_ip_address(), ports: list = [MR_UPDATE_PORT, FS_UPDATE_PORT]
+        self,
+        host=None,
+        ports: list = [MR_UPDATE_PORT, FS_UPDATE_PORT],
+        multiplexed=False,
     ):
-        self.host = host
+        self.host = host  # None: get_ip_address() on connect
         self.ports = ports
-        self.update_client = [UpdateClient() for _ in ports]
+        self.multiplexed = multiplexed
+        self.mux = None
+        if multiplexed:
+            # one connection to ports[0], one channel per update type by position
+            # (ports[0]: MR, ports[1]: FS), the port numbers may be non-default
+            channels = [MUX_CHANNEL_MR, MUX_CHANNEL_FS]
+            if len(ports) > len(channels):
+                raise ValueError("Multiplexed mode carries one MR and one FS update.")
+            self.mux = MuxConnection()
+            self.update_client = [
+                MuxUpdateClient(self.mux, channel)
+                for channel, _ in zip(channels, ports)
+            ]
+        else:
+            self.update_client = [UpdateClient() for _ in ports]
         self.loop = asyncio.get_event_loop()
 
     async def async_connect(self):
+        if self.host is None:
+            self.host = get_ip_address()
+        if self.multiplexed and not await self.mux._async_connect(
+            self.host, self.ports[0]
+        ):
+            print("Multiplexed connection failed.")
+            return False
+
         tasks = []
         for i, port in enumerate(self.ports):
             tasks.append(self.update_client[i]._async_connect(self.host, port))
@@ -399,6 +1031,9 @@ class MorowClient:
         return all(results)
 
     async def async_update(self, update_files, save_logs=False, show_progress=False):
+        if self.multiplexed:
+            await self.mux._async_set_weights(self._get_channel_weights(update_files))
+
         tasks = []
         for i, (_, update_file) in enumerate(zip(self.ports, update_files)):
             if not self.update_client[i].select_file(update_file):
@@ -413,12 +1048,28 @@ class MorowClient:
             print("One or both updates failed.")
         return all(results)
 
+    def _get_channel_weights(self, update_files):
+        # give the smaller package a larger share so it finishes first
+        sizes = {}
+        for client, update_file in zip(self.update_client, update_files):
+            if exists(update_file):
+                sizes[client.channel] = max(1, os.path.getsize(update_file))
+        if not sizes:
+            return {}
+        largest = max(sizes.values())
+        return {
+            channel: min(MUX_MAX_WEIGHT, max(1, round(largest / size)))
+            for channel, size in sizes.items()
+        }
+
     async def async_close(self):
         tasks = []
         for client in self.update_client:
             tasks.append(client._async_close())
 
         await asyncio.gather(*tasks)
+        if self.multiplexed:
+            await self.mux._async_close()
 
     def connect(self):
         return self.loop.run_until_complete(self.async_connect())
@@ -429,8 +1080,22 @@ class MorowClient:
         )
 
     def request_log(self, saving_dir, log_type="eventlog"):
+        if self.multiplexed:
+            # log pulls use the control channel so they never wait on an update
+            client = MuxUpdateClient(self.mux, MUX_CHANNEL_CTRL)
+            self.loop.run_until_complete(client._async_connect())
+            client.fnLogDebug = self.update_client[0].fnLogDebug
+            return client.request_log(saving_dir, log_type)
         self.update_client[0].request_log(saving_dir, log_type)
 
+    def query_log(self, saving_dir, log_type="eventlog", **kwargs):
+        client = self.update_client[0]
+        if self.multiplexed:
+            client = MuxUpdateClient(self.mux, MUX_CHANNEL_CTRL)
+            self.loop.run_until_complete(client._async_connect())
+            client.fnLogDebug = self.update_client[0].fnLogDebug
+        return client.query_log(saving_dir, log_type, **kwargs)
+
     def close(self):
         # asyncio.run(self.async_close())
         self.loop.run_until_complete(self.async_close())
@@ -439,6 +1104,14 @@ class MorowClient:
         for client in self.update_client:
             client.fnLogDebug = fnLogDebug
 
+    def set_parallel_streams(self, streams):
+        for client in self.update_client:
+            client.set_parallel_streams(streams)
+
+    def set_rate_limit(self, upload=0, download=0, adaptive=False):
+        for client in self.update_client:
+            client.set_rate_limit(upload, download, adaptive)
+
     def get_log_details(self):
         return [client.log_details for client in self.update_client]
 
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from log_query import LogQuery
+from update_client import UpdateClient
+from update_util import FS_UPDATE_PORT, MR_UPDATE_PORT, get_ip_address
+
+DAEMON_SOCKET_PATH = "~/.cache/morow_update/client.sock"
+# kept connections are closed before the server reaps them (IDLE_TIMEOUT)
+CONNECTION_IDLE_TIMEOUT = 240
+CONNECTION_REAP_INTERVAL = 30
+UPDATE_PORTS = {"mr": MR_UPDATE_PORT, "fs": FS_UPDATE_PORT}
+
+# JSON lines over the socket:
+#   request  {"id": 1, "method": "update", "params": {"type": "mr", "file": "..."}}
+#   events   {"id": 1, "event": "progress", "message": "..."}
+#            {"id": 1, "event": "log", "file": "...", "data": "..."}
+#   result   {"id": 1, "result": {...}} or {"id": 1, "error": "..."}
+
+
+class CachedConnection:
+
+    def __init__(self):
+        self.client = UpdateClient()
+        self.lock = asyncio.Lock()  # one operation at a time per connection
+        self.last_used = time.monotonic()
+
+
+class DaemonRequest:
+
+    def __init__(self, request_id, send):
+        self.id = request_id
+        self.send = send
+        self.client = None  # client of a running follow
+        self.failed = False  # the connection of a failed operation is not reused
+
+    def emit(self, event, **fields):
+        self.send(dict({"id": self.id, "event": event}, **fields))
+
+
+class UpdateDaemon:
+    # one event loop and kept robot connections shared by every caller
+
+    def __init__(
+        self,
+        socket_path=DAEMON_SOCKET_PATH,
+        idle_timeout=CONNECTION_IDLE_TIMEOUT,
+    ):
+        self.socket_path = os.path.expanduser(socket_path)
+        self.idle_timeout = idle_timeout
+        self.connections = {}  # (host, port) -> CachedConnection
+        self.default_host = None
+        self.stop_event = None
+        self.methods = {
+            "ping": self._ping,
+            "update": self._update,
+            "request_log": self._request_log,
+            "query_log": self._query_log,
+            "follow_log": self._follow_log,
+            "connections": self._list_connections,
+            "close": self._close_connection,
+            "shutdown": self._shutdown,
+        }
+
+    def _resolve(self, params):
+        # "host" defaults to get_ip_address(), resolved once on first use
+        host = params.get("host")
+        if not host:
+            if self.default_host is None:
+                self.default_host = get_ip_address()
+            host = self.default_host
+        port = params.get("port") or UPDATE_PORTS[params.get("type", "mr")]
+        return host, int(port)
+
+    @staticmethod
+    def _bind(client, request):
+        client.fnLogDebug = lambda msg: request.emit("progress", message=msg)
+        client.fnLogLine = None
+
+    @contextlib.asynccontextmanager
+    async def _connection(self, params, request):
+        key = self._resolve(params)
+        connection = self.connections.get(key)
+        if connection is None:
+            connection = self.connections[key] = CachedConnection()
+
+        async with connection.lock:
+            client = connection.client
+            self._bind(client, request)
+            if client.connected and (
+                client.reader.at_eof() or client.writer.is_closing()
+            ):
+                # closed by the server (idle timeout, restart)
+                await client._async_close()
+            if not client.connected and not await client._async_connect(*key):
+                raise ConnectionError(f"Connection to {key[0]}:{key[1]} failed.")
+            try:
+                yield client
+            except BaseException:
+                request.failed = True
+                raise
+            finally:
+                client.fnLogDebug = lambda msg: None
+                connection.last_used = time.monotonic()
+                if request.failed:
+                    # the protocol state of a failed or cancelled operation is
+                    # unknown, frames of it may still be on the stream
+                    if self.connections.get(key) is connection:
+                        del self.connections[key]
+                    await client._async_close()
+
+    async def _ping(self, params, request):
+        return {"pid": os.getpid(), "connections": len(self.connections)}
+
+    async def _update(self, params, request):
+        if not os.path.exists(params["file"]):
+            raise FileNotFoundError(f"File not found: {params['file']}")
+        async with self._connection(params, request) as client:
+            if not client.select_file(params["file"]):
+                raise FileNotFoundError(f"File not found: {params['file']}")
+            rate = params.get("rate") or {}
+            client.set_rate_limit(
+                rate.get("upload", 0), rate.get("download", 0), rate.get("adaptive", False)
+            )
+            client.set_parallel_streams(params.get("parallel_streams", 1))
+            success = await client._async_update(params.get("save_logs", False))
+            request.failed = not success
+            return {"success": success, "log": client.log_details}
+
+    async def _request_log(self, params, request):
+        async with self._connection(params, request) as client:
+            success = await client._async_request_log(
+                params["directory"], params.get("log_type", "eventlog")
+            )
+            request.failed = not success
+            return {"success": success}
+
+    async def _query_log(self, params, request):
+        query = LogQuery(
+            params.get("log_type", "eventlog"),
+            params.get("since"),
+            params.get("until"),
+            params.get("pattern", ""),
+            params.get("regex", False),
+            params.get("ignore_case", False),
+            params.get("compress", True),
+        )
+        async with self._connection(params, request) as client:
+            success = await client._async_query_log(params["directory"], query)
+            request.failed = not success
+            return {"success": success}
+
+    async def _follow_log(self, params, request):
+        # own connection, a follow would hold a kept one for its whole duration
+        client = UpdateClient()
+        self._bind(client, request)
+        client.fnLogLine = lambda name, data: request.emit(
+            "log", file=name, data=data.decode(errors="replace")
+        )
+        if not await client._async_connect(*self._resolve(params)):
+            raise ConnectionError("Connection failed.")
+        request.client = client
+        try:
+            success = await client._async_follow_log(
+                params.get("log_type", "eventlog"),
+                params.get("files"),
+                params.get("duration"),
+            )
+        finally:
+            request.client = None
+            await client._async_close()
+        return {"success": success}
+
+    async def _list_connections(self, params, request):
+        now = time.monotonic()
+        return [
+            {
+                "host": host,
+                "port": port,
+                "connected": connection.client.connected,
+                "busy": connection.lock.locked(),
+                "idle": round(now - connection.last_used, 1),
+            }
+            for (host, port), connection in self.connections.items()
+        ]
+
+    async def _close_connection(self, params, request):
+        key = self._resolve(params)
+        connection = self.connections.pop(key, None)
+        if connection is None:
+            return False
+        async with connection.lock:
+            await connection.client._async_close()
+        return True
+
+    async def _shutdown(self, params, request):
+        self.stop_event.set()
+        return True
+
+    async def _dispatch(self, message, request):
+        method = self.methods.get(message.get("method"))
+        if method is None:
+            request.send({"id": request.id, "error": "Unknown method."})
+            return
+        try:
+            result = await method(message.get("params") or {}, request)
+            request.send({"id": request.id, "result": result})
+        except asyncio.CancelledError:
+            request.send({"id": request.id, "error": "Cancelled."})
+            raise
+        except Exception as e:
+            request.send({"id": request.id, "error": str(e) or type(e).__name__})
+
+    async def _cancel(self, requests, request_id):
+        task, request = requests.get(request_id, (None, None))
+        if task is None:
+            return False
+        if request.client is not None:
+            # a follow ends with the server's ACK, the connection stays usable
+            await request.client._async_stop_follow()
+        else:
+            task.cancel()
+        return True
+
+    async def _handle_api(self, reader, writer):
+        requests = {}  # request id -> (task, DaemonRequest)
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write(json.dumps(message).encode("utf-8") + b"\n")
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    send({"id": None, "error": "Invalid JSON."})
+                    continue
+
+                request = DaemonRequest(message.get("id"), send)
+                if message.get("method") == "cancel":
+                    params = message.get("params") or {}
+                    result = await self._cancel(requests, params.get("request"))
+                    send({"id": request.id, "result": result})
+                    continue
+
+                task = asyncio.ensure_future(self._dispatch(message, request))
+                requests[request.id] = (task, request)
+                task.add_done_callback(
+                    lambda _, request_id=request.id: requests.pop(request_id, None)
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # updates finish without a listener, follows end with it
+            for task, request in list(requests.values()):
+                if request.client is not None:
+                    task.cancel()
+            writer.close()
+
+    async def _reap_connections(self):
+        while True:
+            await asyncio.sleep(CONNECTION_REAP_INTERVAL)
+            now = time.monotonic()
+            for key, connection in list(self.connections.items()):
+                if (
+                    not connection.lock.locked()
+                    and now - connection.last_used > self.idle_timeout
+                ):
+                    del self.connections[key]
+                    await connection.client._async_close()
+
+    def _is_running(self):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+
+    async def async_run(self):
+        self.stop_event = asyncio.Event()
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if self._is_running():
+                raise RuntimeError("Update daemon is already running.")
+            os.remove(self.socket_path)
+
+        server = await asyncio.start_unix_server(self._handle_api, self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        reaper = asyncio.ensure_future(self._reap_connections())
+        print(f"Update daemon started. ({self.socket_path})")
+        try:
+            await self.stop_event.wait()
+        finally:
+            reaper.cancel()
+            server.close()
+            await server.wait_closed()
+            for connection in self.connections.values():
+                await connection.client._async_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            print("Update daemon stopped.")
+
+    def run(self):
+        asyncio.run(self.async_run())
+
+
+def call(method, params=None, socket_path=DAEMON_SOCKET_PATH, on_event=None):
+    # one request to a running daemon, events are passed to on_event
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(os.path.expanduser(socket_path))
+        request = {"id": 1, "method": method, "params": params or {}}
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            for line in f:
+                message = json.loads(line)
+                if "event" in message:
+                    if on_event is not None:
+                        on_event(message)
+                elif "error" in message:
+                    raise Exception(message["error"])
+                else:
+                    return message["result"]
+    raise ConnectionError("Update daemon closed the connection.")
+
+
+def _print_event(message):
+    if message["event"] == "log":
+        print(f"{message['file']}: {message['data']}", end="")
+    else:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] {message.get('message', '')}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Client Daemon")
+    parser.add_argument("--socket", type=str, default=DAEMON_SOCKET_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run")
+    call_parser = subparsers.add_parser("call")
+    call_parser.add_argument("method", type=str)
+    call_parser.add_argument("params", type=str, nargs="?", default="{}")
+    opts = parser.parse_args(argv)
+
+    if opts.command == "run":
+        UpdateDaemon(opts.socket).run()
+        return 0
+
+    result = call(opts.method, json.loads(opts.params), opts.socket, _print_event)
+    print(json.dumps(result, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_util import FS_UPDATE_PORT
+
+EVENT_SOCKET_PATH = "~/.cache/morow_update/events_{port}.sock"
+EVENT_HISTORY_SIZE = 256  # events replayed to new subscribers
+EVENT_QUEUE_SIZE = 1024  # events buffered per subscriber
+EVENT_BATCH_INTERVAL = 0.2  # seconds to collect events before sending
+EVENT_BATCH_SIZE = 64  # events per line
+EVENT_HEARTBEAT_INTERVAL = 10  # seconds, an empty batch detects gone subscribers
+EVENT_HELLO_TIMEOUT = 5
+# only the latest pending event of a session is kept
+COALESCED_EVENTS = {"bytes", "progress"}
+
+# JSON lines over the socket:
+#   subscriber  {"since": 0}  last seq seen, 0 replays the whole history
+#   server      {"events": [{"seq": 1, "time": ..., "type": ..., "session": ...}],
+#                "dropped": 0}
+
+
+class EventSubscriber:
+    # bounded event buffer, the oldest events are dropped when a subscriber is slow
+
+    def __init__(self, max_events=EVENT_QUEUE_SIZE):
+        self.max_events = max_events
+        self.events = deque()
+        self.pending = {}  # (type, session) -> queued coalesced event
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, event):
+        with self.condition:
+            key = (event["type"], event.get("session"))
+            if event["type"] in COALESCED_EVENTS:
+                previous = self.pending.get(key)
+                if previous is not None:
+                    # replaced at the end, events stay in seq order
+                    self.events.remove(previous)
+                self.pending[key] = event
+            self.events.append(event)
+            while len(self.events) > self.max_events:
+                self._pop()
+                self.dropped += 1
+            self.condition.notify_all()
+
+    def _pop(self):
+        event = self.events.popleft()
+        key = (event["type"], event.get("session"))
+        if self.pending.get(key) is event:
+            del self.pending[key]
+        return event
+
+    def get_batch(self, timeout=EVENT_BATCH_INTERVAL, max_events=EVENT_BATCH_SIZE):
+        # returns ([event], dropped), waits for the first event up to timeout
+        with self.condition:
+            if not self.events and not self.closed:
+                self.condition.wait(timeout)
+            if self.events and len(self.events) < max_events and not self.closed:
+                # collect the burst that follows the first event
+                self.condition.wait(EVENT_BATCH_INTERVAL)
+            batch = []
+            while self.events and len(batch) < max_events:
+                batch.append(self._pop())
+            dropped, self.dropped = self.dropped, 0
+        return batch, dropped
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class EventHub:
+    # structured status events of the update sessions, kept for replay
+
+    def __init__(self, history_size=EVENT_HISTORY_SIZE):
+        self.sequence = 0
+        self.history = deque(maxlen=history_size)
+        self.coalesced = {}  # (type, session) -> latest coalesced event
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def publish(self, event_type, session=None, **fields):
+        with self.lock:
+            self.sequence += 1
+            event = dict(
+                seq=self.sequence,
+                time=round(time.time(), 3),
+                type=event_type,
+                session=session,
+                **fields,
+            )
+            if event_type in COALESCED_EVENTS:
+                # the history keeps only the latest one of a session
+                previous = self.coalesced.get((event_type, session))
+                if previous is not None and previous in self.history:
+                    self.history.remove(previous)
+                self.coalesced[(event_type, session)] = event
+            elif event_type == "session_ended":
+                for coalesced_type in COALESCED_EVENTS:
+                    self.coalesced.pop((coalesced_type, session), None)
+            self.history.append(event)
+            for subscriber in self.subscribers:
+                subscriber.put(event)
+        return event
+
+    def subscribe(self, since=0):
+        # replays the kept events after since, all of them after a server restart
+        subscriber = EventSubscriber()
+        with self.lock:
+            if since > self.sequence:
+                since = 0
+            for event in self.history:
+                if event["seq"] > since:
+                    subscriber.put(event)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+        subscriber.close()
+
+
+class EventHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.request.settimeout(EVENT_HELLO_TIMEOUT)
+        try:
+            hello = json.loads(self.rfile.readline() or b"{}")
+            since = int(hello.get("since") or 0)
+        except (OSError, ValueError, AttributeError):
+            return
+        self.request.settimeout(None)
+
+        hub = self.server.hub
+        subscriber = hub.subscribe(since)
+        last_sent = time.monotonic()
+        try:
+            while not self.server.stopped:
+                events, dropped = subscriber.get_batch()
+                if (
+                    not events
+                    and not dropped
+                    and time.monotonic() - last_sent < EVENT_HEARTBEAT_INTERVAL
+                ):
+                    continue
+                line = json.dumps({"events": events, "dropped": dropped})
+                self.wfile.write(line.encode("utf-8") + b"\n")
+                last_sent = time.monotonic()
+        except OSError:
+            pass
+        finally:
+            hub.unsubscribe(subscriber)
+
+
+class EventServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # local event channel for the backend, one thread per subscriber
+
+    daemon_threads = True
+
+    def __init__(self, hub, socket_path):
+        self.hub = hub
+        self.socket_path = os.path.expanduser(socket_path)
+        self.stopped = False
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        socketserver.UnixStreamServer.__init__(self, self.socket_path, EventHandler)
+        os.chmod(self.socket_path, 0o600)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def main(argv):
+    # prints the events of a running update server
+    parser = argparse.ArgumentParser(description="Update Server Events")
+    parser.add_argument("--port", type=int, default=FS_UPDATE_PORT)
+    parser.add_argument("--socket", type=str, help="default: events_<port>.sock")
+    parser.add_argument("--since", type=int, default=0)
+    opts = parser.parse_args(argv)
+
+    socket_path = os.path.expanduser(
+        opts.socket or EVENT_SOCKET_PATH.format(port=opts.port)
+    )
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"since": opts.since}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            for line in f:
+                batch = json.loads(line)
+                if batch["dropped"]:
+                    print(f"{batch['dropped']} events dropped.")
+                for event in batch["events"]:
+                    print(json.dumps(event))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_util import get_package_password
+
+MANIFEST_NAME = "MANIFEST.json"
+SIGNATURE_NAME = "MANIFEST.sig"
+VERSION_INFO_NAME = "version_info.txt"
+MANIFEST_FORMAT = 1
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def _read_umask_once():
+    # only at import, os.umask() changes the mask of every thread
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+STARTUP_UMASK = _read_umask_once()
+
+
+def current_umask():
+    # without touching it, /proc/self/status has it since Linux 4.7
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return STARTUP_UMASK
+
+
+class HashingReader:
+    # file object wrapper that hashes what tarfile reads from it
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def parse_version_info(text):
+    # "software_version: MR1.1.0" lines -> {"software_version": "MR1.1.0"}
+    version = {}
+    for line in text.splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            version[key.strip()] = value.strip()
+    return version
+
+
+def sign_manifest(manifest_bytes, password=None):
+    key = (password or get_package_password()).encode()
+    return hmac.new(key, manifest_bytes, hashlib.sha256).hexdigest().encode()
+
+
+class UpdateManifest:
+
+    def __init__(self, entries=None, version=None):
+        self.entries = entries or []  # path, type, size, mode, sha256 / target
+        self.version = version or {}
+
+    def add_tarinfo(self, tarinfo, sha256=None):
+        path = os.path.normpath(tarinfo.name)
+        entry = {"path": path, "mode": stat.S_IMODE(tarinfo.mode)}
+        if tarinfo.isreg():
+            entry.update(type="file", size=tarinfo.size, sha256=sha256)
+        elif tarinfo.isdir():
+            entry.update(type="dir")
+        elif tarinfo.issym():
+            entry.update(type="symlink", target=tarinfo.linkname)
+        else:
+            return
+        self.entries.append(entry)
+
+    def add_file(self, root, path):
+        # used when the manifest is built from an extracted tree
+        st = os.lstat(path)
+        entry = {
+            "path": os.path.relpath(path, root),
+            "mode": stat.S_IMODE(st.st_mode),
+        }
+        if stat.S_ISREG(st.st_mode):
+            entry.update(type="file", size=st.st_size, sha256=hash_file(path))
+        elif stat.S_ISDIR(st.st_mode):
+            entry.update(type="dir")
+        elif stat.S_ISLNK(st.st_mode):
+            entry.update(type="symlink", target=os.readlink(path))
+        else:
+            return
+        self.entries.append(entry)
+
+    def software_version(self):
+        return self.version.get("software_version", "")
+
+    def is_compatible(self, version_prefix):
+        return self.software_version().startswith(version_prefix)
+
+    def files(self):
+        return [entry for entry in self.entries if entry["type"] == "file"]
+
+    def dumps(self):
+        return json.dumps(
+            {
+                "format": MANIFEST_FORMAT,
+                "version": self.version,
+                "entries": self.entries,
+            },
+            indent=1,
+        ).encode("utf-8")
+
+    @classmethod
+    def loads(cls, manifest_bytes):
+        manifest = json.loads(manifest_bytes)
+        if manifest.get("format") != MANIFEST_FORMAT:
+            raise Exception("Unknown manifest format.")
+        return cls(manifest["entries"], manifest["version"])
+
+    @classmethod
+    def load(cls, directory, password=None):
+        # returns None for packages without a manifest, raises if it is not valid
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, "rb") as f:
+            manifest_bytes = f.read()
+        try:
+            with open(os.path.join(directory, SIGNATURE_NAME), "rb") as f:
+                signature = f.read().strip()
+        except OSError:
+            raise Exception("Manifest signature not found.")
+        if not hmac.compare_digest(signature, sign_manifest(manifest_bytes, password)):
+            raise Exception("Manifest signature mismatch.")
+        return cls.loads(manifest_bytes)
+
+
+def _verify_entry(directory, entry, umask=0):
+    path = os.path.join(directory, entry["path"])
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return f"{entry['path']}: missing"
+
+    if entry["type"] == "file":
+        if not stat.S_ISREG(st.st_mode) or st.st_size != entry["size"]:
+            return f"{entry['path']}: size mismatch"
+        # tar applies the umask unless it runs as root
+        if stat.S_IMODE(st.st_mode) not in (entry["mode"], entry["mode"] & ~umask):
+            return f"{entry['path']}: mode mismatch"
+        if hash_file(path) != entry["sha256"]:
+            return f"{entry['path']}: hash mismatch"
+    elif entry["type"] == "dir" and not stat.S_ISDIR(st.st_mode):
+        return f"{entry['path']}: not a directory"
+    elif entry["type"] == "symlink" and (
+        not stat.S_ISLNK(st.st_mode) or os.readlink(path) != entry["target"]
+    ):
+        return f"{entry['path']}: symlink mismatch"
+    return None
+
+
+def _unlisted_paths(directory, manifest):
+    # entries of the tree the signed manifest does not know about,
+    # parent directories of listed entries may be missing from a tar
+    listed = {MANIFEST_NAME, SIGNATURE_NAME}
+    for entry in manifest.entries:
+        path = os.path.normpath(entry["path"])
+        while path not in ("", "."):
+            listed.add(path)
+            path = os.path.dirname(path)
+
+    unlisted = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            rel = os.path.relpath(os.path.join(root, name), directory)
+            if rel not in listed:
+                unlisted.append(rel)
+        # nothing below an unlisted directory is listed either
+        dirs[:] = [
+            name
+            for name in dirs
+            if os.path.relpath(os.path.join(root, name), directory) in listed
+        ]
+    return unlisted
+
+
+def verify_tree(directory, manifest, workers=None, umask=None):
+    # returns the list of errors, files are hashed concurrently
+    # (hashlib releases the GIL while hashing large buffers)
+    if umask is None:
+        umask = current_umask()
+    errors = [f"{rel}: not in manifest" for rel in _unlisted_paths(directory, manifest)]
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        results = executor.map(
+            lambda entry: _verify_entry(directory, entry, umask), manifest.entries
+        )
+        return errors + [error for error in results if error]
+
+
+def create_manifest(directory):
+    manifest = UpdateManifest()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            if root == directory and name in (MANIFEST_NAME, SIGNATURE_NAME):
+                continue
+            manifest.add_file(directory, path)
+
+    version_path = os.path.join(directory, VERSION_INFO_NAME)
+    if os.path.exists(version_path):
+        with open(version_path, "r") as f:
+            manifest.version = parse_version_info(f.read())
+    return manifest
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Package Manifest")
+    parser.add_argument("command", choices=["create", "verify"])
+    parser.add_argument("directory", type=str)
+    opts = parser.parse_args(argv)
+
+    if opts.command == "create":
+        manifest_bytes = create_manifest(opts.directory).dumps()
+        with open(os.path.join(opts.directory, MANIFEST_NAME), "wb") as f:
+            f.write(manifest_bytes)
+        with open(os.path.join(opts.directory, SIGNATURE_NAME), "wb") as f:
+            f.write(sign_manifest(manifest_bytes))
+        return 0
+
+    manifest = UpdateManifest.load(opts.directory)
+    if manifest is None:
+        print("Manifest not found.")
+        return 1
+    errors = verify_tree(opts.directory, manifest)
+    for error in errors:
+        print(error)
+    print(f"{manifest.software_version()}: {len(errors)} error(s)")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import fnmatch
+import gzip
+import io
+import os
+import queue
+import string
+import sys
+import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import product
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_archive import (
+    ARCHIVE_FRAME_SIZE,
+    ARCHIVE_SUFFIX,
+    PACKAGE_FORMATS,
+    ArchiveWriter,
+    compress_frame,
+    encrypt_block,
+    supported_compressions,
+)
+from update_manifest import (
+    MANIFEST_NAME,
+    SIGNATURE_NAME,
+    VERSION_INFO_NAME,
+    HashingReader,
+    UpdateManifest,
+    parse_version_info,
+    sign_manifest,
+)
+from update_util import MR_UPDATE_PORT, get_package_password
+
+# same exclude list as script.sh encrypt
+EXCLUDES = [
+    "./.git",
+    "./.repo",
+    "./roboesim",
+    "./tools",
+    "*.tar.gz",
+    "*/meshes",
+    "*.csv",
+    "*.pdf",
+    "*.ply",
+    "*.onnx",
+    "*events.out.tfevents*",
+    "*/doc",
+    "*/morow3d/build",
+]
+
+PACK_BLOCK_SIZE = 1024 * 1024 * 8  # tar bytes per encrypted part
+PACK_CHUNK_SIZE = 1024 * 1024  # output chunk size
+
+
+def is_excluded(arcname, excludes=EXCLUDES):
+    # tar --exclude semantics: wildcards match '/', patterns without '/' match names
+    name = os.path.basename(arcname)
+    for pattern in excludes:
+        if fnmatch.fnmatch(arcname, pattern):
+            return True
+        if "/" not in pattern and fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def walk_tree(source_path, excludes=EXCLUDES):
+    # yields (arcname, path) in a stable order, directories before their contents
+    def _walk(directory, prefix):
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                arcname = f"{prefix}/{entry.name}"
+                if is_excluded(arcname, excludes):
+                    continue
+                yield arcname, entry.path
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk(entry.path, arcname)
+
+    with os.scandir(source_path) as entries:
+        # script.sh packs './*', which leaves out top level dot files
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.startswith("."):
+                continue
+            arcname = f"./{entry.name}"
+            if is_excluded(arcname, excludes):
+                continue
+            yield arcname, entry.path
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path, arcname)
+
+
+def part_names():
+    # part_aaaa, part_aaab, ... (sorted like split output)
+    for letters in product(string.ascii_lowercase, repeat=4):
+        yield "part_" + "".join(letters)
+
+
+class _BlockWriter:
+    # file object for tarfile that cuts the stream into fixed size blocks
+
+    def __init__(self, fn_block, block_size=PACK_BLOCK_SIZE):
+        self.fn_block = fn_block
+        self.block_size = block_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            self.fn_block(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.fn_block(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+class _OutputWriter:
+    # file object for the outer tar.gz, collects compressed output
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(0, zlib.DEFLATED, 31)  # gzip, stored
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        self.chunks.append(self.compressor.flush())
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class UpdatePacker:
+    # builds <package_name>.enc.tar.gz the same way as script.sh encrypt:
+    # tar.gz of the tree, split into parts, parts encrypted, parts packed into tar.gz.
+    # every part is an independent gzip member, so the merged parts are a valid
+    # multi-member gzip stream and compression and encryption run in parallel.
+    # package_format 2 writes the parts as frames of a seekable UpdateArchive.
+
+    def __init__(
+        self,
+        source_path,
+        package_name,
+        password=None,
+        excludes=EXCLUDES,
+        workers=None,
+        compresslevel=6,
+        manifest=True,
+        package_format=1,
+        compression="zlib",
+    ):
+        self.source_path = source_path
+        self.package_name = package_name
+        self.password = password or get_package_password()
+        self.excludes = excludes
+        self.workers = workers or os.cpu_count() or 1
+        self.compresslevel = compresslevel
+        self.with_manifest = manifest
+        self.manifest = None
+        self.members = {}  # arcname -> [start, end] in the tar stream
+        self.package_name = package_name
+        self.set_format(package_format, compression)
+        self.size = 0  # output bytes so far
+
+    def set_format(self, package_format, compression="zlib"):
+        self.package_format = package_format
+        self.compression = compression
+        suffix = ARCHIVE_SUFFIX if package_format == 2 else ".enc.tar.gz"
+        self.filename = f"{self.package_name}{suffix}"
+
+    def _process_block(self, block):
+        if self.package_format == 2:
+            data = compress_frame(block, self.compression, self.compresslevel)
+            return encrypt_block(data, self.password), len(block)
+        return encrypt_block(gzip.compress(block, self.compresslevel), self.password)
+
+    def _add(self, tar, arcname, path):
+        tarinfo = tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            return  # sockets, fifos
+
+        start = tar.offset
+        if tarinfo.isreg():
+            # hash while packing so the tree is read only once
+            with open(path, "rb") as f:
+                reader = HashingReader(f)
+                tar.addfile(tarinfo, reader)
+            self.manifest.add_tarinfo(tarinfo, reader.hexdigest())
+            if arcname == f"./{VERSION_INFO_NAME}":
+                with open(path, "r") as f:
+                    self.manifest.version = parse_version_info(f.read())
+        else:
+            tar.addfile(tarinfo)
+            self.manifest.add_tarinfo(tarinfo)
+        self.members[arcname] = [start, tar.offset]
+
+    def _add_bytes(self, tar, name, data):
+        tarinfo = tarfile.TarInfo(f"./{name}")
+        tarinfo.size = len(data)
+        tarinfo.mode = 0o644
+        tarinfo.mtime = int(datetime.now().timestamp())
+        start = tar.offset
+        tar.addfile(tarinfo, io.BytesIO(data))
+        self.members[tarinfo.name] = [start, tar.offset]
+
+    def _produce(self, executor, futures, stop):
+        def _submit(block):
+            if stop.is_set():
+                raise Exception("Packing cancelled.")
+            # the bounded queue keeps memory flat when the upload is slower
+            futures.put(executor.submit(self._process_block, block))
+
+        try:
+            block_writer = _BlockWriter(
+                _submit,
+                ARCHIVE_FRAME_SIZE if self.package_format == 2 else PACK_BLOCK_SIZE,
+            )
+            with tarfile.open(fileobj=block_writer, mode="w|") as tar:
+                self.manifest = UpdateManifest()
+                self.members = {}
+                for arcname, path in walk_tree(self.source_path, self.excludes):
+                    self._add(tar, arcname, path)
+                if self.with_manifest:
+                    # appended last, the file hashes are known only after packing
+                    manifest_bytes = self.manifest.dumps()
+                    self._add_bytes(tar, MANIFEST_NAME, manifest_bytes)
+                    self._add_bytes(
+                        tar,
+                        SIGNATURE_NAME,
+                        sign_manifest(manifest_bytes, self.password),
+                    )
+            block_writer.flush()
+            futures.put(None)
+        except Exception as e:
+            futures.put(e)
+
+    def pack(self, artifact_path=None):
+        # generator of output chunks, optionally also written to artifact_path
+        self.size = 0
+        stop = threading.Event()
+        futures = queue.Queue(self.workers * 2)
+        executor = ThreadPoolExecutor(self.workers)
+        producer = threading.Thread(
+            target=self._produce, args=(executor, futures, stop)
+        )
+        producer.daemon = True
+        producer.start()
+
+        artifact = open(artifact_path, "wb") if artifact_path else None
+        try:
+            if self.package_format == 2:
+                yield from self._pack_archive(futures, artifact)
+            else:
+                yield from self._pack_tar(futures, artifact)
+        finally:
+            stop.set()
+            # unblock the producer if it is waiting on a full queue
+            while producer.is_alive():
+                try:
+                    futures.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            executor.shutdown(wait=False)
+            if artifact:
+                artifact.close()
+
+    @staticmethod
+    def _results(futures):
+        # processed blocks in packing order
+        while True:
+            future = futures.get()
+            if future is None:
+                return
+            if isinstance(future, Exception):
+                raise future
+            yield future.result()
+
+    def _pack_tar(self, futures, artifact):
+        output = _OutputWriter()
+        names = part_names()
+        tar = tarfile.open(fileobj=output, mode="w|")
+        for data in self._results(futures):
+            tarinfo = tarfile.TarInfo(next(names) + ".enc")
+            tarinfo.size = len(data)
+            tarinfo.mtime = int(datetime.now().timestamp())
+            tar.addfile(tarinfo, io.BytesIO(data))
+
+            yield from self._emit(output.take(), artifact)
+        tar.close()
+        output.close()
+        yield from self._emit(output.take(), artifact)
+
+    def _pack_archive(self, futures, artifact):
+        writer = ArchiveWriter(self.password, self.compression)
+        yield from self._emit(writer.header(), artifact)
+        for data, size in self._results(futures):
+            yield from self._emit(writer.add_frame(data, size), artifact)
+        # the producer is done, every member offset is known
+        yield from self._emit(writer.finish(self.members), artifact)
+
+    def _emit(self, data, artifact):
+        for i in range(0, len(data), PACK_CHUNK_SIZE):
+            chunk = data[i : i + PACK_CHUNK_SIZE]
+            self.size += len(chunk)
+            if artifact:
+                artifact.write(chunk)
+            yield chunk
+
+
+def default_package_name(source_path):
+    return (
+        f"{os.path.basename(os.path.normpath(source_path))}"
+        f"_{datetime.now().strftime('%y%m%d_%H%M%S')}"
+    )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Package Packer")
+    parser.add_argument("source", type=str)
+    parser.add_argument("--name", type=str, default="")
+    parser.add_argument("--output", type=str, default="", help="write the package")
+    parser.add_argument("--host", type=str, default="", help="upload the package")
+    parser.add_argument("--port", type=int, default=MR_UPDATE_PORT)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument(
+        "--format",
+        type=int,
+        default=1,
+        choices=PACKAGE_FORMATS,
+        help="package format of --output, uploads negotiate it",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="zlib",
+        choices=supported_compressions(),
+        help="frame compression of format 2",
+    )
+    opts = parser.parse_args(argv)
+
+    package_name = opts.name or default_package_name(opts.source)
+    if opts.host:
+        from update_client import UpdateClient
+
+        client = UpdateClient()
+        client.connect(opts.host, opts.port)
+        client.select_source(
+            opts.source, package_name, artifact_path=opts.output or None
+        )
+        result = client.update(save_logs=False)
+        client.close()
+        return 0 if result else 1
+
+    packer = UpdatePacker(
+        opts.source,
+        package_name,
+        workers=opts.workers or None,
+        package_format=opts.format,
+        compression=opts.compression,
+    )
+    output = opts.output or packer.filename
+    for _ in packer.pack(output):
+        pass
+    print(f"{output} ({packer.size} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
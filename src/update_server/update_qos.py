@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import struct
+import threading
+import time
+
+TCP_INFO_RTT_OFFSET = 68  # struct tcp_info.tcpi_rtt (usec)
+# tcpi_rtt is sampled from acks of sent data and goes stale on the receiving
+# side, the receiver estimate is tcpi_rcv_rtt (usec)
+TCP_INFO_RCV_RTT_OFFSET = 92
+
+ADAPTIVE_INTERVAL = 1.0  # seconds between rtt samples
+ADAPTIVE_RTT_FACTOR = 2.0  # back off when rtt > base rtt * factor
+ADAPTIVE_DECREASE = 0.7
+ADAPTIVE_INCREASE = 0.1  # of max rate per interval
+ADAPTIVE_MIN_RATE = 1024 * 64
+
+
+class TokenBucket:
+    # rate: bytes per second (0 = unlimited)
+
+    def __init__(self, rate=0, burst=None):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0
+        self.timestamp = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = max(0, int(rate))
+            # allow about 100 ms of traffic as burst by default
+            self.burst = burst or max(1024 * 64, self.rate // 10)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, n):
+        # take n tokens and return how long the caller has to wait for them
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.timestamp) * self.rate
+            )
+            self.timestamp = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def consume(self, n):
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_consume(self, n):
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def get_tcp_rtt(sock, receiving=False):
+    # smoothed rtt of a connected tcp socket in seconds (linux only),
+    # receiving: measured on the data received instead of the data sent
+    offset = TCP_INFO_RCV_RTT_OFFSET if receiving else TCP_INFO_RTT_OFFSET
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        rtt = struct.unpack_from("I", info, offset)[0]
+    except (AttributeError, OSError, struct.error):
+        return None
+    return rtt / 1000000 if rtt else None
+
+
+class AdaptiveRate:
+    # AIMD on the measured rtt: back off when the link queue builds up.
+    # receiving: the bucket limits data read from the socket
+
+    def __init__(
+        self, bucket, max_rate, min_rate=ADAPTIVE_MIN_RATE, receiving=False
+    ):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.receiving = receiving
+        self.base_rtt = None
+        self.rtt = None
+        self.timestamp = 0.0
+
+    def update(self, sock):
+        now = time.monotonic()
+        if self.max_rate <= 0 or now - self.timestamp < ADAPTIVE_INTERVAL:
+            return
+        self.timestamp = now
+
+        self.rtt = get_tcp_rtt(sock, self.receiving)
+        if self.rtt is None:
+            return
+        if self.base_rtt is None or self.rtt < self.base_rtt:
+            self.base_rtt = self.rtt
+
+        rate = self.bucket.rate or self.max_rate
+        if self.rtt > self.base_rtt * ADAPTIVE_RTT_FACTOR:
+            rate = max(self.min_rate, int(rate * ADAPTIVE_DECREASE))
+        else:
+            rate = min(self.max_rate, int(rate + self.max_rate * ADAPTIVE_INCREASE))
+        self.bucket.set_rate(rate)
+
+
+def limit_rate(requested, ceiling):
+    # 0 means unlimited on both sides
+    if ceiling <= 0:
+        return requested
+    if requested <= 0:
+        return ceiling
+    return min(requested, ceiling)
+
+
+def format_rate_limit(upload, download, adaptive=False):
+    return f"{int(upload)},{int(download)},{int(bool(adaptive))}"
+
+
+def parse_rate_limit(text):
+    upload, download, adaptive = text.split(",")
+    return int(upload), int(download), adaptive == "1"
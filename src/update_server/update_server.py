@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 import argparse
 import asyncio
-import base64
+import errno
+import json
 import os
+import queue
 import re
+import select
 import shutil
 import socket
 import socketserver
@@ -13,6 +16,8 @@ import subprocess
 import sys
 import threading
 import time
+import uuid
+from collections import deque
 
 cwd = os.path.dirname(os.path.abspath(__file__))
 os.sys.path.append(cwd)
@@ -20,23 +25,89 @@ os.sys.path.append(cwd)
 from update_util import (
     FS_UPDATE_PORT,
     MAX_CHUNK_SIZE,
+    MAX_CONTROL_FRAME_SIZE,
+    MAX_FRAME_SIZES,
     MR_UPDATE_PORT,
+    MUX_HEADER_LENGTH,
+    MUX_CHANNEL_CTRL,
+    MUX_CHANNEL_PORTS,
+    MUX_QUANTUM,
+    MUX_QUEUE_SIZE,
+    PARALLEL_OFFSET_SIZE,
     PROTOCOL_ACK,
     PROTOCOL_AUTH,
     PROTOCOL_BASH,
     PROTOCOL_DATA,
     PROTOCOL_DCHK,
+    PROTOCOL_DEND,
     PROTOCOL_FAIL,
     PROTOCOL_INFO,
     PROTOCOL_LENGTH,
     PROTOCOL_LOGS,
     PROTOCOL_MDAT,
+    PROTOCOL_MFOL,
     PROTOCOL_MINF,
     PROTOCOL_MLOG,
+    PROTOCOL_MQRY,
+    PROTOCOL_MSTP,
+    PROTOCOL_MUXO,
+    PROTOCOL_MUXW,
+    PROTOCOL_PDAT,
+    PROTOCOL_PEND,
+    PROTOCOL_PINF,
+    PROTOCOL_PJON,
+    PROTOCOL_RATE,
     PROTOCOL_STEP,
     PROTOCOL_VERS,
     decode_auth_token,
     get_ip_address,
+    get_package_password,
+    pack_mux_frame,
+    parse_mux_weights,
+    unpack_mux_frame,
+)
+from build_prewarm import (
+    BuildPrewarm,
+    cache_environment,
+    format_environment,
+    format_hit_rate,
+    read_cache_stats,
+)
+from config_carryover import (
+    ConfigCarryOver,
+    format_report as format_carryover_report,
+)
+from db_carryover import (
+    DB_SNAPSHOT_DIRECTORY,
+    ROBOT_API_DATA,
+    DatabaseCarryOver,
+    format_report as format_db_report,
+)
+from fs_sync import FsSync, format_report as format_sync_report
+from log_follow import LogWatcherHub
+from log_query import LogCompressor, LogQuery, get_log_directory
+from package_installer import PackageInstaller, format_report
+from update_archive import (
+    UpdateArchive,
+    format_capabilities,
+    is_archive,
+    split_package_name,
+)
+from update_events import EVENT_SOCKET_PATH, EventHub, EventServer
+from update_manifest import (
+    MANIFEST_NAME,
+    VERSION_INFO_NAME,
+    UpdateManifest,
+    current_umask,
+    parse_version_info,
+    verify_tree,
+)
+from update_qos import (
+    AdaptiveRate,
+    TokenBucket,
+    format_rate_limit,
+    limit_rate,
+    parse_rate_limit,
 )
 
 MR_INSTALL_SCRIPT = "mr_update.sh"
@@ -47,56 +118,485 @@ VERSION_IDENTIFIER = "software_version"
 MR_VERNAME_PREFIX = "MR"
 FS_VERNAME_PREFIX = "FS"
 
+STAGING_PREFIX = "rundwn_"
+
+# session limits, see UpdateServer
+MAX_CONNECTIONS = 32
+AUTH_TIMEOUT = 10  # seconds from connect to authentication
+IDLE_TIMEOUT = 300  # seconds between frames
+FRAME_TIMEOUT = 30  # seconds to receive the rest of a frame or to send one
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+BYTES_EVENT_INTERVAL = 0.5  # seconds between upload progress events
+
 version = "1.0.0"
 # 1.0.0 - 2024. 10. 23 initial release
 
 
-class RequestHandler(socketserver.BaseRequestHandler):
+class FrameTooLarge(Exception):
+    pass
+
+
+def sweep_staging(script_directory):
+    # removes staging directories left by server processes that no longer run
+    for name in os.listdir(script_directory):
+        port_directory = os.path.join(script_directory, name)
+        if not name.startswith(STAGING_PREFIX) or not os.path.isdir(port_directory):
+            continue
+        for entry in os.listdir(port_directory):
+            pid = entry.split("_", 1)[0]
+            if pid.isdigit() and _is_process_alive(int(pid)):
+                continue
+            path = os.path.join(port_directory, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ParallelUpload:
+    # preallocated file written at offsets by several connections
+
+    def __init__(self, path, size, session_id=None):
+        self.token = uuid.uuid4().hex
+        self.path = path
+        self.size = size
+        self.session_id = session_id  # session of the events of joined connections
+        self.ranges = []  # written [start, end), sorted and merged
+        self.lock = threading.Lock()
+        # pwrite runs outside the lock, close() waits for the running writes
+        self.writers = 0
+        self.writers_done = threading.Condition(self.lock)
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # fails fast when the disk is too small for the package
+            os.posix_fallocate(self.fd, 0, max(size, 1))
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                os.close(self.fd)
+                raise
+            os.ftruncate(self.fd, size)
+
+    def write(self, offset, data):
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError("Data out of range.")
+        with self.lock:
+            if self.fd is None:
+                raise ValueError("Upload closed.")
+            fd = self.fd
+            self.writers += 1
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            with self.lock:
+                self.writers -= 1
+                self.writers_done.notify_all()
+
+        with self.lock:
+            ranges = self.ranges + [(offset, offset + len(data))]
+            ranges.sort()
+            self.ranges = [ranges[0]]
+            for start, end in ranges[1:]:
+                if start <= self.ranges[-1][1]:
+                    self.ranges[-1] = (
+                        self.ranges[-1][0],
+                        max(self.ranges[-1][1], end),
+                    )
+                else:
+                    self.ranges.append((start, end))
+
+    def is_covered(self, offset, length):
+        if length == 0:
+            return True
+        with self.lock:
+            return any(
+                start <= offset and offset + length <= end for start, end in self.ranges
+            )
+
+    def is_complete(self):
+        return self.is_covered(0, self.size)
+
+    def received(self):
+        with self.lock:
+            return sum(end - start for start, end in self.ranges)
+
+    def close(self):
+        with self.lock:
+            self.writers_done.wait_for(lambda: self.writers == 0)
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+class UpdateSession:
+
+    def __init__(self, server, client_address, port, send_packet, sock=None):
+        self.server = server
+        self.client_address = client_address
+        self.port = port  # MR_UPDATE_PORT or FS_UPDATE_PORT
+        self.send_packet = send_packet
+        self.sock = sock  # used for rtt measurement
+
+        # rate limits (bytes/sec, 0 = unlimited), capped by the server settings
+        self.upload_bucket = TokenBucket(server.max_upload_rate)
+        self.download_bucket = TokenBucket(server.max_download_rate)
+        self.upload_adaptive = None
+        self.download_adaptive = None
 
-    def setup(self):
-        self.request.settimeout(None)
         self.filename = ""  # file name
         self.filesize = 0  # file size
 
         self.file_stream = None  # file object
         self.datasize = 0  # recved data size
+        self.parallel_upload = None  # ParallelUpload created or joined
 
         self.is_auth_verified = False
         self.is_info_verified = False  # file info verified
         self.is_data_verified = False  # file data verified
 
-        self.install_directory = os.path.expanduser("~/catkin_ws/")
+        self.install_directory = os.path.expanduser(server.install_directory)
+        self.script_directory = server.script_directory
+        # staging directory of this session only: {pid}_{session}
+        self.session_id = uuid.uuid4().hex[:8]
         self.save_directory = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            f"rundwn_{self.server.server_address[1]}",
+            self.script_directory,
+            f"{STAGING_PREFIX}{self.port}",
+            f"{os.getpid()}_{self.session_id}",
         )
+        self.install_target = None  # verified package moved to the install directory
+        self.install_started = False
         self.decrypted_name = ""  # decrypted directory
+        self.manifest = None  # manifest of the verified package
         self.log_string = ""
         self.version_prefix = (
-            MR_VERNAME_PREFIX
-            if self.server.server_address[1] == MR_UPDATE_PORT
-            else FS_VERNAME_PREFIX
+            MR_VERNAME_PREFIX if self.port == MR_UPDATE_PORT else FS_VERNAME_PREFIX
         )
         self.update_script = (
-            MR_INSTALL_SCRIPT
-            if self.server.server_address[1] == MR_UPDATE_PORT
-            else FS_INSTALL_SCRIPT
+            MR_INSTALL_SCRIPT if self.port == MR_UPDATE_PORT else FS_INSTALL_SCRIPT
         )
         self.decrypt_script = DECRYPT_SCRIPT
 
-    def _cleanup(self):
+        self.follow_thread = None  # sends followed log lines
+        self.follow_stop = threading.Event()
+
+        self.bytes_published = 0.0  # time of the last upload progress event
+        self._publish(
+            "session_started",
+            peer=f"{client_address[0]}:{client_address[1]}",
+            port=port,
+        )
+
+    def _reset_upload(self):
+        # a kept connection uploads the next package in the same session
         self.datasize = 0
+        self.is_data_verified = False
         if self.file_stream:
             self.file_stream.close()
             self.file_stream = None
+        self._close_parallel_upload()
+
+    def _remove_install_target(self):
+        # a verified package that was never installed
+        if self.install_target is not None and not self.install_started:
+            shutil.rmtree(self.install_target, ignore_errors=True)
+        self.install_target = None
+
+    def _start_upload(self):
+        # state of the previous package of a kept connection, DCHK and BASH
+        # read log_string and must not see the output of that package
+        self._reset_upload()
+        self._remove_install_target()
+        self.install_started = False
+        self.manifest = None
+        self.log_string = ""
+
+    def _cleanup(self):
+        self._reset_upload()
 
         shutil.rmtree(self.save_directory, ignore_errors=True)
+        self._remove_install_target()
+
+        self.follow_stop.set()
+        self._publish("session_ended")
+
+    def _publish(self, event_type, session_id=None, **fields):
+        self.server.events.publish(event_type, session_id or self.session_id, **fields)
+
+    def _publish_bytes(self, received, total, session_id=None):
+        # throttled, the last chunk of a known size is always published
+        now = time.monotonic()
+        if received != total and now - self.bytes_published < BYTES_EVENT_INTERVAL:
+            return
+        self.bytes_published = now
+        self._publish("bytes", session_id, received=received, total=total)
+
+    def _install_packages(self):
+        # skips wheels and editable packages installed before with the same hash
+        report = PackageInstaller(os.path.join(self.install_directory, "src")).run()
+        self.log_string += "\n\n" + report["log"] + "\n\n" + format_report(report)
+        self._send_packet(
+            PROTOCOL_STEP
+            + (
+                f"Packages: {len(report['installed'])} installed, "
+                f"{len(report['skipped'])} skipped, {len(report['failed'])} failed"
+            ).encode("utf-8")
+        )
+
+    def _sync_fs_tree(self):
+        # compare while the UI is still running, copy only changed files after shutdown
+        sync = FsSync(
+            os.path.join(self.install_directory, self.decrypted_name),
+            os.path.join(self.install_directory, "src"),
+            os.path.join(
+                self.install_directory,
+                f"fs_src_backup_{time.strftime('%y%m%d%H%M%S')}",
+            ),
+        )
+        self._publish("phase", phase="sync")
+        self._send_packet(PROTOCOL_STEP + b"Comparing UI trees...")
+        plan = sync.plan()
+
+        self._send_packet(PROTOCOL_STEP + b"Shutting down UI...")
+        self.excute_bash(
+            f"cd {self.install_directory} && ./{self.update_script} shutdown",
+            async_mode=False,
+        )
+        report = sync.apply(plan)
+        self.log_string += "\n\n" + format_sync_report(report)
+        self._send_packet(
+            PROTOCOL_STEP
+            + (
+                f"UI sync: {report['copied']} copied, {report['deleted']} deleted, "
+                f"{report['unchanged']} unchanged, {len(report['kept'])} kept"
+            ).encode("utf-8")
+        )
+        return report
+
+    def _carry_over_config(self):
+        # robot specific files of the running version into the new tree,
+        # before mr_update.sh swaps the trees; False: the script copies them
+        carry_over = ConfigCarryOver(
+            os.path.join(self.install_directory, "src"),
+            os.path.join(self.install_directory, self.decrypted_name),
+        )
+        self._send_packet(PROTOCOL_STEP + b"Carrying over config files...")
+        try:
+            report = carry_over.apply()
+        except OSError as e:
+            self.log_string += "\n\n====== config carry-over ======\n\n" + str(e)
+            return False
+        self.log_string += "\n\n" + format_carryover_report(report)
+        return True
+
+    def _snapshot_database(self):
+        # robot-api keeps serving while its databases are copied, fs_update.sh
+        # swaps the snapshot in after the shutdown; None: the script copies them
+        carry_over = DatabaseCarryOver(
+            os.path.join(self.install_directory, DB_SNAPSHOT_DIRECTORY)
+        )
+        self._send_packet(PROTOCOL_STEP + b"Taking database snapshot...")
+        try:
+            report = carry_over.snapshot(
+                os.path.join(self.install_directory, "src", ROBOT_API_DATA)
+            )
+        except Exception as e:
+            self.log_string += "\n\n====== database snapshot ======\n\n" + str(e)
+            shutil.rmtree(carry_over.snapshot_directory, ignore_errors=True)
+            return None
+        self.log_string += "\n\n" + format_db_report(report)
+        return carry_over.snapshot_directory
+
+    def _prewarm_build(self, build):
+        # returns the build report, None if the new version does not build
+        self._publish("phase", phase="build")
+        self._send_packet(PROTOCOL_STEP + b"Prewarming build cache...")
+        try:
+            build.prepare()
+        except (OSError, shutil.Error) as e:
+            self.log_string += "\n\n====== prewarm build ======\n\n" + str(e)
+            self._send_packet(PROTOCOL_FAIL + b"Prewarm build failed.")
+            return None
+
+        before = read_cache_stats(build.cache_directory)
+        started = time.monotonic()
+        returncode = self.excute_bash(build.build_command(), show_progress=True)
+        after = read_cache_stats(build.cache_directory)
+        report = (
+            f"prewarm build {time.monotonic() - started:.1f}s, "
+            f"cache hit {format_hit_rate(before, after)}"
+        )
+        self.log_string += "\n\n" + report
+        if returncode != 0:
+            # the running version was not touched
+            self._send_packet(
+                PROTOCOL_FAIL + b"Prewarm build failed, current version kept."
+            )
+            return None
+        return report
+
+    def is_busy(self):
+        # sessions following a log may be silent for a long time
+        return (
+            self.follow_thread is not None
+            and self.follow_thread.is_alive()
+            and not self.follow_stop.is_set()
+        )
+
+    def handle_message(self, msg_bytes):
+        # a failed command is answered, the client would wait for a reply forever
+        try:
+            self.process_message(msg_bytes)
+        except (ConnectionError, socket.timeout):
+            raise
+        except Exception as e:
+            print(e)
+            self._send_packet(PROTOCOL_FAIL + str(e).encode("utf-8"))
+
+    def _close_parallel_upload(self):
+        # only the session that created the upload owns it
+        if self.parallel_upload is not None and self.filename:
+            self.server.unregister_upload(self.parallel_upload)
+            self.parallel_upload.close()
+        self.parallel_upload = None
+
+    def _follow_log(self, log_directory, subscriber):
+        last_name = ""
+        try:
+            while not self.follow_stop.is_set():
+                batch, dropped = subscriber.get_batch()
+                if dropped:
+                    self._send_packet(
+                        PROTOCOL_STEP + f"{dropped} lines dropped.".encode("utf-8")
+                    )
+                for name, data in batch:
+                    if name != last_name:
+                        # send file info (size is unknown)
+                        self._send_packet(PROTOCOL_MINF + f"{name},-1".encode("utf-8"))
+                        last_name = name
+                    self._send_packet(PROTOCOL_MDAT + data)
+            self._send_packet(PROTOCOL_ACK)
+        except OSError as e:
+            print(e)
+        finally:
+            self.server.log_watchers.unsubscribe(log_directory, subscriber)
+            print("Log follow stopped.")
+
+    def _verify_manifest(self, directory):
+        try:
+            self.manifest = UpdateManifest.load(directory)
+        except Exception as e:
+            self._send_packet(PROTOCOL_FAIL + str(e).encode("utf-8"))
+            return False
+
+        # version metadata is structured, no need to search the decrypt log
+        if not self.manifest.is_compatible(self.version_prefix):
+            self._send_packet(PROTOCOL_FAIL + b"File is not compatible.")
+            return False
+
+        errors = verify_tree(directory, self.manifest, umask=self.server.umask)
+        if errors:
+            self.log_string += "\n\n====== manifest ======\n\n" + "\n".join(errors)
+            self._send_packet(PROTOCOL_FAIL + b"File verification failed.")
+            return False
+
+        self.log_string += (
+            f"\n\n{self.manifest.software_version()}: "
+            f"{len(self.manifest.entries)} manifest entries verified."
+        )
+        return True
+
+    def _extract_archive(self, package_path, directory):
+        # v2 packages: version_info.txt is read from the index before anything
+        # is extracted, the frames are then decompressed by all cores
+        self._publish("phase", phase="extract")
+        try:
+            with UpdateArchive(package_path) as archive:
+                try:
+                    version_info = archive.read(VERSION_INFO_NAME).decode("utf-8")
+                except KeyError:
+                    self._send_packet(PROTOCOL_FAIL + b"File is not valid.")
+                    return False
+                self.log_string += "\n\n" + version_info
+                package_version = parse_version_info(version_info)
+                if VERSION_IDENTIFIER not in package_version:
+                    self._send_packet(PROTOCOL_FAIL + b"File is not valid.")
+                    return False
+                software_version = package_version[VERSION_IDENTIFIER]
+                if not software_version.startswith(self.version_prefix):
+                    self._send_packet(PROTOCOL_FAIL + b"File is not compatible.")
+                    return False
+                archive.extract(directory)
+        except Exception as e:
+            self.log_string += "\n\n====== extract ======\n\n" + str(e)
+            self._send_packet(PROTOCOL_FAIL + b"File decryption failed.")
+            return False
+        return True
+
+    def _script_supports(self, hook):
+        # the install script comes from the package and may predate the hook
+        try:
+            with open(os.path.join(self.install_directory, self.update_script)) as f:
+                return hook in f.read()
+        except OSError:
+            return False
+
+    def _send_packet(self, msg_bytes, publish=True):
+        self.download_bucket.consume(len(msg_bytes))
+        if self.download_adaptive and self.sock:
+            self.download_adaptive.update(self.sock)
+        self.send_packet(msg_bytes)
+
+        # steps and failures shown to the client are also status events
+        command = msg_bytes[:PROTOCOL_LENGTH]
+        if publish and command in (PROTOCOL_STEP, PROTOCOL_FAIL):
+            self._publish(
+                "step" if command == PROTOCOL_STEP else "failed",
+                message=msg_bytes[PROTOCOL_LENGTH:].decode("utf-8", errors="replace"),
+            )
+
+    def set_rate_limit(self, upload, download, adaptive=False):
+        upload = limit_rate(upload, self.server.max_upload_rate)
+        download = limit_rate(download, self.server.max_download_rate)
+        self.upload_bucket.set_rate(upload)
+        self.download_bucket.set_rate(download)
+        # uploads are received here, their rtt is the receiver estimate
+        self.upload_adaptive = (
+            AdaptiveRate(self.upload_bucket, upload, receiving=True)
+            if adaptive and upload
+            else None
+        )
+        self.download_adaptive = (
+            AdaptiveRate(self.download_bucket, download)
+            if adaptive and download
+            else None
+        )
+        return upload, download
+
+    def _send_progress(self, percent):
+        self._send_packet(
+            PROTOCOL_STEP + f"Processing... {percent}/100".encode("utf-8"),
+            publish=False,
+        )
+        self._publish("progress", percent=percent)
 
     def excute_bash(self, command, async_mode=True, show_progress=False):
+        # returns the exit status of the command
         if async_mode:
-            asyncio.run(self.async_excute_bash(command, show_progress))
+            return asyncio.run(self.async_excute_bash(command, show_progress))
         else:
-            self.sync_excute_bash(command)
+            return self.sync_excute_bash(command)
 
     def sync_excute_bash(self, command):
         result = subprocess.run(
@@ -112,6 +612,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
             self.log_string += result.stderr
 
         # print("log string: " + self.log_string)
+        return result.returncode
 
     async def async_excute_bash(self, command, show_progress=False):
         # Create a subprocess
@@ -122,23 +623,24 @@ class RequestHandler(socketserver.BaseRequestHandler):
             limit=1024 * 1024 * 3,
         )
 
+        # read the output while waiting, long builds would fill the pipes
+        output = asyncio.ensure_future(process.communicate())
+
         if show_progress:
             progress = 1
             while True:
                 # Send a processing packet every 5 seconds
-                self._send_packet(
-                    PROTOCOL_STEP + f"Processing... {progress}/100".encode("utf-8")
-                )
+                self._send_progress(progress)
                 if progress <= 99:
                     progress += 1
                 await asyncio.sleep(5)
 
                 # Check if the process has terminated
-                if process.returncode is not None:
+                if output.done():
                     break
 
         # Get the output
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await output
         # stdout = process.stdout
         # stderr = process.stderr
 
@@ -151,16 +653,17 @@ class RequestHandler(socketserver.BaseRequestHandler):
         # print("log string: " + self.log_string)
         if show_progress:
             for i in range(progress, 101):
-                self._send_packet(
-                    PROTOCOL_STEP + f"Processing... {i}/100".encode("utf-8")
-                )
+                self._send_progress(i)
+        return process.returncode
 
     def process_message(self, msg_bytes):
         # recv message
         command, data = msg_bytes[:PROTOCOL_LENGTH], msg_bytes[PROTOCOL_LENGTH:]
 
         if command == PROTOCOL_VERS:
-            self._send_packet(PROTOCOL_VERS + version.encode())
+            # clients sending their capabilities get the package formats back
+            reply = f"{version};{format_capabilities()}" if data else version
+            self._send_packet(PROTOCOL_VERS + reply.encode())
 
         elif command == PROTOCOL_AUTH:
             # authentication
@@ -168,6 +671,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
             if port == self.client_address[1]:
                 self.is_auth_verified = True
                 self._send_packet(PROTOCOL_ACK)
+                self._publish("authenticated")
 
                 print("Authentication successful.")
             else:
@@ -178,14 +682,23 @@ class RequestHandler(socketserver.BaseRequestHandler):
                 self._send_packet(PROTOCOL_FAIL + b"Authentication required.")
                 return
 
-            if command == PROTOCOL_INFO:
+            if command == PROTOCOL_RATE:
+                # configure rate limits of this session
+                upload, download, adaptive = parse_rate_limit(data.decode())
+                upload, download = self.set_rate_limit(upload, download, adaptive)
+                self._send_packet(
+                    PROTOCOL_ACK
+                    + format_rate_limit(upload, download, adaptive).encode()
+                )
+
+            elif command == PROTOCOL_INFO:
                 # get file information
                 self.filename, self.filesize = data.decode().split(",")
-                self.filesize = int(self.filesize)
+                self.filesize = int(self.filesize)  # -1: streamed, size sent by DEND
                 # check if file is valid
-                match = re.match(r"^(.*)\.enc\.tar\.gz$", self.filename)
-                if match:
-                    self.decrypted_name = match.group(1)
+                decrypted_name = split_package_name(self.filename)
+                if decrypted_name:
+                    self.decrypted_name = decrypted_name
                     self.is_info_verified = True
                 else:
                     self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
@@ -193,6 +706,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
                     return
 
                 # create save directory
+                self._start_upload()
                 shutil.rmtree(self.save_directory, ignore_errors=True)
                 os.makedirs(self.save_directory, exist_ok=True)
                 # create file object
@@ -200,6 +714,9 @@ class RequestHandler(socketserver.BaseRequestHandler):
                     os.path.join(self.save_directory, self.filename), "wb"
                 )
                 self._send_packet(PROTOCOL_ACK)
+                self._publish(
+                    "phase", phase="upload", filename=self.filename, size=self.filesize
+                )
 
                 print("File information received.")
             elif command == PROTOCOL_DATA:
@@ -207,9 +724,15 @@ class RequestHandler(socketserver.BaseRequestHandler):
                     self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
                     return
 
+                # throttle the upload by delaying the next read
+                self.upload_bucket.consume(len(data))
+                if self.upload_adaptive and self.sock:
+                    self.upload_adaptive.update(self.sock)
+
                 # write data to file
                 self.datasize += len(data)
                 self.file_stream.write(data)
+                self._publish_bytes(self.datasize, self.filesize)
 
                 if self.datasize == self.filesize:
                     self.file_stream.close()
@@ -218,28 +741,156 @@ class RequestHandler(socketserver.BaseRequestHandler):
                     print("File transmission completed.")
                     self._send_packet(PROTOCOL_ACK)
 
-            elif command == PROTOCOL_DCHK:
-                if self.datasize != self.filesize:
-                    self._send_packet(PROTOCOL_FAIL + b"File size mismatch.")
+            elif command == PROTOCOL_PINF:
+                # get file information, data arrives over several connections
+                self.filename, self.filesize = data.decode().split(",")
+                self.filesize = int(self.filesize)
+                if self.filesize < 0:
+                    self._send_packet(PROTOCOL_FAIL + b"Invalid file size.")
+                    self.is_info_verified = False
+                    return
+                # check if file is valid
+                decrypted_name = split_package_name(self.filename)
+                if decrypted_name:
+                    self.decrypted_name = decrypted_name
+                else:
+                    self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
+                    self.is_info_verified = False
                     return
 
-                # move bash script to save directory
-                shutil.copy(
-                    os.path.join(cwd, self.decrypt_script),
-                    self.save_directory,
+                # create save directory
+                self._start_upload()
+                shutil.rmtree(self.save_directory, ignore_errors=True)
+                os.makedirs(self.save_directory, exist_ok=True)
+                # preallocate file
+                try:
+                    self.parallel_upload = ParallelUpload(
+                        os.path.join(self.save_directory, self.filename),
+                        self.filesize,
+                        self.session_id,
+                    )
+                except OSError as e:
+                    self._send_packet(
+                        PROTOCOL_FAIL + f"Preallocation failed: {e.strerror}".encode()
+                    )
+                    self.is_info_verified = False
+                    return
+                self.is_info_verified = True
+                self.server.register_upload(self.parallel_upload)
+                self._send_packet(PROTOCOL_ACK + self.parallel_upload.token.encode())
+                self._publish(
+                    "phase", phase="upload", filename=self.filename, size=self.filesize
                 )
 
-                # decrypt file
-                self.excute_bash(
-                    f"cd {self.save_directory} && ./{self.decrypt_script} decrypt {self.filename} {base64.b64decode('cm9ib2VeXjIxMDkwMQ==').decode('ascii')}"
+                print("Parallel file information received.")
+
+            elif command == PROTOCOL_PJON:
+                # join an upload started by another connection
+                self.parallel_upload = self.server.find_upload(data.decode())
+                if self.parallel_upload is None:
+                    self._send_packet(PROTOCOL_FAIL + b"Upload not found.")
+                    return
+                self._send_packet(PROTOCOL_ACK)
+
+            elif command == PROTOCOL_PDAT:
+                if self.parallel_upload is None:
+                    self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
+                    return
+
+                # throttle the upload by delaying the next read
+                self.upload_bucket.consume(len(data))
+                if self.upload_adaptive and self.sock:
+                    self.upload_adaptive.update(self.sock)
+
+                # write data at its offset
+                offset = struct.unpack(">Q", data[:PARALLEL_OFFSET_SIZE])[0]
+                try:
+                    self.parallel_upload.write(offset, data[PARALLEL_OFFSET_SIZE:])
+                except (OSError, ValueError) as e:
+                    self._send_packet(PROTOCOL_FAIL + str(e).encode("utf-8"))
+                    return
+                self._publish_bytes(
+                    self.parallel_upload.received(),
+                    self.parallel_upload.size,
+                    self.parallel_upload.session_id,
                 )
-                # check if directory exists
+
+            elif command == PROTOCOL_PEND:
+                if self.parallel_upload is None:
+                    self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
+                    return
+
+                offset, length = (int(v) for v in data.decode().split(","))
+                if self.parallel_upload.is_covered(offset, length):
+                    self._send_packet(PROTOCOL_ACK)
+                else:
+                    self._send_packet(PROTOCOL_FAIL + b"Range incomplete.")
+
+            elif command == PROTOCOL_DEND:
+                if not self.is_info_verified or self.filesize >= 0:
+                    self._send_packet(PROTOCOL_FAIL + b"Info verification failed.")
+                    return
+
+                # streamed upload is complete when the total size matches
+                if int(data.decode()) != self.datasize:
+                    self._send_packet(PROTOCOL_FAIL + b"File size mismatch.")
+                    return
+                self.filesize = self.datasize
+                self.file_stream.close()
+                os.system("sync & sync")
+                self._publish_bytes(self.datasize, self.filesize)
+
+                print("File transmission completed.")
+                self._send_packet(PROTOCOL_ACK)
+
+            elif command == PROTOCOL_DCHK:
+                if self.parallel_upload is not None and self.filename:
+                    # every range has to be acknowledged before the check
+                    if not self.parallel_upload.is_complete():
+                        self._send_packet(PROTOCOL_FAIL + b"File size mismatch.")
+                        return
+                    self.datasize = self.filesize
+                    self._close_parallel_upload()
+                    os.system("sync & sync")
+
+                if self.datasize != self.filesize:
+                    self._send_packet(PROTOCOL_FAIL + b"File size mismatch.")
+                    return
+                self._publish("phase", phase="verify")
+
+                package_path = os.path.join(self.save_directory, self.filename)
                 decrypt_output_directory = os.path.join(
                     self.save_directory, self.decrypted_name
                 )  # ~/catkin_ws/rundwn/mr1.0.0_241017_1823_80
+                if is_archive(package_path):
+                    if not self._extract_archive(
+                        package_path, decrypt_output_directory
+                    ):
+                        shutil.rmtree(self.save_directory, ignore_errors=True)
+                        self.is_data_verified = False
+                        return
+                else:
+                    # move bash script to save directory
+                    shutil.copy(
+                        os.path.join(self.script_directory, self.decrypt_script),
+                        self.save_directory,
+                    )
+
+                    # decrypt file
+                    self.excute_bash(
+                        f"cd {self.save_directory} && ./{self.decrypt_script} decrypt {self.filename} {get_package_password()}"
+                    )
+                # check if directory exists
                 if not os.path.exists(decrypt_output_directory):
                     self._send_packet(PROTOCOL_FAIL + b"File decryption failed.")
                     self.is_data_verified = False
+                # check signed manifest if the package has one
+                elif os.path.exists(
+                    os.path.join(decrypt_output_directory, MANIFEST_NAME)
+                ):
+                    self.is_data_verified = self._verify_manifest(
+                        decrypt_output_directory
+                    )
                 # check if file is valid
                 elif VERSION_IDENTIFIER not in self.log_string:
                     self._send_packet(PROTOCOL_FAIL + b"File is not valid.")
@@ -266,13 +917,14 @@ class RequestHandler(socketserver.BaseRequestHandler):
                 )  # ~/catkin_ws/mr1.0.0_241017_1823_80
                 shutil.rmtree(target_directory, ignore_errors=True)
                 shutil.move(decrypt_output_directory, target_directory)
+                self.install_target = target_directory
                 # clean up save directory
                 shutil.rmtree(self.save_directory, ignore_errors=True)
 
                 # copy bash script to install directory
                 try:
                     # run script in update new version
-                    decrypt_bash_directory = cwd.replace(
+                    decrypt_bash_directory = self.script_directory.replace(
                         "catkin_ws/src", f"catkin_ws/{self.decrypted_name}"
                     )
                     # ~/catkin_ws/mr1.0.0_241017_1823_80/integration/morow/morow/util/update
@@ -284,32 +936,146 @@ class RequestHandler(socketserver.BaseRequestHandler):
                 except Exception as e:
                     self.log_string += str(e)
                     shutil.copy(
-                        os.path.join(cwd, self.update_script),
+                        os.path.join(self.script_directory, self.update_script),
                         self.install_directory,
                     )
                 os.system("sync & sync")
 
                 print("File verification completed.")
                 self._send_packet(PROTOCOL_ACK)
+                self._publish("verified", filename=self.filename)
 
             elif command == PROTOCOL_BASH:
                 if not self.is_data_verified:
                     self._send_packet(PROTOCOL_FAIL + b"File is not valid.")
                     return
+                self.install_started = True
+                self._publish("phase", phase="install")
+
+                # python packages of MR updates are installed by the server,
+                # scripts without the hook and the build step install them
+                managed_install = (
+                    self.port == MR_UPDATE_PORT
+                    and self.server.managed_install
+                    and self._script_supports("MOROW_PIP_INSTALL")
+                    and self._script_supports('"$1" == "build"')
+                )
+                bash_env = "MOROW_PIP_INSTALL=server " if managed_install else ""
+
+                # config files are carried over by the server (config_carryover.py)
+                if (
+                    self.port == MR_UPDATE_PORT
+                    and self.server.config_carryover
+                    and self._script_supports("MOROW_CARRYOVER")
+                    and self._carry_over_config()
+                ):
+                    bash_env += "MOROW_CARRYOVER=server "
+
+                # the UI tree of FS updates is synced incrementally by the server,
+                # scripts without the FS_SYNC hook still do the full copy
+                fs_synced = False
+                if (
+                    self.port == FS_UPDATE_PORT
+                    and self.server.fs_sync
+                    and self._script_supports("FS_SYNC")
+                ):
+                    try:
+                        report = self._sync_fs_tree()
+                    except OSError as e:
+                        # FsSync.apply restored the live tree
+                        self.log_string += "\n\n====== fs sync ======\n\n" + str(e)
+                        self._send_packet(PROTOCOL_FAIL + b"UI sync failed.")
+                        return
+                    bash_env = "FS_SYNC=server " + (
+                        "" if report["catkin_changed"] else "FS_CATKIN_BUILD=no "
+                    )
+                    fs_synced = True
+
+                # the full copy carries robot-api's databases over, snapshot them
+                # before the UI is shut down. FsSync never touches them
+                # (FS_PRESERVED), synced trees have nothing to carry over
+                db_snapshot = None
+                if (
+                    self.port == FS_UPDATE_PORT
+                    and not fs_synced
+                    and self.server.db_carryover
+                    and self._script_supports("FS_DB_SNAPSHOT")
+                ):
+                    db_snapshot = self._snapshot_database()
+                    if db_snapshot is not None:
+                        bash_env += f"FS_DB_SNAPSHOT={db_snapshot} "
+
+                # MR updates are built next to the running version first to
+                # fill the compiler cache of the live build after the switch,
+                # the workspace is only replaced after that build succeeded
+                prewarm = None
+                if (
+                    self.port == MR_UPDATE_PORT
+                    and self.server.build_prewarm
+                    and BuildPrewarm.is_available()
+                ):
+                    prewarm = BuildPrewarm(
+                        os.path.join(self.install_directory, self.decrypted_name)
+                    )
+                    build_report = self._prewarm_build(prewarm)
+                    if build_report is None:
+                        # the verified package is not installed
+                        shutil.rmtree(self.install_target, ignore_errors=True)
+                        self.install_target = None
+                        return
+                    bash_env += (
+                        "MOROW_BUILD_CACHE=ccache "
+                        + format_environment(
+                            cache_environment(prewarm.cache_directory)
+                        )
+                        + " "
+                    )
+                    cache_stats = read_cache_stats(prewarm.cache_directory)
 
-                # configure bash script
-                bash_commands = [
-                    (
-                        f"cd {self.install_directory} && ./{self.update_script} update {self.decrypted_name} build",
-                        "Updating workspace...",
-                    ),
-                ]
+                # configure bash script, packages installed by the server go
+                # between the swap of the workspace and the catkin build
+                script = (
+                    f"cd {self.install_directory} && {bash_env}./{self.update_script}"
+                )
+                if managed_install:
+                    bash_commands = [
+                        (
+                            f"{script} update {self.decrypted_name} no",
+                            "Updating workspace...",
+                        ),
+                        (self._install_packages, "Installing packages..."),
+                        (f"{script} build", "Building workspace..."),
+                    ]
+                else:
+                    bash_commands = [
+                        (
+                            f"{script} update {self.decrypted_name} build",
+                            "Updating workspace...",
+                        ),
+                    ]
 
                 # run bash script
-                for command in bash_commands:
-                    self._send_packet(PROTOCOL_STEP + command[1].encode("utf-8"))
-                    # execute bash script
-                    self.excute_bash(command[0], show_progress=True)
+                started = time.monotonic()
+                for command, message in bash_commands:
+                    self._send_packet(PROTOCOL_STEP + message.encode("utf-8"))
+                    if callable(command):
+                        command()
+                    # execute bash script, the next steps need a swapped workspace
+                    elif self.excute_bash(command, show_progress=True) != 0:
+                        break
+                if db_snapshot is not None:
+                    shutil.rmtree(db_snapshot, ignore_errors=True)
+
+                build_result = b"Build completed."
+                if prewarm is not None:
+                    build_report += (
+                        f", live build {time.monotonic() - started:.1f}s, cache hit "
+                        + format_hit_rate(
+                            cache_stats, read_cache_stats(prewarm.cache_directory)
+                        )
+                    )
+                    self.log_string += "\n\n" + build_report
+                    build_result += f" ({build_report})".encode("utf-8")
 
                 build_error_count = 0
                 match = re.search(
@@ -320,9 +1086,16 @@ class RequestHandler(socketserver.BaseRequestHandler):
                     build_error_count = int(match.group(1))
 
                 if build_error_count > 0:
-                    self._send_packet(PROTOCOL_FAIL + b"Build failed.")
+                    build_result = b"Build failed."
+                    self._send_packet(PROTOCOL_FAIL + build_result)
                 else:
-                    self._send_packet(PROTOCOL_ACK + b"Build completed.")
+                    self._send_packet(PROTOCOL_ACK + build_result)
+                self._publish(
+                    "result",
+                    operation="update",
+                    success=build_error_count == 0,
+                    message=build_result.decode("utf-8"),
+                )
 
                 # sync
                 os.system("sync & sync")
@@ -341,6 +1114,8 @@ class RequestHandler(socketserver.BaseRequestHandler):
                 if not os.path.exists(log_directory):
                     self._send_packet(PROTOCOL_FAIL + b"Directory not found.")
                     return
+                self._publish("phase", phase="log_export", log_type=log_type)
+                exported_files = 0
                 # scan directory and send files
                 with os.scandir(log_directory) as entries:
                     for entry in entries:
@@ -363,71 +1138,497 @@ class RequestHandler(socketserver.BaseRequestHandler):
                             self._send_packet(
                                 PROTOCOL_STEP + entry.name.encode("utf-8")
                             )
+                            exported_files += 1
 
                 self._send_packet(PROTOCOL_ACK)
+                self._publish(
+                    "result",
+                    operation="log_export",
+                    success=True,
+                    message=f"{exported_files} files sent",
+                )
+
+            elif command == PROTOCOL_MFOL:
+                follow = json.loads(data.decode())
+                # check if directory exists
+                log_directory = get_log_directory(follow["type"])
+                if log_directory is None or not os.path.exists(log_directory):
+                    self._send_packet(PROTOCOL_FAIL + b"Directory not found.")
+                    return
+                if self.follow_thread is not None and self.follow_thread.is_alive():
+                    self._send_packet(PROTOCOL_FAIL + b"Already following.")
+                    return
+
+                # lines are pushed by the shared watcher of the directory
+                subscriber = self.server.log_watchers.subscribe(
+                    log_directory, follow.get("files")
+                )
+                self._send_packet(
+                    PROTOCOL_STEP + b"Following " + follow["type"].encode()
+                )
+                self._publish("phase", phase="log_follow", log_type=follow["type"])
+                self.follow_stop.clear()
+                self.follow_thread = threading.Thread(
+                    target=self._follow_log, args=(log_directory, subscriber)
+                )
+                self.follow_thread.daemon = True
+                self.follow_thread.start()
+
+            elif command == PROTOCOL_MSTP:
+                if self.follow_thread is None or not self.follow_thread.is_alive():
+                    self._send_packet(PROTOCOL_FAIL + b"Not following.")
+                    return
+                # the follow thread sends ACK when it is done
+                self.follow_stop.set()
+
+            elif command == PROTOCOL_MQRY:
+                query = LogQuery.loads(data.decode())
+                # check if directory exists
+                log_directory = get_log_directory(query.log_type)
+                if log_directory is None or not os.path.exists(log_directory):
+                    self._send_packet(PROTOCOL_FAIL + b"Directory not found.")
+                    return
+
+                self._publish("phase", phase="log_query", log_type=query.log_type)
+                # scan only the files overlapping the time window
+                selected, skipped = query.select_files(log_directory)
+                compressor = LogCompressor(query.compress)
+                matched_bytes = 0
+                for entry in selected:
+                    sent = False
+                    for batch in query.batches(entry.path):
+                        if not sent:
+                            # send file info (size is unknown)
+                            self._send_packet(
+                                PROTOCOL_MINF + f"{entry.name},-1".encode("utf-8")
+                            )
+                            sent = True
+                        matched_bytes += len(batch)
+                        self._send_packet(PROTOCOL_MDAT + compressor.compress(batch))
+                    if sent:
+                        # send progress(file name)
+                        self._send_packet(PROTOCOL_STEP + entry.name.encode("utf-8"))
+
+                summary = f"{len(selected)} scanned, {len(skipped)} skipped, {matched_bytes} bytes matched"
+                self._send_packet(PROTOCOL_ACK + summary.encode("utf-8"))
+                self._publish(
+                    "result", operation="log_query", success=True, message=summary
+                )
             else:
                 # unknown command
                 self._send_packet(PROTOCOL_FAIL)
 
+
+class MuxSender:
+    # weighted fair (deficit round robin) scheduler for multiplexed channels
+
+    def __init__(self, request, weights=None):
+        self.request = request
+        self.weights = weights or {}
+        self.queues = {}  # channel id -> deque of frames
+        self.deficits = {}  # channel id -> bytes allowed in this round
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set_weights(self, weights):
+        with self.condition:
+            self.weights.update(weights)
+
+    def send(self, channel, msg_bytes):
+        if not isinstance(msg_bytes, bytes):
+            msg_bytes = msg_bytes.encode("utf-8")
+
+        frame = pack_mux_frame(channel, msg_bytes)
+        with self.condition:
+            queue = self.queues.setdefault(channel, deque())
+            # block the channel worker while its queue is full (backpressure)
+            while len(queue) >= MUX_QUEUE_SIZE and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise ConnectionError("Multiplexed connection closed.")
+            queue.append(struct.pack(">I", len(frame)) + frame)
+            self.condition.notify_all()
+
+    def _next_round(self):
+        frames = []
+        for channel, queue in sorted(self.queues.items()):
+            if not queue:
+                self.deficits[channel] = 0
+                continue
+            self.deficits[channel] = self.deficits.get(
+                channel, 0
+            ) + MUX_QUANTUM * self.weights.get(channel, 1)
+            while queue and len(queue[0]) <= self.deficits[channel]:
+                frame = queue.popleft()
+                self.deficits[channel] -= len(frame)
+                frames.append(frame)
+        return frames
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not any(self.queues.values()):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                frames = self._next_round()
+                self.condition.notify_all()
+
+            try:
+                for frame in frames:
+                    self.request.sendall(frame)
+            except OSError:
+                self.close()
+                return
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class MuxChannel:
+    # one update session per channel, processed on its own worker thread
+
+    def __init__(self, session):
+        self.session = session
+        # bounded so a throttled or busy channel pushes back on the reader
+        self.messages = queue.Queue(MUX_QUEUE_SIZE)
+        self.busy = False  # processing a message
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            msg_bytes = self.messages.get()
+            if msg_bytes is None:
+                break
+            self.busy = True
+            try:
+                self.session.handle_message(msg_bytes)
+            except Exception as e:
+                print(e)
+            finally:
+                self.busy = False
+
+    def close(self):
+        self.messages.put(None)
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        # blocking reads and writes give up after frame_timeout,
+        # the wait for the next frame is bounded by _wait_packet
+        self.request.settimeout(self.server.frame_timeout)
+        set_keepalive(self.request, self.server.keepalive_idle)
+        # poll instead of select.select, which fails for fds above FD_SETSIZE
+        self.poller = select.poll()
+        self.poller.register(self.request, select.POLLIN)
+        self.last_activity = time.monotonic()
+        self.session = UpdateSession(
+            self.server,
+            self.client_address,
+            self.server.update_port,
+            self._send_packet,
+            self.request,
+        )
+        self.send_lock = threading.Lock()  # log follow sends from its own thread
+        self.mux_sender = None
+        self.mux_channels = {}  # channel id -> MuxChannel
+
+    def _start_mux(self, data):
+        self.mux_sender = MuxSender(self.request, parse_mux_weights(data.decode()))
+        self._send_packet(PROTOCOL_ACK)
+        print("Multiplexed mode started.")
+
+    def _get_mux_channel(self, channel):
+        if channel not in self.mux_channels:
+            mux_sender = self.mux_sender
+            session = UpdateSession(
+                self.server,
+                self.client_address,
+                MUX_CHANNEL_PORTS.get(channel, self.server.update_port),
+                lambda msg_bytes: mux_sender.send(channel, msg_bytes),
+                self.request,
+            )
+            self.mux_channels[channel] = MuxChannel(session)
+        return self.mux_channels[channel]
+
+    def process_mux_message(self, msg_bytes):
+        channel, msg_bytes = unpack_mux_frame(msg_bytes)
+        command, data = msg_bytes[:PROTOCOL_LENGTH], msg_bytes[PROTOCOL_LENGTH:]
+        if command == PROTOCOL_MUXW:
+            self.mux_sender.set_weights(parse_mux_weights(data.decode()))
+            return
+        self._get_mux_channel(channel).messages.put(msg_bytes)
+
+    def process_message(self, msg_bytes):
+        if self.mux_sender is not None:
+            self.process_mux_message(msg_bytes)
+        elif msg_bytes[:PROTOCOL_LENGTH] == PROTOCOL_MUXO:
+            # channels start worker threads, only for authenticated peers
+            if not self.session.is_auth_verified:
+                self._send_packet(PROTOCOL_FAIL + b"Authentication required.")
+                return
+            self._start_mux(msg_bytes[PROTOCOL_LENGTH:])
+        else:
+            self.session.handle_message(msg_bytes)
+
+    def _sessions(self):
+        return [self.session] + [
+            mux_channel.session for mux_channel in self.mux_channels.values()
+        ]
+
+    def _is_busy(self):
+        # a command still running on a channel or a log follow is not idle
+        return any(session.is_busy() for session in self._sessions()) or any(
+            mux_channel.busy or not mux_channel.messages.empty()
+            for mux_channel in self.mux_channels.values()
+        )
+
+    def _wait_packet(self):
+        # returns False when the session has to be reaped
+        while True:
+            if self.mux_sender is not None and self.mux_sender.closed:
+                return False
+            if any(session.is_auth_verified for session in self._sessions()):
+                timeout = self.server.idle_timeout
+            else:
+                timeout = self.server.auth_timeout
+            remaining = self.last_activity + timeout - time.monotonic()
+            if remaining <= 0:
+                if not self._is_busy():
+                    print(f"Session idle for {timeout}s, closing.")
+                    return False
+                self.last_activity = time.monotonic()
+                continue
+            if self.poller.poll(min(remaining, 1) * 1000):
+                return True
+
+    def _read_bytes(self, n):
+        # n 바이트 만큼의 데이터를 수신
+        data = bytearray()
+        while len(data) < n:
+            packet = self.request.recv(n - len(data))
+            if not packet:
+                return None
+            data.extend(packet)
+        return data
+
     def _read_packet(self):
-        def _read_bytes(n):
-            # n 바이트 만큼의 데이터를 수신
-            data = bytearray()
-            while len(data) < n:
-                packet = self.request.recv(n - len(data))
-                if not packet:
-                    return None
-                data.extend(packet)
-            return data
-
-        raw_msglen = _read_bytes(4)
+        raw_msglen = self._read_bytes(4)
         if not raw_msglen:
             return None
         msglen = struct.unpack(">I", raw_msglen)[0]
 
-        return _read_bytes(msglen)
+        # the command decides how large the frame may be
+        header_length = PROTOCOL_LENGTH
+        if self.mux_sender is not None:
+            header_length += MUX_HEADER_LENGTH
+        header = self._read_bytes(min(msglen, header_length))
+        if header is None:
+            return None
+        command = bytes(header[-PROTOCOL_LENGTH:])
+        limit = MAX_FRAME_SIZES.get(command, MAX_CONTROL_FRAME_SIZE)
+        if msglen - header_length + PROTOCOL_LENGTH > limit:
+            raise FrameTooLarge(
+                f"Frame too large. ({command.decode(errors='replace')}, {msglen} bytes)"
+            )
+
+        data = self._read_bytes(msglen - len(header))
+        if data is None:
+            return None
+        return header + data
 
     def _send_packet(self, msg_bytes):
         if not isinstance(msg_bytes, bytes):
             msg_bytes = msg_bytes.encode("utf-8")
 
         msglen_bytes = struct.pack(">I", len(msg_bytes))
-        self.request.sendall(msglen_bytes + msg_bytes)
+        with self.send_lock:
+            self.request.sendall(msglen_bytes + msg_bytes)
 
     def handle(self):
-        while True:
+        # every error ends the session, finish() cleans up its partial state
+        while self._wait_packet():
             try:
                 msg_bytes = self._read_packet()
                 if not msg_bytes:
                     break
                 # print("msg len: ", len(msg_bytes))
                 self.process_message(msg_bytes)
+                self.last_activity = time.monotonic()
+            except FrameTooLarge as e:
+                print(e)
+                self._try_send_packet(PROTOCOL_FAIL + str(e).encode("utf-8"))
+                break
             except socket.timeout as e:
                 print("timeout")
+                break
             except ConnectionResetError as e:
                 print("ConnectionResetError")
+                break
             except Exception as e:
                 print(e)
+                break
+
+    def _try_send_packet(self, msg_bytes):
+        try:
+            if self.mux_sender is not None:
+                self.mux_sender.send(MUX_CHANNEL_CTRL, msg_bytes)
+            else:
+                self._send_packet(msg_bytes)
+        except OSError:
+            pass
 
     def finish(self):
+        for mux_channel in self.mux_channels.values():
+            mux_channel.close()
+        if self.mux_sender is not None:
+            self.mux_sender.close()
         self.request.close()
-        self._cleanup()
+        self.session._cleanup()
+        for mux_channel in self.mux_channels.values():
+            mux_channel.session._cleanup()
+
+
+def set_keepalive(sock, idle):
+    # dead peers are detected while a session is legitimately silent
+    if not idle:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
 
 
 class UpdateServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
 
     allow_reuse_address = True
     daemon_threads = True
-
-    def __init__(self, ipaddress="localhost", port=MR_UPDATE_PORT):
+    request_queue_size = 64  # connection bursts are rejected, not dropped
+
+    def __init__(
+        self,
+        ipaddress="localhost",
+        port=MR_UPDATE_PORT,
+        max_upload_rate=0,
+        max_download_rate=0,
+        managed_install=True,
+        fs_sync=True,
+        db_carryover=True,
+        config_carryover=True,
+        build_prewarm=True,
+        update_port=None,
+        install_directory="~/catkin_ws/",
+        script_directory=cwd,
+        max_connections=MAX_CONNECTIONS,
+        auth_timeout=AUTH_TIMEOUT,
+        idle_timeout=IDLE_TIMEOUT,
+        frame_timeout=FRAME_TIMEOUT,
+        keepalive_idle=KEEPALIVE_IDLE,
+        event_socket=EVENT_SOCKET_PATH,
+    ):
+        # rate ceilings in bytes/sec (0 = unlimited)
+        self.max_upload_rate = max_upload_rate
+        self.max_download_rate = max_download_rate
+        # install python packages with package_installer instead of mr_update.sh
+        self.managed_install = managed_install
+        # sync only changed UI files instead of fs_update.sh replacing the tree
+        self.fs_sync = fs_sync
+        # snapshot robot-api's databases online when fs_update.sh copies them
+        self.db_carryover = db_carryover
+        # carry MR config files over with config_carryover instead of mr_update.sh
+        self.config_carryover = config_carryover
+        # prewarm ccache with a build of MR updates next to the running version
+        self.build_prewarm = build_prewarm
+        # MR_UPDATE_PORT or FS_UPDATE_PORT, when listening on another port
+        self.update_port = update_port or port
+        self.install_directory = install_directory
+        self.script_directory = script_directory  # install and decrypt scripts
+        # read once, packages are extracted with it by every session
+        self.umask = current_umask()
+        # connections above max_connections are rejected right away (0 = no cap)
+        self.max_connections = max_connections
+        self.connections = 0
+        self.connections_lock = threading.Lock()
+        self.auth_timeout = auth_timeout
+        self.idle_timeout = idle_timeout
+        self.frame_timeout = frame_timeout
+        self.keepalive_idle = keepalive_idle
+        sweep_staging(script_directory)
+        self.log_watchers = LogWatcherHub()
+        self.parallel_uploads = {}  # token -> ParallelUpload
+        self.parallel_uploads_lock = threading.Lock()
+        # structured session events for the backend, None: no event socket
+        self.events = EventHub()
+        self.event_socket = event_socket.format(port=port) if event_socket else None
+        self.event_server = None
         socketserver.TCPServer.__init__(self, (ipaddress, port), RequestHandler)
 
+    def register_upload(self, upload):
+        with self.parallel_uploads_lock:
+            self.parallel_uploads[upload.token] = upload
+
+    def unregister_upload(self, upload):
+        with self.parallel_uploads_lock:
+            self.parallel_uploads.pop(upload.token, None)
+
+    def find_upload(self, token):
+        with self.parallel_uploads_lock:
+            return self.parallel_uploads.get(token)
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            admitted = (
+                not self.max_connections or self.connections < self.max_connections
+            )
+            if admitted:
+                self.connections += 1
+        if admitted:
+            socketserver.ThreadingMixIn.process_request(self, request, client_address)
+            return
+
+        # answer on the accepting thread, no session is created
+        try:
+            request.settimeout(1)
+            msg_bytes = PROTOCOL_FAIL + b"Server busy."
+            request.sendall(struct.pack(">I", len(msg_bytes)) + msg_bytes)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+        print(f"Connection from {client_address[0]} rejected, server busy.")
+        self.events.publish("rejected", peer=f"{client_address[0]}:{client_address[1]}")
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(
+                self, request, client_address
+            )
+        finally:
+            with self.connections_lock:
+                self.connections -= 1
+
     def start(self, run_foreground=False):
         print(
             "Update Server started. ({0}:{1})".format(
                 self.server_address[0], self.server_address[1]
             )
         )
+        if self.event_socket:
+            try:
+                self.event_server = EventServer(self.events, self.event_socket)
+                self.event_server.start()
+            except OSError as e:
+                print(f"Event socket not available: {e}")
         if run_foreground:
             self.serve_forever()
         else:
@@ -438,16 +1639,92 @@ class UpdateServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     def stop(self):
         self.shutdown()
         self.server_close()
+        if self.event_server is not None:
+            self.event_server.stop()
         print("Update Server stopped.")
 
 
 def main(argv):
     parser = argparse.ArgumentParser(description="Update Server Client")
-    parser.add_argument("--ipaddress", type=str, default=get_ip_address())
+    parser.add_argument("--ipaddress", type=str, help="default: get_ip_address()")
     parser.add_argument("--port", type=int, default=FS_UPDATE_PORT)
+    parser.add_argument(
+        "--max-upload-rate", type=int, default=0, help="bytes/sec, 0 = unlimited"
+    )
+    parser.add_argument(
+        "--max-download-rate", type=int, default=0, help="bytes/sec, 0 = unlimited"
+    )
+    parser.add_argument(
+        "--no-managed-install",
+        action="store_true",
+        help="let mr_update.sh install python packages",
+    )
+    parser.add_argument(
+        "--no-fs-sync",
+        action="store_true",
+        help="let fs_update.sh replace the whole UI tree",
+    )
+    parser.add_argument(
+        "--no-db-carryover",
+        action="store_true",
+        help="let fs_update.sh copy the robot-api databases",
+    )
+    parser.add_argument(
+        "--no-config-carryover",
+        action="store_true",
+        help="let mr_update.sh copy the config files",
+    )
+    parser.add_argument(
+        "--no-build-prewarm",
+        action="store_true",
+        help="build MR updates only in the live workspace",
+    )
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument(
+        "--auth-timeout",
+        type=float,
+        default=AUTH_TIMEOUT,
+        help="seconds from connect to authentication",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help="seconds between frames",
+    )
+    parser.add_argument(
+        "--frame-timeout",
+        type=float,
+        default=FRAME_TIMEOUT,
+        help="seconds to receive the rest of a frame or to send one",
+    )
+    parser.add_argument(
+        "--event-socket",
+        type=str,
+        default=EVENT_SOCKET_PATH,
+        help="unix socket of the status events, {port} is replaced",
+    )
+    parser.add_argument(
+        "--no-events", action="store_true", help="do not open the event socket"
+    )
     opts = parser.parse_args(argv)
 
-    server = UpdateServer(ipaddress=opts.ipaddress, port=opts.port)
+    server = UpdateServer(
+        ipaddress=opts.ipaddress or get_ip_address(),
+        port=opts.port,
+        max_upload_rate=opts.max_upload_rate,
+        max_download_rate=opts.max_download_rate,
+        managed_install=not opts.no_managed_install,
+        fs_sync=not opts.no_fs_sync,
+        db_carryover=not opts.no_db_carryover,
+        config_carryover=not opts.no_config_carryover,
+        build_prewarm=not opts.no_build_prewarm,
+        max_connections=opts.max_connections,
+        auth_timeout=opts.auth_timeout,
+        idle_timeout=opts.idle_timeout,
+        frame_timeout=opts.frame_timeout,
+        event_socket=None if opts.no_events else opts.event_socket,
+    )
     server.start(run_foreground=True)
 
 
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+os.sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from update_client import UpdateClient
+from update_util import (
+    MAX_CHUNK_SIZE,
+    MR_UPDATE_PORT,
+    PROTOCOL_ACK,
+    PROTOCOL_DATA,
+    PROTOCOL_LENGTH,
+)
+
+SIMULATOR_PORT = MR_UPDATE_PORT + 10000
+
+# slow_reader: waits before every response, truncated: stops in the middle of a
+# DATA frame, disconnect: aborts in the middle of the upload, oversized: sends a
+# DATA frame with a huge length header, idle: connects and never sends anything
+FAULTS = ["slow_reader", "truncated", "disconnect", "oversized", "idle"]
+OVERSIZED_LENGTH = 0xFFFFFFF0
+PHASES = ["connect", "auth", "info", "upload", "check", "bash", "logs", "session"]
+
+STUB_DECRYPT_SCRIPT = """#!/bin/bash
+# stub of script.sh: nothing is decrypted, only the output directory is created
+if [ "$1" == "decrypt" ]; then
+    sleep {decrypt_time}
+    mkdir -p "${{2%.enc.tar.gz}}"
+    echo "software_version MR0.0.0"
+fi
+"""
+
+STUB_UPDATE_SCRIPT = """#!/bin/bash
+# stub of mr_update.sh: the workspace is not touched, only the build time is spent
+if [ "$1" == "update" ]; then
+    sleep {build_time}
+    rm -rf "$2"
+    echo "[build] Summary: All 1 packages succeeded!"
+fi
+"""
+
+
+def read_process_status(pid):
+    # (threads, rss bytes, cpu seconds) of a process
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.split()
+    with open(f"/proc/{pid}/stat") as f:
+        # the fields after the command name, utime and stime are 14 and 15
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return int(status["Threads"][0]), int(status["VmRSS"][0]) * 1024, cpu
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def parse_faults(text):
+    # "slow_reader=0.05,disconnect=0.1" -> {"slow_reader": 0.05, "disconnect": 0.1}
+    faults = {}
+    for item in filter(None, text.split(",")):
+        name, _, ratio = item.partition("=")
+        if name not in FAULTS:
+            raise ValueError(f"Unknown fault: {name}")
+        faults[name] = float(ratio or 0)
+    return faults
+
+
+def _run_server(server_options, quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    from update_server import UpdateServer
+
+    UpdateServer(**server_options).start(run_foreground=True)
+
+
+class SimulatedClient(UpdateClient):
+    # one MR update session sent from memory, optionally with a fault
+
+    def __init__(self, index, payload, fault=None, fault_delay=1.0, hold=10.0):
+        super().__init__()
+        self.filename = f"mr0.0.0_sim_{index:05d}.enc.tar.gz"
+        self.filesize = len(payload)
+        self.payload = payload
+        self.fault = fault
+        self.fault_delay = fault_delay
+        self.hold = hold  # seconds a faulty connection is kept open
+        self.fnLogDebug = self._log_debug
+        self.last_message = ""
+        self.timings = {}  # phase -> seconds
+        self.phase = ""
+
+    def _log_debug(self, msg):
+        self.last_message = msg
+
+    async def _read_packet(self):
+        if self.fault == "slow_reader":
+            await asyncio.sleep(self.fault_delay)
+        return await super()._read_packet()
+
+    async def _async_inject_fault(self, chunk):
+        if self.fault == "disconnect":
+            self.writer.transport.abort()
+            return
+        msg_bytes = PROTOCOL_DATA + chunk
+        if self.fault == "truncated":
+            # header of a full frame, half of its data
+            self.writer.write(
+                struct.pack(">I", len(msg_bytes)) + msg_bytes[: len(msg_bytes) // 2]
+            )
+        else:
+            self.writer.write(struct.pack(">I", OVERSIZED_LENGTH) + msg_bytes)
+        await self.writer.drain()
+        await asyncio.sleep(self.hold)
+
+    async def _async_send_payload(self):
+        # returns False when a fault ended the upload
+        middle = len(self.payload) // 2
+        for offset in range(0, len(self.payload), MAX_CHUNK_SIZE):
+            chunk = self.payload[offset : offset + MAX_CHUNK_SIZE]
+            if offset >= middle and self.fault in (
+                "truncated",
+                "disconnect",
+                "oversized",
+            ):
+                await self._async_inject_fault(chunk)
+                return False
+            await self._async_send_data(chunk)
+
+        response = await self._read_packet()
+        if response is None or response[:PROTOCOL_LENGTH] != PROTOCOL_ACK:
+            raise Exception("File data transmission failed.")
+        return True
+
+    async def _async_phase(self, name, coroutine):
+        self.phase = name
+        started = time.monotonic()
+        result = await coroutine
+        self.timings[name] = time.monotonic() - started
+        return result
+
+    async def async_run(self, host, port):
+        # returns "ok", "fault", "refused", "rejected" or "failed"
+        started = time.monotonic()
+        try:
+            connected = await self._async_phase(
+                "connect", self._async_connect(host, port)
+            )
+            if not connected:
+                return "refused"
+            if self.fault == "idle":
+                await asyncio.sleep(self.hold)
+                return "fault"
+            await self._async_phase("auth", self._async_authenticate())
+            await self._async_phase("info", self._async_send_info())
+            if not await self._async_phase("upload", self._async_send_payload()):
+                return "fault"
+            await self._async_phase("check", self._async_check_file())
+            await self._async_phase("bash", self._async_send_bash())
+            await self._async_phase("logs", self._async_send_logs())
+            return "ok"
+        except Exception as e:
+            self.last_message = str(e) or type(e).__name__
+            return "rejected" if self.phase == "connect" else "failed"
+        finally:
+            self.timings["session"] = time.monotonic() - started
+            if self.writer is not None:
+                self.writer.transport.abort()
+
+
+class UpdateSimulator:
+    # drives many simulated clients against an update server in a child process
+    # with stub decrypt and build scripts
+
+    def __init__(
+        self,
+        sessions=100,
+        concurrency=100,
+        payload_size=1024 * 1024,
+        faults=None,
+        fault_delay=1.0,
+        hold=10.0,
+        decrypt_time=0.2,
+        build_time=0.5,
+        session_timeout=60.0,
+        sample_interval=1.0,
+        port=SIMULATOR_PORT,
+        seed=0,
+        quiet=True,
+        server_options=None,
+    ):
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.payload_size = payload_size
+        self.faults = faults or {}  # fault -> ratio of the sessions
+        self.fault_delay = fault_delay
+        self.hold = hold
+        self.decrypt_time = decrypt_time
+        self.build_time = build_time
+        self.session_timeout = session_timeout
+        self.sample_interval = sample_interval
+        self.port = port
+        self.random = random.Random(seed)
+        self.quiet = quiet
+        self.server_options = server_options or {}  # extra UpdateServer arguments
+
+        self.sandbox = None
+        self.server_process = None
+        self.samples = []  # (seconds, threads, rss, cpu seconds, active sessions)
+        self.results = []  # (fault, outcome, timings, message)
+        self.active = 0
+
+    def _prepare_sandbox(self):
+        self.sandbox = tempfile.mkdtemp(prefix="update_simulator_")
+        script_directory = os.path.join(self.sandbox, "scripts")
+        os.makedirs(script_directory)
+        os.makedirs(os.path.join(self.sandbox, "catkin_ws"))
+        scripts = {
+            "script.sh": STUB_DECRYPT_SCRIPT.format(decrypt_time=self.decrypt_time),
+            "mr_update.sh": STUB_UPDATE_SCRIPT.format(build_time=self.build_time),
+        }
+        for name, content in scripts.items():
+            path = os.path.join(script_directory, name)
+            with open(path, "w") as f:
+                f.write(content)
+            os.chmod(path, 0o755)
+        return script_directory
+
+    def start_server(self):
+        script_directory = self._prepare_sandbox()
+        server_options = {
+            "ipaddress": "127.0.0.1",
+            "port": self.port,
+            "update_port": MR_UPDATE_PORT,
+            "install_directory": os.path.join(self.sandbox, "catkin_ws"),
+            "script_directory": script_directory,
+            "managed_install": False,
+            "fs_sync": False,
+            "build_prewarm": False,
+        }
+        server_options.update(self.server_options)
+        context = multiprocessing.get_context("spawn")
+        self.server_process = context.Process(
+            target=_run_server, args=(server_options, self.quiet)
+        )
+        self.server_process.daemon = True
+        self.server_process.start()
+
+        # wait until the server accepts connections
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("Update server did not start.")
+
+    def stop_server(self):
+        if self.server_process is not None:
+            self.server_process.terminate()
+            self.server_process.join(5)
+            self.server_process = None
+        if self.sandbox is not None:
+            shutil.rmtree(self.sandbox, ignore_errors=True)
+            self.sandbox = None
+
+    def _sample(self, started):
+        try:
+            threads, rss, cpu = read_process_status(self.server_process.pid)
+        except OSError:
+            # the server died
+            threads, rss, cpu = 0, 0, 0.0
+        self.samples.append(
+            (time.monotonic() - started, threads, rss, cpu, self.active)
+        )
+
+    async def _async_sampler(self, started, stop_event):
+        while not stop_event.is_set():
+            self._sample(started)
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _choose_fault(self):
+        value = self.random.random()
+        for fault, ratio in self.faults.items():
+            if value < ratio:
+                return fault
+            value -= ratio
+        return None
+
+    async def _async_session(self, index, payload, semaphore):
+        fault = self._choose_fault()
+        async with semaphore:
+            client = SimulatedClient(index, payload, fault, self.fault_delay, self.hold)
+            self.active += 1
+            try:
+                outcome = await asyncio.wait_for(
+                    client.async_run("127.0.0.1", self.port), self.session_timeout
+                )
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                client.last_message = f"no response in {client.phase}"
+            finally:
+                self.active -= 1
+        self.results.append((fault, outcome, client.timings, client.last_message))
+
+    async def _async_run(self):
+        payload = os.urandom(self.payload_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stop_event = asyncio.Event()
+        started = time.monotonic()
+        sampler = asyncio.ensure_future(self._async_sampler(started, stop_event))
+
+        await asyncio.gather(
+            *(
+                self._async_session(index, payload, semaphore)
+                for index in range(self.sessions)
+            )
+        )
+        elapsed = time.monotonic() - started
+
+        # threads and memory the server keeps after every client is gone
+        await asyncio.sleep(max(2.0, self.sample_interval * 2))
+        stop_event.set()
+        await sampler
+        self._sample(started)
+        return elapsed
+
+    def run(self):
+        self.start_server()
+        try:
+            self._sample(time.monotonic())
+            baseline = self.samples.pop()
+            elapsed = asyncio.run(self._async_run())
+            server_alive = self.server_process.is_alive()
+        finally:
+            self.stop_server()
+        return self.report(elapsed, baseline, server_alive)
+
+    def report(self, elapsed, baseline, server_alive):
+        outcomes = {}
+        for fault, outcome, _, _ in self.results:
+            counts = outcomes.setdefault(fault or "none", {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+        latencies = {}
+        for phase in PHASES:
+            values = [
+                timings[phase]
+                for fault, outcome, timings, _ in self.results
+                if outcome == "ok" and phase in timings
+            ]
+            if values:
+                latencies[phase] = {
+                    "p50": percentile(values, 50),
+                    "p90": percentile(values, 90),
+                    "p99": percentile(values, 99),
+                    "max": max(values),
+                }
+
+        completed = sum(1 for _, outcome, _, _ in self.results if outcome == "ok")
+        # "fault: message" -> count, of the sessions that did not end as planned
+        errors = {}
+        for fault, outcome, _, message in self.results:
+            if outcome not in ("ok", "fault"):
+                key = f"{fault or 'none'}: {message}"
+                errors[key] = errors.get(key, 0) + 1
+
+        final = self.samples[-1]
+        return {
+            "sessions": self.sessions,
+            "concurrency": self.concurrency,
+            "elapsed": elapsed,
+            "completed": completed,
+            "throughput": completed * self.payload_size / elapsed if elapsed else 0,
+            "outcomes": outcomes,
+            "errors": errors,
+            "latencies": latencies,
+            "samples": self.samples,
+            "peak_threads": max(sample[1] for sample in self.samples),
+            "peak_rss": max(sample[2] for sample in self.samples),
+            "leaked_threads": final[1] - baseline[1],
+            "leaked_rss": final[2] - baseline[2],
+            "server_alive": server_alive,
+        }
+
+
+def format_report(report):
+    mb = 1024 * 1024
+    lines = [
+        f"{report['sessions']} sessions, {report['concurrency']} concurrent, "
+        f"{report['elapsed']:.1f}s",
+        f"completed {report['completed']}, "
+        f"throughput {report['throughput'] / mb:.2f} MB/s",
+        "",
+        "outcomes:",
+    ]
+    for fault, counts in sorted(report["outcomes"].items()):
+        lines.append(
+            f"  {fault:12} "
+            + ", ".join(
+                f"{outcome} {count}" for outcome, count in sorted(counts.items())
+            )
+        )
+    if report["errors"]:
+        lines.append("errors:")
+        for message, count in sorted(report["errors"].items(), key=lambda e: -e[1]):
+            lines.append(f"  {count:5} {message}")
+
+    lines += ["", "latency (s)      p50      p90      p99      max"]
+    for phase, values in report["latencies"].items():
+        lines.append(
+            f"  {phase:10}"
+            + "".join(f"{values[key]:9.3f}" for key in ("p50", "p90", "p99", "max"))
+        )
+
+    lines += ["", "    time  threads   rss(MB)   cpu(s)  active"]
+    for seconds, threads, rss, cpu, active in report["samples"]:
+        lines.append(
+            f"  {seconds:6.1f} {threads:8} {rss / mb:9.1f} {cpu:8.1f} {active:7}"
+        )
+    lines += [
+        "",
+        f"peak threads {report['peak_threads']}, "
+        f"peak rss {report['peak_rss'] / mb:.1f} MB",
+        f"after drain: {report['leaked_threads']:+} threads, "
+        f"{report['leaked_rss'] / mb:+.1f} MB",
+        f"server {'alive' if report['server_alive'] else 'DIED'}",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Update Server Load Simulator")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--payload-size", type=int, default=1024 * 1024)
+    parser.add_argument(
+        "--faults",
+        type=str,
+        default="",
+        help="ratio of the sessions per fault, e.g. slow_reader=0.05,disconnect=0.1 "
+        f"({', '.join(FAULTS)})",
+    )
+    parser.add_argument("--fault-delay", type=float, default=1.0)
+    parser.add_argument("--hold", type=float, default=10.0)
+    parser.add_argument("--decrypt-time", type=float, default=0.2)
+    parser.add_argument("--build-time", type=float, default=0.5)
+    parser.add_argument("--session-timeout", type=float, default=60.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=SIMULATOR_PORT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show server output")
+    # limits of the simulated server
+    parser.add_argument("--max-connections", type=int)
+    parser.add_argument("--auth-timeout", type=float)
+    parser.add_argument("--idle-timeout", type=float)
+    parser.add_argument("--frame-timeout", type=float)
+    opts = parser.parse_args(argv)
+
+    server_options = {
+        name: getattr(opts, name)
+        for name in ("max_connections", "auth_timeout", "idle_timeout", "frame_timeout")
+        if getattr(opts, name) is not None
+    }
+
+    simulator = UpdateSimulator(
+        sessions=opts.sessions,
+        concurrency=opts.concurrency,
+        payload_size=opts.payload_size,
+        faults=parse_faults(opts.faults),
+        fault_delay=opts.fault_delay,
+        hold=opts.hold,
+        decrypt_time=opts.decrypt_time,
+        build_time=opts.build_time,
+        session_timeout=opts.session_timeout,
+        sample_interval=opts.sample_interval,
+        port=opts.port,
+        seed=opts.seed,
+        quiet=not opts.verbose,
+        server_options=server_options,
+    )
+    print(format_report(simulator.run()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import base64
+import struct
 
 PROTOCOL_LENGTH = 4
 
@@ -16,18 +17,53 @@ PROTOCOL_COMP = b"COMP"
 PROTOCOL_LOGS = b"LOGS"
 PROTOCOL_STEP = b"STEP"
 PROTOCOL_DCHK = b"DCHK"
+PROTOCOL_DEND = b"DEND"  # end of streamed data (total size)
+PROTOCOL_RATE = b"RATE"  # per session rate limits
+# parallel upload protocol
+PROTOCOL_PINF = b"PINF"  # file info, preallocate and return a token
+PROTOCOL_PJON = b"PJON"  # join an upload with its token
+PROTOCOL_PDAT = b"PDAT"  # offset(8) + data
+PROTOCOL_PEND = b"PEND"  # range done: offset,length
 # morrow log protocol
 PROTOCOL_MLOG = b"MLOG"
 PROTOCOL_MDAT = b"MDAT"
 PROTOCOL_MINF = b"MINF"
+PROTOCOL_MQRY = b"MQRY"  # filtered log query
+PROTOCOL_MFOL = b"MFOL"  # follow log files
+PROTOCOL_MSTP = b"MSTP"  # stop following
+# multiplexed protocol
+PROTOCOL_MUXO = b"MUXO"  # switch connection to multiplexed mode
+PROTOCOL_MUXW = b"MUXW"  # update channel weights
 
 
 MAX_BUFFER_SIZE = 1024
 MAX_CHUNK_SIZE = (1024 * 64) - 8  # packet header(4)+ protocol header(4)
+PARALLEL_OFFSET_SIZE = 8
+
+# largest frame the server accepts per command (protocol header included),
+# every other command is a control message
+MAX_CONTROL_FRAME_SIZE = 1024 * 16
+MAX_FRAME_SIZES = {
+    PROTOCOL_DATA: PROTOCOL_LENGTH + MAX_CHUNK_SIZE,
+    PROTOCOL_PDAT: PROTOCOL_LENGTH + MAX_CHUNK_SIZE,  # offset(8) is in the chunk
+}
 
 MR_UPDATE_PORT = 12341
 FS_UPDATE_PORT = 12342
 
+# multiplexed frame: packet header(4) + channel id(1) + protocol header(4) + data
+MUX_HEADER_LENGTH = 1
+MUX_CHANNEL_CTRL = 0  # log pulls, status
+MUX_CHANNEL_MR = 1
+MUX_CHANNEL_FS = 2
+MUX_CHANNEL_PORTS = {
+    MUX_CHANNEL_MR: MR_UPDATE_PORT,
+    MUX_CHANNEL_FS: FS_UPDATE_PORT,
+}
+MUX_QUANTUM = 1024 * 64  # bytes per round for a channel with weight 1
+MUX_QUEUE_SIZE = 8  # queued frames per channel
+MUX_MAX_WEIGHT = 8
+
 
 lookup_table = {
     "0": "r",
@@ -77,6 +113,32 @@ def decode_auth_token(encoded_data):
     return ip, int(port)
 
 
+def get_package_password():
+    return base64.b64decode("cm9ib2VeXjIxMDkwMQ==").decode("ascii")
+
+
+def pack_mux_frame(channel, msg_bytes):
+    return struct.pack(">B", channel) + msg_bytes
+
+
+def unpack_mux_frame(frame):
+    return frame[0], bytes(frame[MUX_HEADER_LENGTH:])
+
+
+def format_mux_weights(weights):
+    # {1: 4, 2: 1} -> "1:4,2:1"
+    return ",".join(f"{channel}:{weight}" for channel, weight in weights.items())
+
+
+def parse_mux_weights(text):
+    weights = {}
+    for item in text.split(","):
+        if ":" in item:
+            channel, weight = item.split(":")
+            weights[int(channel)] = max(1, int(weight))
+    return weights
+
+
 def get_ip_address():
     import socket
 